@@ -0,0 +1,229 @@
+"""
+Admission control for upstream LLM calls.
+
+Every `ask_llm_stream` call holds a slot for the whole stream. A slot is
+granted when all of these allow it:
+
+- global cap: at most LLM_MAX_CONCURRENCY streams per worker
+- per-user cap: at most LLM_MAX_PER_USER streams for the user in `llm_user`
+  (set per request by the endpoints, before any streaming task copies the
+  context; calls without a user only count against the global cap)
+- token bucket: LLM_RATE new streams per second, bursting to LLM_BURST
+  (LLM_RATE=0 disables it)
+
+Callers that can't start immediately wait in one bounded queue, served by
+priority class (router and hint first, background summaries last) and then
+arrival order. A waiter held back only by its user's cap doesn't block other
+users. When LLM_MAX_QUEUE callers are waiting, a new caller is rejected at
+once with `LLMOverloaded`, unless a lower-priority waiter can be rejected in
+its place; waiting longer than LLM_QUEUE_TIMEOUT is rejected the same way.
+
+Metrics: llm.in_flight and llm.queue_depth gauges, llm.queue_wait_ms (also
+per purpose), llm.rejected.<reason>.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from app import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))
+LLM_RATE = float(os.getenv("LLM_RATE", "0"))  # new streams per second; 0 = unlimited
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+
+# Lower runs first; unknown purposes get DEFAULT_PRIORITY
+PURPOSE_PRIORITIES = {
+    "router": 0,
+    "hint": 0,
+    "explain": 1,
+    "feedback": 1,
+    "conversation": 1,
+    "context_summary": 1,  # inline, the user is waiting on it
+    "summary": 2,  # background rolling summaries
+}
+DEFAULT_PRIORITY = 1
+
+# User the current request's LLM calls count against
+llm_user = ContextVar("llm_user", default=None)
+
+
+class LLMOverloaded(Exception):
+    """Raised instead of queueing when the LLM admission queue is full or the wait times out."""
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "user", "future", "enqueued")
+
+    def __init__(self, priority, seq, user, future):
+        self.priority = priority
+        self.seq = seq
+        self.user = user
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_per_user: int = LLM_MAX_PER_USER,
+                 rate: float = LLM_RATE, burst: int = LLM_BURST, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._per_user = {}
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._queue = []  # heap of _Waiter; rejected/cancelled ones are skipped lazily
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._timer = None
+
+    def _refill(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _can_start(self, user) -> bool:
+        if self.in_flight >= self.max_concurrency:
+            return False
+        if user is not None and self._per_user.get(user, 0) >= self.max_per_user:
+            return False
+        return self.rate <= 0 or self._tokens >= 1
+
+    def _start(self, user):
+        self.in_flight += 1
+        if user is not None:
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+        if self.rate > 0:
+            self._tokens -= 1
+        metrics.set_gauge("llm.in_flight", self.in_flight)
+
+    def _release(self, user):
+        self.in_flight -= 1
+        if user is not None:
+            count = self._per_user.get(user, 1) - 1
+            if count:
+                self._per_user[user] = count
+            else:
+                self._per_user.pop(user, None)
+        metrics.set_gauge("llm.in_flight", self.in_flight)
+        self._dispatch()
+
+    def _dispatch(self):
+        self._refill()
+        skipped = []
+        while self._queue and self.in_flight < self.max_concurrency:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            if not self._can_start(waiter.user):
+                if self.rate > 0 and self._tokens < 1:
+                    heapq.heappush(self._queue, waiter)
+                    self._schedule_refill()
+                    break
+                skipped.append(waiter)  # held back by its user's cap only
+                continue
+            self._start(waiter.user)
+            self._waiting -= 1
+            waiter.future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self._queue, waiter)
+        metrics.set_gauge("llm.queue_depth", self._waiting)
+
+    def _schedule_refill(self):
+        if self._timer is None:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_refill)
+
+    def _on_refill(self):
+        self._timer = None
+        self._dispatch()
+
+    def _reject(self, waiter, reason):
+        self._waiting -= 1
+        metrics.inc(f"llm.rejected.{reason}")
+        waiter.future.set_exception(LLMOverloaded(f"LLM queue {reason}"))
+
+    def _make_room(self, priority) -> bool:
+        # Reject the newest waiter of the lowest priority class, if it ranks below the newcomer
+        victims = [w for w in self._queue if not w.future.done() and w.priority > priority]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda w: (w.priority, w.seq))
+        self._reject(victim, "preempted")
+        return True
+
+    async def acquire(self, purpose: str = None, user=None):
+        priority = PURPOSE_PRIORITIES.get(purpose, DEFAULT_PRIORITY)
+        self._refill()
+        if self._waiting == 0 and self._can_start(user):
+            self._start(user)
+            metrics.observe("llm.queue_wait_ms", 0.0)
+            return
+        if self._waiting >= self.max_queue and not self._make_room(priority):
+            metrics.inc("llm.rejected.queue_full")
+            raise LLMOverloaded("LLM queue full")
+
+        waiter = _Waiter(priority, next(self._seq), user, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self._waiting += 1
+        metrics.set_gauge("llm.queue_depth", self._waiting)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                waiter.future.result()  # granted or rejected just as the timeout fired
+            else:
+                self._reject(waiter, "timeout")
+                waiter.future.exception()
+                raise LLMOverloaded("LLM queue timeout") from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self._release(user)  # granted, but the caller went away
+            elif not waiter.future.done():
+                waiter.future.cancel()
+                self._waiting -= 1
+                metrics.set_gauge("llm.queue_depth", self._waiting)
+            raise
+        wait_ms = (time.perf_counter() - waiter.enqueued) * 1000
+        metrics.observe("llm.queue_wait_ms", wait_ms)
+        if purpose:
+            metrics.observe(f"llm.queue_wait_ms.{purpose}", wait_ms)
+
+    def try_acquire(self, user=None) -> bool:
+        """Takes a slot only if one is free right now and nobody is queued; never waits."""
+        self._refill()
+        if self._waiting or not self._can_start(user):
+            return False
+        self._start(user)
+        return True
+
+    def release(self, user=None):
+        self._release(user)
+
+    @asynccontextmanager
+    async def slot(self, purpose: str = None, user=None):
+        await self.acquire(purpose, user)
+        try:
+            yield
+        finally:
+            self._release(user)
+
+
+admission = AdmissionController()
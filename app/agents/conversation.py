@@ -1,6 +1,8 @@
 from app.llm import ask_llm_stream
+from app.cache import cached_stream
+from app.prompts import PromptTemplate, Section
 
-CONVERSATION_PROMPT = """You are a friendly and helpful AI Python tutor name CodePlay AI. The user has said something that doesn't require a specific tool or explanation. Respond conversationally and briefly.
+CONVERSATION_PROMPT = PromptTemplate("conversation", """You are a friendly and helpful AI Python tutor name CodePlay AI. The user has said something that doesn't require a specific tool or explanation. Respond conversationally and briefly.
 
 Recent conversation:
 {conversation_history}
@@ -8,13 +10,16 @@ Recent conversation:
 User input: {user_input}
 
 Your response:
-"""
+""")
 
 async def generate_conversational_response(user_input: str, conversation_history: str):
     """Generates a simple conversational response."""
-    prompt = CONVERSATION_PROMPT.format(
-        user_input=user_input,
-        conversation_history=conversation_history
+    prompt = CONVERSATION_PROMPT.render(
+        user_input=Section(user_input, strategy="head", priority=1),
+        conversation_history=Section(conversation_history, strategy="turns", priority=0)
     )
-    async for token in ask_llm_stream(prompt):
+    async for token in cached_stream(
+        "conversation", user_input, None, conversation_history,
+        lambda: ask_llm_stream(prompt, purpose="conversation")
+    ):
         yield token
\ No newline at end of file
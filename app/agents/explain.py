@@ -1,20 +1,19 @@
 from app.llm import ask_llm_stream
+from app.cache import cached_stream
+from app.prompts import PromptTemplate, Section
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn.error")
 
-
-
-async def explain_lesson(user_question: str, topic: str = None, conversation_history: str = ""):
-    prompt = f"""
+EXPLAIN_PROMPT = PromptTemplate("explain", """
 You are a helpful and expert educational assistant named CodePlay AI for beginner and intermediate programmers learning Python.
 
 Conversation history:
 {conversation_history}
 
 User Question: {user_question}
-{"Topic: " + topic if topic else ""}
+{topic_line}
 
 Instructions:
 - Use the conversation history above to inform your answer if relevant.
@@ -28,6 +27,17 @@ Instructions:
 - Output must not contain any HTML or placeholder text.
 
 Now provide the most direct and concise answer to the user's question. If more detail might be helpful, suggest a follow-up question the user can ask.
-"""
-    async for token in ask_llm_stream(prompt.strip()):
+""")
+
+
+async def explain_lesson(user_question: str, topic: str = None, conversation_history: str = ""):
+    prompt = EXPLAIN_PROMPT.render(
+        conversation_history=Section(conversation_history, strategy="turns", priority=0),
+        user_question=Section(user_question, strategy="head", priority=2),
+        topic_line="Topic: " + topic if topic else "",
+    )
+    async for token in cached_stream(
+        "explain", user_question, topic, conversation_history,
+        lambda: ask_llm_stream(prompt.strip(), purpose="explain")
+    ):
         yield token
@@ -1,7 +1,7 @@
 from app.llm import ask_llm_stream
+from app.prompts import PromptTemplate, Section
 
-async def code_feedback(problem_title: str, problem_description: str, user_code: str, running_result: str = ""):
-    prompt = f"""
+FEEDBACK_PROMPT = PromptTemplate("feedback", """
 You are CodePlay AI, an expert Python tutor for beginner and intermediate programmers.
 
 Review the code below and provide clear, direct feedback.
@@ -35,8 +35,15 @@ Instructions:
 
 Now give **clear, concise, and actionable feedback**:
 
-"""
-    feedback = ""
-    async for token in ask_llm_stream(prompt.strip()):
-        feedback += token
-    yield feedback
\ No newline at end of file
+""")
+
+
+async def code_feedback(problem_title: str, problem_description: str, user_code: str, running_result: str = ""):
+    prompt = FEEDBACK_PROMPT.render(
+        problem_title=problem_title,
+        user_code=Section(user_code, strategy="middle", priority=3),
+        running_result=Section(running_result, strategy="tail", priority=2, min_tokens=200),
+        problem_description=Section(problem_description, strategy="head", priority=1),
+    )
+    async for token in ask_llm_stream(prompt.strip(), purpose="feedback"):
+        yield token
@@ -1,4 +1,5 @@
 from app.llm import ask_llm_stream
+from app.prompts import PromptTemplate, Section
 
 # --- Instructions when code execution IS allowed ---
 PROMPT_INSTRUCTIONS_CAN_RUN = """
@@ -61,6 +62,10 @@ You are an AI tutor helping a student with Python. Based on the context above, i
 ### Your Output:
 """
 
+# The instructions are static, so each variant is a template of its own
+HINT_PROMPT_CAN_RUN = PromptTemplate("hint", HINT_PROMPT_TEMPLATE.replace("{instructions}", PROMPT_INSTRUCTIONS_CAN_RUN))
+HINT_PROMPT_CANNOT_RUN = PromptTemplate("hint", HINT_PROMPT_TEMPLATE.replace("{instructions}", PROMPT_INSTRUCTIONS_CANNOT_RUN))
+
 async def generate_hint(
     user_question: str = "",
     problem_title: str = "",
@@ -84,22 +89,20 @@ async def generate_hint(
     # --- End of added debugging code ---
 
     # Select the correct set of instructions based on the is_done flag
-    if is_done:
-        instructions = PROMPT_INSTRUCTIONS_CANNOT_RUN
-    else:
-        instructions = PROMPT_INSTRUCTIONS_CAN_RUN
-    
-    prompt = HINT_PROMPT_TEMPLATE.format(
-        instructions=instructions,
-        user_question=user_question,
+    template = HINT_PROMPT_CANNOT_RUN if is_done else HINT_PROMPT_CAN_RUN
+
+    # Under the budget, the conversation goes first, then the test case and problem text;
+    # the question, code and the end of the run result are kept longest
+    prompt = template.render(
+        user_question=Section(user_question, strategy="head", priority=5),
         problem_title=problem_title,
-        problem_description=problem_description,
-        user_code=user_code,
-        conversation_history=conversation_history,
-        running_result=running_result,
-        testcase=testcase
+        user_code=Section(user_code, strategy="middle", priority=4),
+        running_result=Section(running_result, strategy="tail", priority=3, min_tokens=200),
+        problem_description=Section(problem_description, strategy="head", priority=2, min_tokens=200),
+        testcase=Section(testcase, strategy="head", priority=1),
+        conversation_history=Section(conversation_history, strategy="turns", priority=0),
     )
 
-    async for token in ask_llm_stream(prompt.strip()):
+    async for token in ask_llm_stream(prompt.strip(), purpose="hint"):
         print(token, end="", flush=True)
         yield token
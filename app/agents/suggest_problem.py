@@ -1,59 +1,55 @@
 import pinecone
-import openai
-import asyncpg
 import json
 import asyncio
 import re
 import os
+from collections import Counter
+from app.db import acquire
+from app.catalog import CatalogCache
+from app.embeddings import get_embedding_service
+from app.retrieval import RETRIEVAL_BACKEND, LOCAL_INDEX_PATH, LocalVectorIndex, PineconeBackend
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV", "us-east-1")
 PINECONE_INDEX = os.getenv("PINECONE_INDEX", "gami-ai")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-openai.api_key = OPENAI_API_KEY
-
-PG_CONN = {
-    "database": os.getenv("PGDATABASE", "gami-ai"),
-    "user": os.getenv("PGUSER", "thangbui"),
-    "password": os.getenv("PGPASSWORD", "password"),
-    "host": os.getenv("PGHOST", "localhost"),
-    "port": os.getenv("PGPORT", "5432")
-}
-
-# Initialize Pinecone
-pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(PINECONE_INDEX)
-
-def get_embedding(text):
-    response = openai.embeddings.create(
-        input=text,
-        model="text-embedding-ada-002"
-    )
-    return response.data[0].embedding
+
+# Initialize the retrieval backend; the local index needs no Pinecone access at all
+if RETRIEVAL_BACKEND == "local":
+    index = None
+    retriever = LocalVectorIndex.load(LOCAL_INDEX_PATH)
+    catalog = CatalogCache(None)
+    catalog.seed(retriever.metadata_by_id())
+else:
+    pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
+    index = pc.Index(PINECONE_INDEX)
+    retriever = PineconeBackend(index)
+    catalog = CatalogCache(index)
+
+async def get_embedding(text):
+    # Cached, micro-batched and non-blocking; see app/embeddings.py
+    return await get_embedding_service().embed(text)
 
 async def fetch_user_history(user_id):
     """
     Returns a set of completed problem and lesson IDs for the given user.
     """
-    conn = await asyncpg.connect(**PG_CONN)
-    # Fetch solved problems (status = 'Accepted')
-    solved_rows = await conn.fetch("""
-        SELECT DISTINCT problem_id
-        FROM submissions
-        WHERE user_id = $1 AND status = 'Accepted' AND problem_id IS NOT NULL
-    """, user_id)
-    solved_problems = {f"problem_{row['problem_id']}" for row in solved_rows if row['problem_id'] is not None}
+    async with acquire() as conn:
+        # Fetch solved problems (status = 'Accepted')
+        solved_rows = await conn.fetch("""
+            SELECT DISTINCT problem_id
+            FROM submissions
+            WHERE user_id = $1 AND status = 'Accepted' AND problem_id IS NOT NULL
+        """, user_id)
+
+        # Fetch completed lessons
+        lesson_rows = await conn.fetch("""
+            SELECT DISTINCT lesson_id
+            FROM lesson_progress
+            WHERE user_id = $1 AND completed = true AND lesson_id IS NOT NULL
+        """, user_id)
 
-    # Fetch completed lessons
-    lesson_rows = await conn.fetch("""
-        SELECT DISTINCT lesson_id
-        FROM lesson_progress
-        WHERE user_id = $1 AND completed = true AND lesson_id IS NOT NULL
-    """, user_id)
+    solved_problems = {f"problem_{row['problem_id']}" for row in solved_rows if row['problem_id'] is not None}
     completed_lessons = {f"lesson_{row['lesson_id']}" for row in lesson_rows if row['lesson_id'] is not None}
-
-    await conn.close()
     # Return a set of all completed item IDs (matching Pinecone IDs)
     return solved_problems.union(completed_lessons)
 
@@ -62,14 +58,16 @@ def extract_keywords(topic):
     keywords = [w for w in words if len(w) > 2]
     return keywords
 
-async def suggest_next(user_id: str, user_input: str, user_level: str = "beginner", extra: dict = None):
+async def suggest_next(user_id: str, user_input: str, user_level: str = "beginner", extra: dict = None, completed_ids: set = None):
     """
-    Suggest the next problem or lesson for a user using Pinecone.
+    Suggest the next problem or lesson for a user using the configured retrieval backend.
     Streams the result token by token, similar to generate_hint.
     Accepts extra context such as lessonId, problemId, or topic.
+    `completed_ids` may be passed in when the caller already prefetched the user's history.
     """
     item_type = determine_item_type(user_input)
-    completed_ids = await fetch_user_history(user_id)
+    if completed_ids is None:
+        completed_ids = await fetch_user_history(user_id)
     extra = extra or {}
 
     # Handle both lessonId and lesson_id
@@ -101,8 +99,11 @@ async def suggest_next(user_id: str, user_input: str, user_level: str = "beginne
     }
     difficulty_order = ["easy", "medium", "hard"]
 
-    # Infer current user difficulty
-    inferred = await infer_user_difficulty(completed_ids)
+    # Infer current user difficulty while the query embedding is computed
+    inferred, query_embedding = await asyncio.gather(
+        infer_user_difficulty(completed_ids),
+        get_embedding(prompt)
+    )
     try:
         idx = difficulty_order.index(inferred)
         # Suggest next level if possible, else same level
@@ -110,72 +111,47 @@ async def suggest_next(user_id: str, user_input: str, user_level: str = "beginne
     except ValueError:
         next_difficulty = "easy"
 
-    # Use next_difficulty in your filter
-    pinecone_filter = {
-        "type": {"$eq": item_type},
-        "difficulty": {"$eq": next_difficulty}
-    }
-    # if lesson_id:
-    #     pinecone_filter["id"] = {"$eq": item_type + str(lesson_id)}
-
-
-    query_embedding = get_embedding(prompt)
-    results = index.query(
-        vector=query_embedding,
+    # Completed items are excluded by the backend (before ranking for the local index)
+    matches = await retriever.query(
+        query_embedding,
         top_k=5,
-        include_metadata=True,
-        filter=pinecone_filter
+        item_type=item_type,
+        difficulty=next_difficulty,
+        exclude_ids=completed_ids
     )
-    # Find the first not-completed item
+    if not matches:
+        # Everything relevant is completed; fall back to the best match overall
+        matches = await retriever.query(
+            query_embedding,
+            top_k=5,
+            item_type=item_type,
+            difficulty=next_difficulty
+        )
     selected = None
-    for match in results["matches"]:
-        item_id = match["id"]
-        if item_id not in completed_ids:
-            try:
-                numeric_id = int(item_id.split("_")[1])
-                # Include the title from metadata if available
-                selected = {
-                    "id": numeric_id,
-                    "type": item_type,
-                    "title": match["metadata"].get("title", "")
-                }
-                break
-            except Exception:
-                continue
-    if not selected and results["matches"]:
-        item_id = results["matches"][0]["id"]
+    for match in matches:
         try:
-            numeric_id = int(item_id.split("_")[1])
+            numeric_id = int(match["id"].split("_")[1])
+            # Include the title from metadata if available
             selected = {
                 "id": numeric_id,
                 "type": item_type,
-                "title": results["matches"][0]["metadata"].get("title", "")
+                "title": match["metadata"].get("title", "")
             }
+            break
         except Exception:
-            selected = None
+            continue
 
-    # Stream the result as JSON, token by token
+    # The result is a single JSON document, so send it in one piece
     if selected:
-        text = json.dumps(selected)
+        yield json.dumps(selected)
     else:
-        text = "Sorry, no suitable problem or lesson found."
-    for token in text:
-        await asyncio.sleep(0)  # Yield control to event loop
-        yield token
+        yield "Sorry, no suitable problem or lesson found."
 
 async def infer_user_difficulty(completed_ids):
-    # Fetch metadata for completed items (you may need to batch this)
-    difficulties = []
-    for item_id in completed_ids:
-        try:
-            res = index.fetch(ids=[item_id])
-            meta = res['vectors'][item_id]['metadata']
-            if 'difficulty' in meta:
-                difficulties.append(meta['difficulty'])
-        except Exception:
-            continue
+    # Metadata comes from the local catalog cache; only uncached ids hit Pinecone, in batches
+    metadata = await catalog.get_many(completed_ids)
+    difficulties = [meta["difficulty"] for meta in metadata.values() if "difficulty" in meta]
     # Count and return the most common difficulty, or "easy" if none
-    from collections import Counter
     if difficulties:
         most_common = Counter(difficulties).most_common(1)[0][0]
         return most_common
@@ -0,0 +1,208 @@
+import os
+import pickle
+
+import numpy as np
+
+from app.agents.gamified_tuner import GamifiedTunerAgent
+
+# Comma-separated bins per state feature (performance, time_taken, engagement, difficulty, proficiency),
+# or a single number used for all of them
+TUNER_STATE_BINS = os.getenv("TUNER_STATE_BINS", "5")
+# GamifiedTunerAgent's default actions; transition logs store indices into this list
+TUNER_ACTIONS = ("increase_difficulty", "decrease_difficulty", "give_hint", "show_motivation")
+
+
+class StateEncoder:
+    """
+    Maps the tuner's continuous state onto a dense index. Each feature is
+    normalized to [0, 1] like `evaluate_logs` (clipped to its range) and cut
+    into equal-width bins; the bin numbers form a mixed-radix state index.
+    """
+
+    # (log key, default, low, high) in get_state order
+    FEATURES = (
+        ("performance", 0.0, 0.0, 1.0),
+        ("time_taken", 0.0, 0.0, 2.0),
+        ("engagement", 0.0, 0.0, 1.0),
+        ("difficulty", 1.0, 1.0, 5.0),
+        ("proficiency", 0.0, 0.0, 1.0),
+    )
+
+    def __init__(self, bins=TUNER_STATE_BINS):
+        if isinstance(bins, str):
+            bins = [int(b) for b in bins.split(",")]
+        elif isinstance(bins, int):
+            bins = [bins]
+        if len(bins) == 1:
+            bins = bins * len(self.FEATURES)
+        if len(bins) != len(self.FEATURES):
+            raise ValueError(f"Expected 1 or {len(self.FEATURES)} bin counts, got {len(bins)}")
+        self.bins = np.array(bins, dtype=np.int64)
+        self.low = np.array([f[2] for f in self.FEATURES])
+        self.high = np.array([f[3] for f in self.FEATURES])
+        self.n_states = int(np.prod(self.bins))
+        self._bins = [int(b) for b in bins]
+
+    def features(self, logs) -> list:
+        return [logs.get(key, default) for key, default, _, _ in self.FEATURES]
+
+    def encode_many(self, features) -> np.ndarray:
+        """Encodes an (n, 5) array of raw feature rows into n state indices."""
+        x = np.asarray(features, dtype=np.float64).reshape(-1, len(self.FEATURES))
+        x = np.nan_to_num(x, nan=0.0)
+        scaled = np.clip((x - self.low) / (self.high - self.low), 0.0, 1.0)
+        cells = np.minimum((scaled * self.bins).astype(np.int64), self.bins - 1)
+        return np.ravel_multi_index(cells.T, self.bins)
+
+    def encode(self, logs) -> int:
+        # Scalar path for single steps; NumPy call overhead dominates for one row
+        index = 0
+        for (key, default, low, high), bins in zip(self.FEATURES, self._bins):
+            value = logs.get(key, default)
+            scaled = 0.0 if value != value else min(max((value - low) / (high - low), 0.0), 1.0)
+            index = index * bins + min(int(scaled * bins), bins - 1)
+        return index
+
+
+def batch_update(q, states, actions, rewards, next_states, alpha, delta):
+    """
+    Applies a batch of Q-learning updates to `q` in place. Targets are computed
+    against the table before the batch; updates hitting the same (state, action)
+    pair are averaged into one, so the result doesn't depend on batch order.
+    """
+    n_actions = q.shape[1]
+    targets = rewards + delta * q[next_states].max(axis=1)
+    cells, inverse = np.unique(states * n_actions + actions, return_inverse=True)
+    mean_targets = np.bincount(inverse, weights=targets) / np.bincount(inverse)
+    flat = q.reshape(-1)
+    flat[cells] = (1 - alpha) * flat[cells] + alpha * mean_targets
+
+
+class VectorizedTunerAgent(GamifiedTunerAgent):
+    """
+    GamifiedTunerAgent with a bounded, dense Q-table: a (states x actions) NumPy
+    array over StateEncoder cells, plus per-state visit counts. `step_many`
+    chooses actions and applies updates for a whole batch of users at once.
+    """
+
+    def __init__(self, actions=None, alpha=0.1, gamma=0.9, delta=0.9, epsilon=1.0, epsilon_min=0.05,
+                 epsilon_decay=0.995, encoder: StateEncoder = None, filepath="q_table.npz", seed=None):
+        # Same hyperparameters as GamifiedTunerAgent; the storage is what differs
+        self.actions = actions or list(TUNER_ACTIONS)
+        self.alpha = alpha
+        self.gamma = gamma
+        self.delta = delta
+        self.epsilon = epsilon
+        self.epsilon_min = epsilon_min
+        self.epsilon_decay = epsilon_decay
+        self.encoder = encoder or StateEncoder()
+        self.filepath = filepath
+        self.q = np.zeros((self.encoder.n_states, len(self.actions)), dtype=np.float64)
+        self.visits = np.zeros(self.encoder.n_states, dtype=np.int64)
+        self._rng = np.random.default_rng(seed)
+
+        self.load_q_table()
+
+    def get_state(self, logs):
+        return self.encoder.encode(logs)
+
+    def choose_action(self, state):
+        # Epsilon-greedy; unvisited states explore, like missing keys in the dict table
+        if self._rng.random() < self.epsilon or self.visits[state] == 0:
+            action = self.actions[self._rng.integers(len(self.actions))]
+        else:
+            row = self.q[state].tolist()
+            action = self.actions[row.index(max(row))]
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+        return action
+
+    def update_q_table(self, state, action, reward, next_state):
+        a = self.actions.index(action)
+        next_max = max(self.q[next_state].tolist())
+        # Q(st,at) = rt + δ * max Q(st+1,a)
+        self.q[state, a] = (1 - self.alpha) * float(self.q[state, a]) + self.alpha * (reward + self.delta * next_max)
+        self.visits[state] += 1
+
+    def step(self, logs, user_action_metrics):
+        state = self.get_state(logs)
+        action = self.choose_action(state)
+        R = self.reward_optimization(user_action_metrics.get("gain", 1.0), user_action_metrics.get("cost", 0.1))
+        logs["engagement"] = self.engagement_dynamics(
+            logs.get("engagement", 0), R, user_action_metrics.get("disengagement", 0.05)
+        )
+        # The encoder clips engagement to its range for the next state; logs keep the raw E + R - D
+        self.update_q_table(state, action, R, self.get_state(logs))
+        return action, logs
+
+    def step_many(self, logs_list, metrics_list):
+        """
+        Batched `step` for many users. Actions are chosen against the current
+        table and updated with `batch_update`.
+        """
+        n = len(logs_list)
+        if n == 0:
+            return []
+        n_actions = len(self.actions)
+        features = np.array([self.encoder.features(logs) for logs in logs_list], dtype=np.float64)
+        states = self.encoder.encode_many(features)
+
+        # Each action in the batch sees the epsilon the sequential version would have used
+        epsilons = np.maximum(self.epsilon_min, self.epsilon * self.epsilon_decay ** np.arange(n))
+        self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay ** n)
+        explore = (self._rng.random(n) < epsilons) | (self.visits[states] == 0)
+        actions = np.where(explore, self._rng.integers(0, n_actions, n), np.argmax(self.q[states], axis=1))
+
+        gain = np.array([m.get("gain", 1.0) for m in metrics_list], dtype=np.float64)
+        cost = np.array([m.get("cost", 0.1) for m in metrics_list], dtype=np.float64)
+        disengagement = np.array([m.get("disengagement", 0.05) for m in metrics_list], dtype=np.float64)
+        rewards = self.reward_optimization(gain, cost)
+        features[:, 2] = self.engagement_dynamics(features[:, 2], rewards, disengagement)
+        next_states = self.encoder.encode_many(features)
+
+        batch_update(self.q, states, actions, rewards, next_states, self.alpha, self.delta)
+        np.add.at(self.visits, states, 1)
+
+        results = []
+        for logs, action, engagement in zip(logs_list, actions, features[:, 2]):
+            logs["engagement"] = float(engagement)
+            results.append((self.actions[action], logs))
+        return results
+
+    def save_q_table(self, filepath=None):
+        filepath = filepath or self.filepath
+        tmp = f"{filepath}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, q=self.q, visits=self.visits, bins=self.encoder.bins)
+        os.replace(tmp, filepath)
+
+    def load_q_table(self, filepath=None):
+        filepath = filepath or self.filepath
+        try:
+            with open(filepath, "rb") as f:
+                data = np.load(f)
+                if not np.array_equal(data["bins"], self.encoder.bins) or data["q"].shape != self.q.shape:
+                    print(f"Ignoring {filepath}: saved with different bins/actions", flush=True)
+                    return
+                self.q[:] = data["q"]
+                self.visits[:] = data["visits"]
+        except FileNotFoundError:
+            self.import_dict_table()
+
+    def import_dict_table(self, filepath="q_table.pkl"):
+        """Seeds the dense table from GamifiedTunerAgent's pickle, averaging states that share a cell."""
+        try:
+            with open(filepath, "rb") as f:
+                table = pickle.load(f)
+        except FileNotFoundError:
+            return
+        if not table:
+            return
+        keys = list(table)
+        states = self.encoder.encode_many([list(k) for k in keys])
+        values = np.array([[table[k].get(a, 0.0) for a in self.actions] for k in keys])
+        counts = np.bincount(states, minlength=self.encoder.n_states)
+        for a in range(len(self.actions)):
+            sums = np.bincount(states, weights=values[:, a], minlength=self.encoder.n_states)
+            self.q[:, a] = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        self.visits[:] = counts
+        print(f"Imported {len(keys)} states from {filepath} into {int((counts > 0).sum())} cells", flush=True)
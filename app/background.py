@@ -0,0 +1,33 @@
+"""
+Fire-and-forget background tasks that must not block the response stream.
+
+Tasks are tracked so they are not garbage-collected mid-flight and so the
+app lifespan can wait for them to finish at shutdown.
+"""
+import asyncio
+
+_tasks = set()
+
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+def _on_done(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_name()} failed: {task.exception()}", flush=True)
+
+
+async def drain(timeout: float = 10.0):
+    """Waits for pending background tasks, cancelling whatever is left after `timeout`."""
+    if not _tasks:
+        return
+    done, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
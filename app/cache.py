@@ -0,0 +1,252 @@
+"""
+Caching helpers.
+
+`TTLCache` is a small size-bounded LRU with per-entry expiry used across the app.
+`cached_stream` wraps an agent's token generator with a response cache keyed on
+the normalized question + topic, so repeated questions such as "what is a
+dictionary" or "thanks" skip the LLM entirely. Cached answers are replayed
+token by token through the same async generator interface.
+
+Backends:
+- memory: per-worker `TTLCache` (default)
+- redis: shared across uvicorn workers via RESPONSE_CACHE_REDIS_URL; size is bounded
+  by the server's maxmemory/eviction policy, entries expire with the TTL
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app import metrics
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | redis
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+# Answers depend on the conversation so far; only cache context-free questions unless told otherwise
+RESPONSE_CACHE_WITH_HISTORY = os.getenv("RESPONSE_CACHE_WITH_HISTORY", "false").lower() == "true"
+# Optional embedding-similarity lookup on exact-key misses
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_SEMANTIC_MAX = int(os.getenv("RESPONSE_CACHE_SEMANTIC_MAX", "1024"))
+
+
+class TTLCache:
+    """Size-bounded LRU mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_text(text: str) -> str:
+    text = (text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, tokens):
+        self._cache.set(key, tokens)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio as redis  # optional dependency
+
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key):
+        raw = await self._redis.get(f"respcache:{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key, tokens):
+        await self._redis.set(f"respcache:{key}", json.dumps(tokens), ex=int(self.ttl))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class SemanticIndex:
+    """Per-worker, bounded set of (embedding -> cache key) used for near-duplicate lookups."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._vectors = OrderedDict()  # (agent, key) -> normalized vector
+
+    def add(self, agent, key, vector):
+        self._vectors[(agent, key)] = vector
+        self._vectors.move_to_end((agent, key))
+        while len(self._vectors) > self.maxsize:
+            self._vectors.popitem(last=False)
+
+    def discard(self, agent, key):
+        self._vectors.pop((agent, key), None)
+
+    def nearest(self, agent, vector, threshold):
+        keys = [k for (a, k) in self._vectors if a == agent]
+        if not keys:
+            return None
+        matrix = np.stack([self._vectors[(agent, k)] for k in keys])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= threshold else None
+
+
+async def _embed(text: str):
+    from app.embeddings import get_embedding_service
+
+    vector = np.asarray(await get_embedding_service().embed(text), dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    def __init__(self, backend, semantic: bool = False):
+        self.backend = backend
+        self.semantic = SemanticIndex(RESPONSE_CACHE_SEMANTIC_MAX) if semantic else None
+
+    @staticmethod
+    def make_key(agent: str, question: str, topic: str = None) -> str:
+        raw = f"{agent}\x00{normalize_text(topic)}\x00{normalize_text(question)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def lookup(self, agent, question, topic):
+        key = self.make_key(agent, question, topic)
+        tokens = await self.backend.get(key)
+        if tokens is not None:
+            metrics.inc("response_cache.hit")
+            metrics.inc(f"response_cache.hit.{agent}")
+            return key, None, tokens
+
+        vector = None
+        if self.semantic is not None:
+            vector = await _embed(f"{normalize_text(topic)} {normalize_text(question)}".strip())
+            similar_key = self.semantic.nearest(agent, vector, RESPONSE_CACHE_SIMILARITY)
+            if similar_key:
+                tokens = await self.backend.get(similar_key)
+                if tokens is not None:
+                    metrics.inc("response_cache.hit")
+                    metrics.inc("response_cache.hit_semantic")
+                    metrics.inc(f"response_cache.hit.{agent}")
+                    return key, vector, tokens
+                self.semantic.discard(agent, similar_key)
+
+        metrics.inc("response_cache.miss")
+        metrics.inc(f"response_cache.miss.{agent}")
+        return key, vector, None
+
+    async def store(self, agent, key, vector, tokens):
+        await self.backend.set(key, tokens)
+        if self.semantic is not None and vector is not None:
+            self.semantic.add(agent, key, vector)
+        metrics.inc("response_cache.store")
+
+    async def close(self):
+        await self.backend.close()
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        if RESPONSE_CACHE_BACKEND == "redis":
+            backend = RedisBackend(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL)
+        else:
+            backend = MemoryBackend(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL)
+        _response_cache = ResponseCache(backend, semantic=RESPONSE_CACHE_SEMANTIC)
+    return _response_cache
+
+
+async def close_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        await _response_cache.close()
+        _response_cache = None
+
+
+async def cached_stream(agent: str, question: str, topic: str, conversation_history: str, generate):
+    """
+    Yields a cached answer for (agent, question, topic) if one exists, otherwise
+    streams `generate()` and stores the tokens once the answer has completed.
+    """
+    if not RESPONSE_CACHE_ENABLED or (conversation_history and not RESPONSE_CACHE_WITH_HISTORY):
+        async for token in generate():
+            yield token
+        return
+
+    cache = get_response_cache()
+    try:
+        key, vector, tokens = await cache.lookup(agent, question, topic)
+    except Exception as e:
+        print(f"Response cache lookup failed: {e}", flush=True)
+        key, vector, tokens = None, None, None
+
+    if tokens is not None:
+        for token in tokens:
+            yield token
+        return
+
+    tokens = []
+    async for token in generate():
+        tokens.append(token)
+        yield token
+
+    if key and tokens:
+        try:
+            await cache.store(agent, key, vector, tokens)
+        except Exception as e:
+            print(f"Response cache store failed: {e}", flush=True)
@@ -0,0 +1,123 @@
+"""
+Local cache of lesson/problem metadata (id -> difficulty/title/type).
+
+Catalog metadata is effectively static, so it is loaded from Pinecone once at
+startup (or seeded from the local vector index) and refreshed periodically;
+lookups such as `infer_user_difficulty` then run in memory. Ids that are not
+cached yet are fetched in batches off the event loop.
+"""
+import asyncio
+import itertools
+import os
+import time
+
+from app import metrics
+
+CATALOG_FETCH_BATCH = int(os.getenv("CATALOG_FETCH_BATCH", "100"))
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "3600"))
+CATALOG_WARM_ON_STARTUP = os.getenv("CATALOG_WARM_ON_STARTUP", "true").lower() == "true"
+
+METADATA_FIELDS = ("difficulty", "title", "type")
+
+
+def _vectors_of(response):
+    return response.vectors if hasattr(response, "vectors") else response["vectors"]
+
+
+def _metadata_of(vector):
+    meta = vector.metadata if hasattr(vector, "metadata") else vector.get("metadata")
+    return meta or {}
+
+
+class CatalogCache:
+    def __init__(self, index):
+        self.index = index
+        self._meta = {}  # id -> {difficulty, title, type}, or {} for ids missing from the index
+        self._refresh_task = None
+        self.loaded_at = None
+
+    def seed(self, metadata: dict):
+        """Fills the cache from metadata already in memory, e.g. the local vector index."""
+        for item_id, meta in metadata.items():
+            self._meta[item_id] = {k: meta[k] for k in METADATA_FIELDS if k in meta}
+        self.loaded_at = time.time()
+        metrics.set_gauge("catalog.size", len(self._meta))
+
+    def get(self, item_id):
+        return self._meta.get(item_id)
+
+    def __len__(self):
+        return len(self._meta)
+
+    def _fetch_batch(self, ids):
+        # Blocking Pinecone call; always run via asyncio.to_thread
+        vectors = _vectors_of(self.index.fetch(ids=list(ids)))
+        found = {}
+        for item_id in ids:
+            vector = vectors.get(item_id)
+            meta = _metadata_of(vector) if vector is not None else {}
+            found[item_id] = {k: meta[k] for k in METADATA_FIELDS if k in meta}
+        return found
+
+    async def load(self, ids):
+        """Fetches metadata for `ids` in parallel batches and stores it in the cache."""
+        ids = list(ids)
+        if self.index is None:
+            # Seeded-only cache (local backend): unknown ids have no metadata
+            self._meta.update({item_id: {} for item_id in ids})
+            return
+        batches = [ids[i:i + CATALOG_FETCH_BATCH] for i in range(0, len(ids), CATALOG_FETCH_BATCH)]
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._fetch_batch, batch) for batch in batches),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Catalog fetch failed: {result}", flush=True)
+                continue
+            self._meta.update(result)
+        metrics.set_gauge("catalog.size", len(self._meta))
+
+    async def get_many(self, ids) -> dict:
+        """Returns metadata for `ids`, fetching the ones not cached yet."""
+        missing = [item_id for item_id in ids if item_id not in self._meta]
+        metrics.inc("catalog.hit", len(ids) - len(missing))
+        if missing:
+            metrics.inc("catalog.miss", len(missing))
+            await self.load(missing)
+        return {item_id: self._meta.get(item_id) or {} for item_id in ids}
+
+    def _list_ids(self):
+        # index.list() pages through every id in the (serverless) index
+        return list(itertools.chain.from_iterable(self.index.list()))
+
+    async def warm(self):
+        start = time.perf_counter()
+        ids = await asyncio.to_thread(self._list_ids)
+        await self.load(ids)
+        self.loaded_at = time.time()
+        print(f"Catalog cache loaded {len(self._meta)} items in {time.perf_counter() - start:.1f}s", flush=True)
+
+    async def _refresh_forever(self, interval):
+        while True:
+            try:
+                await self.warm()
+            except Exception as e:
+                print(f"Catalog refresh failed: {e}", flush=True)
+            await asyncio.sleep(interval)
+
+    def start_refresh(self, interval: float = None):
+        """Warms the cache in the background and refreshes it every `interval` seconds."""
+        if self._refresh_task is None and self.index is not None:
+            self._refresh_task = asyncio.create_task(
+                self._refresh_forever(interval or CATALOG_REFRESH_SECONDS), name="catalog-refresh"
+            )
+
+    async def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
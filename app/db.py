@@ -1,5 +1,10 @@
 import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
 import asyncpg
+from app import metrics
 
 PGUSER = os.getenv("PGUSER", "thangbui")
 PGPASSWORD = os.getenv("PGPASSWORD", "password")
@@ -11,7 +16,82 @@ DATABASE_URL = os.getenv(
     f"postgres://{PGUSER}:{PGPASSWORD}@{PGHOST}:{PGPORT}/{PGDATABASE}"
 )
 
-async def save_ai_assistance(
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def init_db_pool():
+    """Creates the shared connection pool. Called once at app startup."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                dsn=DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            )
+            print(f"DB pool created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})", flush=True)
+    return _pool
+
+async def close_db_pool():
+    """Closes the shared connection pool. Called once at app shutdown."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+@asynccontextmanager
+async def acquire():
+    """
+    Borrows a connection from the shared pool, recording how long we waited for it.
+    The pool is created lazily so scripts can use the helpers without the app lifespan.
+    """
+    pool = _pool or await init_db_pool()
+    start = time.perf_counter()
+    async with pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT) as conn:
+        metrics.observe("db.pool_wait_ms", (time.perf_counter() - start) * 1000)
+        metrics.set_gauge("db.pool_size", pool.get_size())
+        metrics.set_gauge("db.pool_idle", pool.get_idle_size())
+        yield conn
+
+async def listen_forever(channel: str, on_notify, on_reconnect, name: str):
+    """
+    Keeps a dedicated LISTEN connection on `channel`, reconnecting with backoff.
+    `on_reconnect` runs after every disconnect, since notifications may have been missed.
+    """
+    delay = 1.0
+    while True:
+        closed = asyncio.Event()
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=DATABASE_URL)
+            conn.add_termination_listener(lambda _: closed.set())
+            await conn.add_listener(channel, on_notify)
+            print(f"{name} listening on {channel}", flush=True)
+            delay = 1.0
+            await closed.wait()
+        except asyncio.CancelledError:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+            raise
+        except Exception as e:
+            print(f"{name} listener error: {e}", flush=True)
+        on_reconnect()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60.0)
+
+AI_ASSISTANCE_COLUMNS = (
+    "user_id", "lesson_id", "problem_id", "session_id", "user_query", "ai_response", "suggestion_type", "date_time"
+)
+
+def ai_assistance_record(
     user_id=None,
     lesson_id=None,
     problem_id=None,
@@ -19,63 +99,160 @@ async def save_ai_assistance(
     user_query="",
     ai_response="",
     suggestion_type="",
+    date_time=None,
 ):
+    """Builds an ai_assistance row in AI_ASSISTANCE_COLUMNS order, or None if it isn't tied to a lesson/problem."""
     lesson_id = int(lesson_id) if lesson_id is not None else None
     user_id = int(user_id) if user_id is not None else None
     problem_id = int(problem_id) if problem_id is not None else None
     if lesson_id is None and problem_id is None:
+        return None
+    return (user_id, lesson_id, problem_id, session_id, user_query, ai_response, suggestion_type,
+            date_time or datetime.now(timezone.utc))
+
+async def save_ai_assistance(
+    user_id=None,
+    lesson_id=None,
+    problem_id=None,
+    session_id=None,
+    user_query="",
+    ai_response="",
+    suggestion_type="",
+):
+    """Writes one row immediately; the request path uses app.write_behind instead."""
+    record = ai_assistance_record(user_id, lesson_id, problem_id, session_id, user_query, ai_response, suggestion_type)
+    if record is None:
         return
-    conn = await asyncpg.connect(dsn=DATABASE_URL)
-    await conn.execute(
-        """
-        INSERT INTO ai_assistance (user_id, lesson_id, problem_id, session_id, user_query, ai_response, suggestion_type, date_time)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, NOW())
-        """,
-        user_id, lesson_id, problem_id, session_id, user_query, ai_response, suggestion_type
-    )
-    await conn.close()
+    await insert_ai_assistance_batch([record], method="executemany")
+
+async def insert_ai_assistance_batch(records, method: str = "copy"):
+    """Writes many ai_assistance rows in one round trip, with COPY or a batched INSERT."""
+    async with acquire() as conn:
+        if method == "copy":
+            await conn.copy_records_to_table("ai_assistance", records=records, columns=AI_ASSISTANCE_COLUMNS)
+        else:
+            await conn.executemany(
+                """
+                INSERT INTO ai_assistance (user_id, lesson_id, problem_id, session_id, user_query, ai_response, suggestion_type, date_time)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                """,
+                records
+            )
+
+# One query text per filter shape so each plan can use its index from migrations/003;
+# asyncpg prepares and caches them per connection (DB_STATEMENT_CACHE_SIZE).
+PREVIOUS_BY_SESSION = """
+    SELECT user_query, ai_response, date_time
+    FROM ai_assistance
+    WHERE session_id = $1
+    ORDER BY date_time DESC
+    LIMIT $2
+"""
+PREVIOUS_BY_USER_LESSON = """
+    SELECT user_query, ai_response, date_time
+    FROM ai_assistance
+    WHERE user_id = $1 AND lesson_id = $2
+    ORDER BY date_time DESC
+    LIMIT $3
+"""
+PREVIOUS_BY_USER_PROBLEM = """
+    SELECT user_query, ai_response, date_time
+    FROM ai_assistance
+    WHERE user_id = $1 AND problem_id = $2
+    ORDER BY date_time DESC
+    LIMIT $3
+"""
+# Two index scans, each already limited; rows matching both ids come only from the first branch
+PREVIOUS_BY_USER_LESSON_OR_PROBLEM = """
+    SELECT user_query, ai_response, date_time FROM (
+        (SELECT user_query, ai_response, date_time
+         FROM ai_assistance
+         WHERE user_id = $1 AND lesson_id = $2
+         ORDER BY date_time DESC
+         LIMIT $4)
+        UNION ALL
+        (SELECT user_query, ai_response, date_time
+         FROM ai_assistance
+         WHERE user_id = $1 AND problem_id = $3 AND lesson_id IS DISTINCT FROM $2
+         ORDER BY date_time DESC
+         LIMIT $4)
+    ) AS recent
+    ORDER BY date_time DESC
+    LIMIT $4
+"""
 
 async def fetch_previous_conversations(lesson_id: int, problem_id: int, session_id: str, user_id: int, limit: int = 5):
+    lesson_id = int(lesson_id) if lesson_id is not None else None
+    problem_id = int(problem_id) if problem_id is not None else None
     if session_id is not None:
+        query, params = PREVIOUS_BY_SESSION, (session_id, limit)
+    elif user_id is None:
+        return []
+    elif lesson_id is not None and problem_id is not None:
+        query, params = PREVIOUS_BY_USER_LESSON_OR_PROBLEM, (user_id, lesson_id, problem_id, limit)
+    elif lesson_id is not None:
+        query, params = PREVIOUS_BY_USER_LESSON, (user_id, lesson_id, limit)
+    elif problem_id is not None:
+        query, params = PREVIOUS_BY_USER_PROBLEM, (user_id, problem_id, limit)
+    else:
+        return []
+
+    async with acquire() as conn:
+        rows = await conn.fetch(query, *params)
+    return list(reversed(rows))
+
+async def fetch_session_turns_since(session_id: str, since=None, limit: int = 50):
+    """Returns the session's turns newer than `since` (all turns if None), oldest first."""
+    if since is None:
         query = """
-            SELECT user_query, ai_response
+            SELECT user_query, ai_response, date_time
             FROM ai_assistance
             WHERE session_id = $1
-            ORDER BY date_time DESC
+            ORDER BY date_time ASC
             LIMIT $2
         """
         params = (session_id, limit)
-    elif user_id is not None and (lesson_id is not None or problem_id is not None):
+    else:
         query = """
-            SELECT user_query, ai_response
+            SELECT user_query, ai_response, date_time
             FROM ai_assistance
-            WHERE user_id = $1
-            AND (
-                (lesson_id = $2 AND $2 IS NOT NULL)
-                OR
-                (problem_id = $3 AND $3 IS NOT NULL)
-            )
-            ORDER BY date_time DESC
-            LIMIT $4
+            WHERE session_id = $1 AND date_time > $2
+            ORDER BY date_time ASC
+            LIMIT $3
         """
-        params = (user_id, lesson_id, problem_id, limit)
-    else:
-        return []
+        params = (session_id, since, limit)
+    async with acquire() as conn:
+        return await conn.fetch(query, *params)
 
-    conn = await asyncpg.connect(dsn=DATABASE_URL)
-    rows = await conn.fetch(query, *params)
-    await conn.close()
-    return list(reversed(rows))
+async def get_conversation_summary(session_id: str):
+    async with acquire() as conn:
+        return await conn.fetchrow(
+            "SELECT summary, summarized_until, turn_count FROM conversation_summaries WHERE session_id=$1",
+            session_id
+        )
+
+async def upsert_conversation_summary(session_id: str, summary: str, summarized_until, turn_count: int):
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO conversation_summaries (session_id, summary, summarized_until, turn_count, updated_at)
+            VALUES ($1, $2, $3, $4, NOW())
+            ON CONFLICT (session_id) DO UPDATE
+            SET summary = EXCLUDED.summary,
+                summarized_until = EXCLUDED.summarized_until,
+                turn_count = EXCLUDED.turn_count,
+                updated_at = NOW()
+            """,
+            session_id, summary, summarized_until, turn_count
+        )
 
 async def get_solution_code(problem_id: int) -> str:
-    conn = await asyncpg.connect(dsn=DATABASE_URL)
-    row = await conn.fetchrow("SELECT solution_code FROM problems WHERE id=$1", problem_id)
-    await conn.close()
+    async with acquire() as conn:
+        row = await conn.fetchrow("SELECT solution_code FROM problems WHERE id=$1", problem_id)
     return row["solution_code"] if row else ""
 
 async def get_testcases(problem_id: int):
-    conn = await asyncpg.connect(dsn=DATABASE_URL)
-    rows = await conn.fetch("SELECT id, input FROM test_cases WHERE problem_id=$1", problem_id)
-    await conn.close()
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT id, input FROM test_cases WHERE problem_id=$1", problem_id)
     # Adapt this to your actual schema
-    return [{"input": row["input"], "id": row["id"]} for row in rows]
\ No newline at end of file
+    return [{"input": row["input"], "id": row["id"]} for row in rows]
@@ -0,0 +1,156 @@
+"""
+Async embedding service.
+
+- Results are cached in an LRU keyed on the exact text.
+- Requests arriving within EMBEDDING_BATCH_WINDOW_MS of each other are
+  coalesced into one batched provider call (micro-batching); identical texts
+  in flight share a single future.
+- Providers are pluggable: "openai" for production, "hash" for a deterministic
+  local embedder used in tests and benchmarks (no network).
+"""
+import asyncio
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from app import metrics
+from app.cache import TTLCache
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai | hash
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))  # used by the hash provider
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+
+
+class OpenAIEmbeddingProvider:
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        import openai
+
+        self.model = model
+        self._client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    async def embed(self, texts):
+        response = await self._client.embeddings.create(input=list(texts), model=self.model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def close(self):
+        await self._client.close()
+
+
+class HashEmbeddingProvider:
+    """Deterministic feature-hashing embedder over unigrams and bigrams."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed_one(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = re.findall(r"\w+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    async def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
+
+    async def close(self):
+        pass
+
+
+PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "hash": HashEmbeddingProvider,
+}
+
+
+class EmbeddingService:
+    def __init__(self, provider, cache_size: int = EMBEDDING_CACHE_SIZE,
+                 batch_window_ms: float = EMBEDDING_BATCH_WINDOW_MS, max_batch: int = EMBEDDING_MAX_BATCH):
+        self.provider = provider
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self._cache = TTLCache(maxsize=cache_size)
+        self._waiting = {}  # text -> future, for queued and in-flight texts
+        self._queue = []
+        self._timer = None
+        self._batches = set()
+
+    async def embed(self, text: str):
+        vector = self._cache.get(text)
+        if vector is not None:
+            metrics.inc("embeddings.cache_hit")
+            return vector
+        future = self._waiting.get(text)
+        if future is None:
+            metrics.inc("embeddings.cache_miss")
+            future = asyncio.get_running_loop().create_future()
+            # Retrieve the exception even if every waiter was cancelled
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._waiting[text] = future
+            self._queue.append(text)
+            if len(self._queue) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        else:
+            metrics.inc("embeddings.coalesced")
+        # Shielded so one cancelled caller doesn't fail the others waiting on the same text
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts):
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch), name="embedding-batch")
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        metrics.observe("embeddings.batch_size", len(batch))
+        try:
+            vectors = await self.provider.embed(batch)
+        except Exception as e:
+            for text in batch:
+                future = self._waiting.pop(text, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for text, vector in zip(batch, vectors):
+            self._cache.set(text, vector)
+            future = self._waiting.pop(text, None)
+            if future is not None and not future.done():
+                future.set_result(vector)
+
+    async def close(self):
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        await self.provider.close()
+
+
+_service = None
+
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        _service = EmbeddingService(PROVIDERS[EMBEDDING_PROVIDER]())
+    return _service
+
+
+async def close_embedding_service():
+    global _service
+    if _service is not None:
+        await _service.close()
+        _service = None
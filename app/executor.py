@@ -0,0 +1,274 @@
+"""
+Client for the code execution service.
+
+Jobs are submitted with a shared HTTP client, and a per-worker semaphore caps
+in-flight executions (EXEC_MAX_CONCURRENCY). Completion is awaited using
+EXEC_RESULT_MODE:
+
+- "poll":     adaptive exponential backoff polling of /result*/{job_id}
+- "longpoll": the same loop, but asking the service to hold each GET
+              (`?wait=<seconds>`) until the job finishes
+- "sse":      one streaming GET on /result*/{job_id}/stream
+- "webhook":  the service POSTs the result (with its job_id) to the
+              callbackUrl sent with the job, /api/ai/exec-callback; callbacks
+              can land on another worker, so after EXEC_CALLBACK_WAIT seconds
+              we fall back to polling
+
+Any failure of the push-based modes falls back to backoff polling.
+
+Finished problem runs are memoized per worker, keyed on the code (line endings
+normalized), the problem and a hash of its solution/test cases, so re-running
+unchanged code skips the service; identical submissions in flight share one
+job. Free-form "code" runs are never memoized: their output may depend on
+`random`, the clock or input.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+
+import httpx
+
+from app import metrics
+from app.cache import TTLCache
+
+EXEC_API_BASE = os.getenv("EXEC_API_BASE", "http://localhost:8001")  # Change to your exec service base URL
+EXEC_RESULT_MODE = os.getenv("EXEC_RESULT_MODE", "poll")  # poll | longpoll | sse | webhook
+EXEC_MAX_CONCURRENCY = int(os.getenv("EXEC_MAX_CONCURRENCY", "8"))
+EXEC_TIMEOUT = float(os.getenv("EXEC_TIMEOUT", "15"))
+EXEC_POLL_INITIAL_MS = float(os.getenv("EXEC_POLL_INITIAL_MS", "50"))
+EXEC_POLL_MAX_MS = float(os.getenv("EXEC_POLL_MAX_MS", "1000"))
+EXEC_POLL_FACTOR = float(os.getenv("EXEC_POLL_FACTOR", "2"))
+EXEC_LONGPOLL_SECONDS = float(os.getenv("EXEC_LONGPOLL_SECONDS", "10"))
+# Public base URL of this service, used to build webhook callback URLs
+EXEC_CALLBACK_BASE = os.getenv("EXEC_CALLBACK_BASE", "http://localhost:4000")
+EXEC_CALLBACK_SECRET = os.getenv("EXEC_CALLBACK_SECRET", "")
+if EXEC_RESULT_MODE == "webhook" and not EXEC_CALLBACK_SECRET:
+    print("EXEC_RESULT_MODE=webhook needs EXEC_CALLBACK_SECRET; polling instead", flush=True)
+    EXEC_RESULT_MODE = "poll"
+EXEC_CALLBACK_WAIT = float(os.getenv("EXEC_CALLBACK_WAIT", "5"))
+EXEC_RESULT_CACHE_ENABLED = os.getenv("EXEC_RESULT_CACHE_ENABLED", "true").lower() == "true"
+EXEC_RESULT_CACHE_SIZE = int(os.getenv("EXEC_RESULT_CACHE_SIZE", "2048"))
+EXEC_RESULT_CACHE_TTL = float(os.getenv("EXEC_RESULT_CACHE_TTL", "600"))
+
+TIMEOUT_MESSAGE = "Error: Code execution timed out."
+
+# Job kinds whose results are reused; "code" runs arbitrary programs whose output can vary between runs
+MEMOIZED_KINDS = ("problem",)
+
+# (submit path, result path prefix) per job kind
+ENDPOINTS = {
+    "problem": ("/execute-problem", "/result-problem"),
+    "code": ("/execute", "/result"),
+}
+
+_client = None
+_semaphore = None
+_callbacks = {}  # job_id -> future resolved by the webhook endpoint
+_early_callbacks = {}  # results that arrived before the submitter registered
+_results = TTLCache(maxsize=EXEC_RESULT_CACHE_SIZE, ttl=EXEC_RESULT_CACHE_TTL)
+_inflight = {}  # result key -> task, so identical concurrent submissions share one job
+
+
+def get_exec_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=EXEC_API_BASE,
+            timeout=httpx.Timeout(10.0, read=EXEC_LONGPOLL_SECONDS + 5),
+            limits=httpx.Limits(max_connections=EXEC_MAX_CONCURRENCY * 2),
+        )
+    return _client
+
+
+async def close_exec_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(EXEC_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def callback_authorized(secret: str) -> bool:
+    """Checks a webhook's secret header; callbacks are refused when no secret is configured."""
+    return bool(EXEC_CALLBACK_SECRET) and hmac.compare_digest((secret or "").encode(), EXEC_CALLBACK_SECRET.encode())
+
+
+def _is_done(result: dict) -> bool:
+    return result.get("status") in ("finished", "failed")
+
+
+def format_result(kind: str, result: dict) -> str:
+    if result.get("status") == "failed":
+        return f"Error: {result.get('error', 'Job failed')}"
+    if kind == "problem":
+        return json.dumps(result["results"], ensure_ascii=False)
+    return result.get("output", "")
+
+
+def resolve_callback(job_id: str, result: dict):
+    """Called by the webhook endpoint when the exec service reports a finished job."""
+    future = _callbacks.pop(job_id, None)
+    if future is not None and not future.done():
+        future.set_result(result)
+    else:
+        _early_callbacks[job_id] = result
+        # Bound the map; results for jobs owned by other workers are never claimed here
+        while len(_early_callbacks) > 1000:
+            _early_callbacks.pop(next(iter(_early_callbacks)))
+
+
+async def _poll(client, result_path, job_id, deadline, wait=None):
+    delay = EXEC_POLL_INITIAL_MS / 1000
+    params = {"wait": wait} if wait else None
+    polls = 0
+    while time.monotonic() < deadline:
+        response = await client.get(f"{result_path}/{job_id}", params=params)
+        polls += 1
+        result = response.json()
+        if _is_done(result):
+            metrics.observe("exec.polls", polls)
+            return result
+        remaining = deadline - time.monotonic()
+        await asyncio.sleep(max(0.0, min(delay, remaining)))
+        delay = min(delay * EXEC_POLL_FACTOR, EXEC_POLL_MAX_MS / 1000)
+    metrics.observe("exec.polls", polls)
+    return None
+
+
+async def _wait_sse(client, result_path, job_id, deadline):
+    timeout = max(0.1, deadline - time.monotonic())
+    async with client.stream("GET", f"{result_path}/{job_id}/stream", timeout=timeout) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                result = json.loads(line[len("data: "):])
+                if _is_done(result):
+                    return result
+    return None
+
+
+async def _wait_webhook(job_id, future, deadline):
+    try:
+        return await asyncio.wait_for(future, timeout=min(EXEC_CALLBACK_WAIT, max(0.0, deadline - time.monotonic())))
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        _callbacks.pop(job_id, None)
+
+
+async def wait_for_result(kind: str, job_id: str, deadline: float, mode: str = None, callback=None):
+    client = get_exec_client()
+    _, result_path = ENDPOINTS[kind]
+    mode = mode or EXEC_RESULT_MODE
+    result = None
+    try:
+        if mode == "sse":
+            result = await _wait_sse(client, result_path, job_id, deadline)
+        elif mode == "webhook" and callback is not None:
+            result = await _wait_webhook(job_id, callback, deadline)
+        elif mode == "longpoll":
+            return await _poll(client, result_path, job_id, deadline, wait=EXEC_LONGPOLL_SECONDS)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Exec {mode} wait failed for {job_id}, falling back to polling: {e}", flush=True)
+        metrics.inc(f"exec.fallback.{mode}")
+    if result is not None:
+        return result
+    return await _poll(client, result_path, job_id, deadline)
+
+
+def normalize_code(code: str) -> str:
+    """Normalizes line endings only; any other whitespace can matter (string literals, continuations)."""
+    return (code or "").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def testcase_version(solution_code: str, testcases) -> str:
+    raw = json.dumps([solution_code or "", testcases], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def result_key(kind: str, payload: dict, problem_id=None) -> str:
+    if kind == "problem":
+        code = payload.get("userCode", "")
+        version = testcase_version(payload.get("solutionCode"), payload.get("testCases"))
+    else:
+        code = payload.get("code", "")
+        version = ""
+    raw = f"{kind}\x00{problem_id or ''}\x00{version}\x00{normalize_code(code)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _run(kind: str, payload: dict, mode: str):
+    """Submits a job and returns its raw result, or None on timeout."""
+    submit_path, _ = ENDPOINTS[kind]
+    semaphore = _get_semaphore()
+    queued_at = time.perf_counter()
+    async with semaphore:
+        start = time.perf_counter()
+        metrics.observe("exec.queue_ms", (start - queued_at) * 1000)
+        deadline = time.monotonic() + EXEC_TIMEOUT
+        client = get_exec_client()
+        if mode == "webhook":
+            headers = {"X-Exec-Callback-Secret": EXEC_CALLBACK_SECRET}
+            payload = dict(payload, callbackUrl=f"{EXEC_CALLBACK_BASE}/api/ai/exec-callback", callbackHeaders=headers)
+        resp = await client.post(submit_path, json=payload)
+        resp.raise_for_status()
+        job_id = str(resp.json().get("job_id"))
+
+        callback = None
+        if mode == "webhook":
+            early = _early_callbacks.pop(job_id, None)
+            callback = asyncio.get_running_loop().create_future()
+            if early is not None:
+                callback.set_result(early)
+            else:
+                _callbacks[job_id] = callback
+
+        result = await wait_for_result(kind, job_id, deadline, mode=mode, callback=callback)
+        metrics.observe(f"exec.{mode}_ms", (time.perf_counter() - start) * 1000)
+    return result
+
+
+async def _run_and_cache(kind: str, payload: dict, mode: str, key: str):
+    result = await _run(kind, payload, mode)
+    # Only finished jobs are reusable; timeouts and service failures are retried next time
+    if result is not None and result.get("status") == "finished":
+        _results.set(key, result)
+    return result
+
+
+async def run_job(kind: str, payload: dict, mode: str = None, problem_id=None) -> str:
+    """Submits a job and returns its formatted result, bounded by the concurrency cap."""
+    mode = mode or EXEC_RESULT_MODE
+    if mode == "webhook" and not EXEC_CALLBACK_SECRET:
+        mode = "poll"  # the callback endpoint refuses unauthenticated results
+    if not EXEC_RESULT_CACHE_ENABLED or kind not in MEMOIZED_KINDS:
+        result = await _run(kind, payload, mode)
+    else:
+        key = result_key(kind, payload, problem_id)
+        result = _results.get(key)
+        if result is not None:
+            metrics.inc("exec.cache_hit")
+        else:
+            task = _inflight.get(key)
+            if task is None:
+                metrics.inc("exec.cache_miss")
+                task = asyncio.create_task(_run_and_cache(kind, payload, mode, key))
+                _inflight[key] = task
+                task.add_done_callback(lambda t: _inflight.pop(key, None) and (t.cancelled() or t.exception()))
+            else:
+                metrics.inc("exec.coalesced")
+            # Shielded so one disconnecting student doesn't cancel the job for the others
+            result = await asyncio.shield(task)
+    if result is None:
+        metrics.inc("exec.timeout")
+        return TIMEOUT_MESSAGE
+    return format_result(kind, result)
@@ -0,0 +1,124 @@
+"""
+Local fast-path intent classifier for the orchestrator.
+
+High-confidence inputs are routed here without an LLM round-trip; anything
+below ROUTER_CONFIDENCE_THRESHOLD falls back to the LLM router prompt.
+Two stages are tried in order:
+
+1. Keyword/regex rules, in the spirit of `determine_item_type`.
+2. An optional bag-of-words softmax model trained offline with
+   `scripts/train_intent_model.py` and loaded at startup.
+"""
+import json
+import math
+import os
+import re
+from dataclasses import dataclass
+
+AGENTS = ("explain", "hint", "suggest_problem", "conversation")
+
+LOCAL_ROUTER_ENABLED = os.getenv("LOCAL_ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.85"))
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+
+
+@dataclass
+class IntentDecision:
+    agent: str
+    confidence: float
+    source: str  # "rules" or "model"
+
+
+# (agent, confidence, pattern). The first matching rule wins, so order matters.
+_RULES = [
+    ("conversation", 0.95, re.compile(
+        r"^(hi|hello|hey|yo|thanks|thank you|thx|ok|okay|got it|cool|nice|great|bye|goodbye|"
+        r"good (morning|afternoon|evening))( there)?( codeplay)?[\s!.?]*$")),
+    ("suggest_problem", 0.92, re.compile(
+        r"(what'?s next|what is next|what should i do (now|next)|^continue[\s!.]*$|"
+        r"\b(another|next|new|related) (problem|lesson|challenge|exercise|task)\b|"
+        r"\bi want to (practice|learn) more\b|\bgive me (a|an|another) (related )?(problem|lesson|challenge|exercise)\b)")),
+    ("hint", 0.9, re.compile(
+        r"(\b(run|test|execute|debug)\b.*\b(my )?code\b|^(run|test|execute|debug)( it| this)?[\s!.]*$|"
+        r"\bfix (this|my code|it)\b|\bwhy (is|does|doesn'?t|isn'?t) my code\b|"
+        r"\bmy code\b.*\b(wrong|error|fail|not work)|\b(wrong|error)\b.*\bmy code\b|"
+        r"\b(give me|need|want) a hint\b)")),
+    ("explain", 0.88, re.compile(
+        r"^(what (is|are|does)|explain|how (do|can) i|how to|what'?s the syntax|"
+        r"what is the difference|when should i use)\b")),
+]
+
+# Rules for hint only make sense when the user is working on a problem
+_PROBLEM_ONLY = {"hint"}
+
+_model = None
+
+
+def load_intent_model(path: str = None):
+    """Loads the trained linear model if present. Called once at app startup."""
+    global _model
+    path = path or INTENT_MODEL_PATH
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        print(f"Intent model not found at {path}, using rules only", flush=True)
+        return None
+    _model = {
+        "labels": data["labels"],
+        "bias": data["bias"],
+        "weights": data["weights"],
+    }
+    print(f"Intent model loaded from {path} ({len(_model['weights'])} features)", flush=True)
+    return _model
+
+
+def extract_features(text: str):
+    words = re.findall(r"[a-z_']+", text.lower())
+    features = set(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return features
+
+
+def _model_predict(text: str):
+    if _model is None:
+        return None
+    scores = list(_model["bias"])
+    for feature in extract_features(text):
+        weights = _model["weights"].get(feature)
+        if weights:
+            for i, w in enumerate(weights):
+                scores[i] += w
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    best = max(range(len(scores)), key=scores.__getitem__)
+    return _model["labels"][best], exps[best] / total
+
+
+def classify_intent(user_input: str, has_problem: bool = False, threshold: float = None):
+    """
+    Returns an IntentDecision when the local stages are confident enough,
+    otherwise None so the caller can ask the LLM router.
+    """
+    if not LOCAL_ROUTER_ENABLED:
+        return None
+    threshold = ROUTER_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    text = user_input.strip().lower()
+    if not text:
+        return None
+
+    for agent, confidence, pattern in _RULES:
+        if agent in _PROBLEM_ONLY and not has_problem:
+            continue
+        if pattern.search(text):
+            if confidence >= threshold:
+                return IntentDecision(agent, confidence, "rules")
+            break
+
+    prediction = _model_predict(text)
+    if prediction:
+        agent, confidence = prediction
+        if agent in AGENTS and confidence >= threshold and (agent not in _PROBLEM_ONLY or has_problem):
+            return IntentDecision(agent, confidence, "model")
+    return None
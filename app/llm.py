@@ -1,23 +1,88 @@
+import asyncio
 import os
+import time
 import httpx
 import json
 
+from app import metrics
+from app.admission import admission, llm_user
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-key-here")
-OPENAI_URL = "https://api.openai.com/v1/chat/completions"
-OPENAI_MODEL = "gpt-3.5-turbo"
-
-async def ask_llm_stream(prompt: str):
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": OPENAI_MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "stream": True,
-    }
-    async with httpx.AsyncClient() as client:
-        async with client.stream("POST", OPENAI_URL, headers=headers, json=payload, timeout=None) as response:
+OPENAI_URL = os.getenv("OPENAI_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+
+# Models as "provider:model" (openai | ollama), per purpose via LLM_MODEL_<PURPOSE>,
+# e.g. LLM_MODEL_ROUTER="ollama:qwen2.5:1.5b"
+LLM_MODEL_DEFAULT = os.getenv("LLM_MODEL_DEFAULT", f"openai:{OPENAI_MODEL}")
+# Second model per purpose (LLM_FALLBACK_<PURPOSE>), used when the first fails before its
+# first token, or races it when no token arrived within LLM_HEDGE_MS (0 = no hedging)
+LLM_FALLBACK_DEFAULT = os.getenv("LLM_FALLBACK_DEFAULT", "")
+LLM_HEDGE_MS = float(os.getenv("LLM_HEDGE_MS", "0"))
+
+# Shared HTTP client settings
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))  # max gap between streamed chunks
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+
+_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the process-wide client, so keep-alive connections are reused across LLM calls."""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            connect=LLM_CONNECT_TIMEOUT,
+            read=LLM_READ_TIMEOUT,
+            write=LLM_CONNECT_TIMEOUT,
+            pool=LLM_POOL_TIMEOUT,
+        )
+        try:
+            _client = httpx.AsyncClient(http2=LLM_HTTP2, limits=limits, timeout=timeout)
+        except ImportError:
+            # HTTP/2 needs the optional `h2` package (httpx[http2])
+            print("LLM client: h2 not installed, falling back to HTTP/1.1", flush=True)
+            _client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+class OpenAIProvider:
+    """OpenAI-compatible chat completions endpoint (OpenAI, vLLM, llama.cpp server, ...)."""
+
+    name = "openai"
+
+    def __init__(self, model: str, url: str = OPENAI_URL, api_key: str = OPENAI_API_KEY):
+        self.model = model
+        self.url = url
+        self.api_key = api_key
+
+    async def stream(self, prompt: str):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+        }
+        client = get_http_client()
+        async with client.stream("POST", self.url, headers=headers, json=payload) as response:
+            response.raise_for_status()
             async for line in response.aiter_lines():
                 if line.strip():
                     try:
@@ -28,4 +93,145 @@ async def ask_llm_stream(prompt: str):
                             if token:
                                 yield token
                     except Exception:
-                        continue
\ No newline at end of file
+                        continue
+
+
+class OllamaProvider:
+    """Ollama's /api/chat, which streams one JSON object per line."""
+
+    name = "ollama"
+
+    def __init__(self, model: str, base_url: str = OLLAMA_URL):
+        self.model = model
+        self.url = base_url.rstrip("/") + "/api/chat"
+
+    async def stream(self, prompt: str):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+        }
+        client = get_http_client()
+        async with client.stream("POST", self.url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                if data.get("error"):
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                token = data.get("message", {}).get("content")
+                if token:
+                    yield token
+                if data.get("done"):
+                    break
+
+
+PROVIDERS = {"openai": OpenAIProvider, "ollama": OllamaProvider}
+_providers = {}
+
+def get_provider(spec: str):
+    """Returns the provider for a "provider:model" spec; instances are shared."""
+    provider = _providers.get(spec)
+    if provider is None:
+        kind, _, model = spec.partition(":")
+        if kind not in PROVIDERS or not model:
+            raise ValueError(f"Invalid LLM model {spec!r}; expected one of {sorted(PROVIDERS)} as provider:model")
+        provider = _providers[spec] = PROVIDERS[kind](model)
+    return provider
+
+def model_for(purpose: str = None) -> str:
+    return (purpose and os.getenv(f"LLM_MODEL_{purpose.upper()}")) or LLM_MODEL_DEFAULT
+
+def fallback_for(purpose: str = None) -> str:
+    return (purpose and os.getenv(f"LLM_FALLBACK_{purpose.upper()}")) or LLM_FALLBACK_DEFAULT
+
+async def _first_token(tokens):
+    try:
+        return await tokens.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _race(prompt: str, primary, fallback, hedge_s: float):
+    """
+    Returns (provider, token stream, first token) from whichever provider yields first.
+    `fallback` starts when `primary` fails before its first token, reusing the
+    caller's admission slot, or after `hedge_s` without one. A hedge runs beside
+    the primary, so it needs a second slot and is skipped when none is free; that
+    slot is returned once the losing stream is cancelled.
+    """
+    started = time.perf_counter()
+    pending = {}  # first-token task -> (provider, token stream)
+    hedge_slot = False
+
+    def launch(provider):
+        tokens = provider.stream(prompt)
+        pending[asyncio.create_task(_first_token(tokens))] = (provider, tokens)
+
+    launch(primary)
+    fallback_started = hedge_tried = False
+    error = None
+    try:
+        while pending:
+            timeout = hedge_s if hedge_s > 0 and not (fallback_started or hedge_tried) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge_tried = True  # one hedge attempt per call
+                if admission.try_acquire():
+                    hedge_slot = fallback_started = True
+                    metrics.inc("llm.hedged")
+                    launch(fallback)
+                else:
+                    metrics.inc("llm.hedge_skipped")
+                continue
+            for task in done:
+                provider, tokens = pending.pop(task)
+                try:
+                    token = task.result()
+                except Exception as e:
+                    print(f"LLM provider {provider.name}:{provider.model} failed: {e}", flush=True)
+                    error = error or e
+                    if not fallback_started:
+                        metrics.inc("llm.fallback")
+                        fallback_started = True
+                        launch(fallback)
+                    continue
+                metrics.observe(f"llm.ttft_ms.{provider.name}", (time.perf_counter() - started) * 1000)
+                if fallback_started:
+                    metrics.inc(f"llm.race_won.{provider.name}")
+                return provider, tokens, token
+        raise error
+    finally:
+        for task, (_, tokens) in pending.items():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await tokens.aclose()
+        if hedge_slot:
+            admission.release()
+
+async def ask_llm_stream(prompt: str, purpose: str = None):
+    """
+    Streams completion tokens for `prompt` from the model configured for `purpose`
+    (router, hint, explain, feedback, conversation, context_summary, summary), which
+    also sets the call's admission priority. Raises app.admission.LLMOverloaded when
+    the call can't be admitted.
+    """
+    primary = get_provider(model_for(purpose))
+    fallback_spec = fallback_for(purpose)
+    fallback = get_provider(fallback_spec) if fallback_spec else None
+    async with admission.slot(purpose, llm_user.get()):
+        if fallback is None or fallback is primary:
+            async for token in primary.stream(prompt):
+                yield token
+            return
+        _, tokens, token = await _race(prompt, primary, fallback, LLM_HEDGE_MS / 1000)
+        try:
+            if token is not None:
+                yield token
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
@@ -1,18 +1,71 @@
-from fastapi import FastAPI, Body, Depends, HTTPException, status
+from fastapi import FastAPI, Body, Depends, HTTPException, Header, Query, status
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 import base64
+import asyncio
 import os
-from typing import Optional
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Union
 
-from app.orchestrator import route_to_agent_stream
+from app import metrics
+from app.streaming import SSE_HEADERS, coalesce_tokens, ndjson_event, negotiate_mode, record_ttfb, sse_event
+from app.db import init_db_pool, close_db_pool
+from app.llm import close_http_client
+from app.admission import LLMOverloaded, llm_user
+from app.intent import load_intent_model
+from app.prompts import load_tokenizer
+from app.cache import close_response_cache
+from app.embeddings import close_embedding_service
+from app.executor import callback_authorized, close_exec_client, resolve_callback
+from app.background import spawn, drain as drain_background_tasks
+from app.write_behind import close_write_behind
+from app.problem_cache import problem_cache, PROBLEM_CACHE_LISTEN, PROBLEM_CACHE_WARM_COUNT
+from app.session_window import SESSION_WINDOW_ENABLED, SESSION_WINDOW_LISTEN, session_windows
+from app.orchestrator import route_to_agent_events, route_to_agent_stream
 from app.agents.feedback import code_feedback
 from app.agents.gamified_tuner import GamifiedTunerAgent
+from app.agents.vectorized_tuner import VectorizedTunerAgent
+from app.tuner_state import TunerService, make_tuner_state
+from app.agents.suggest_problem import catalog
+from app.catalog import CATALOG_WARM_ON_STARTUP
+
+# --- Lifespan: shared resources created at startup and released at shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db_pool()
+    load_intent_model()
+    await asyncio.to_thread(load_tokenizer)
+    if CATALOG_WARM_ON_STARTUP:
+        catalog.start_refresh()
+    if PROBLEM_CACHE_LISTEN:
+        problem_cache.start_listener()
+    if SESSION_WINDOW_ENABLED and SESSION_WINDOW_LISTEN:
+        session_windows.start_listener()
+    if PROBLEM_CACHE_WARM_COUNT > 0:
+        spawn(problem_cache.warm(), name="problem-cache-warm")
+    if tuner_service is not None:
+        await tuner_service.open()
+    try:
+        yield
+    finally:
+        await catalog.stop_refresh()
+        await problem_cache.stop_listener()
+        await session_windows.stop_listener()
+        await close_write_behind()
+        await drain_background_tasks()
+        await close_response_cache()
+        await close_embedding_service()
+        await close_exec_client()
+        await close_http_client()
+        await close_db_pool()
+        if tuner_service is not None:
+            await tuner_service.close()
 
 # --- App and CORS setup ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Re-enable reading from environment variables
 ALLOW_ORIGINS = os.getenv("ALLOW_ORIGINS", "http://localhost:3000").split(",")
@@ -26,6 +79,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request, exc: LLMOverloaded):
+    # Only reached before a response starts; streams report it as an error event/line instead
+    return JSONResponse({"detail": str(exc)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={"Retry-After": "1"})
+
 # --- JWT setup ---
 JWT_SECRET_RAW = os.getenv("JWT_SECRET", "token_secret")
 JWT_SECRET = base64.b64decode(JWT_SECRET_RAW)
@@ -53,15 +113,40 @@ async def verify_jwt(credentials: Optional[HTTPAuthorizationCredentials] = Depen
             detail="Invalid or expired JWT token",
         )
 
+def request_user_id(user: dict, extra: dict = None):
+    """User the request's LLM calls count against: the body's user_id, else the JWT's."""
+    user_id = (extra or {}).get("user_id") or user.get("user_id") or user.get("sub")
+    return str(user_id) if user_id is not None else None
+
 # --- Apply the dependency to your protected endpoints ---
 
 @app.post("/api/ai/orchestrate")
 async def orchestrate_endpoint(
     user_input: str = Body(..., alias="userInput"),
     extra: dict = Body(default={}),
+    stream: Optional[str] = Query(default=None),
+    accept: Optional[str] = Header(default=None),
     user: dict = Depends(verify_jwt) # Re-enable JWT
 ):
-    return StreamingResponse(route_to_agent_stream(user_input, extra), media_type="text/plain")
+    """
+    Streams the answer as plain text by default. With `?stream=sse` / `Accept: text/event-stream`
+    (or `ndjson` / `application/x-ndjson`) it sends typed events instead: agent-selected,
+    token (coalesced), tool-run, tool-done, final and error.
+    """
+    started = time.perf_counter()
+    mode = negotiate_mode(stream, accept, default="text")
+    # Set before the stream is built: coalesce_tokens advances the generator in new tasks,
+    # which copy this context, so a value set inside the generator would be lost
+    llm_user.set(request_user_id(user, extra))
+    if mode == "sse":
+        events = (sse_event(event, data) async for event, data in coalesce_tokens(route_to_agent_events(user_input, extra)))
+        return StreamingResponse(record_ttfb(events, "orchestrate.sse", started),
+                                 media_type="text/event-stream", headers=SSE_HEADERS)
+    if mode == "ndjson":
+        events = (ndjson_event(event, data) async for event, data in coalesce_tokens(route_to_agent_events(user_input, extra)))
+        return StreamingResponse(record_ttfb(events, "orchestrate.ndjson", started), media_type="application/x-ndjson")
+    return StreamingResponse(record_ttfb(route_to_agent_stream(user_input, extra), "orchestrate.text", started),
+                             media_type="text/plain")
 
 
 @app.post("/api/ai/feedback")
@@ -70,25 +155,97 @@ async def feedback_endpoint(
     problem_description: str = Body(...),
     user_code: str = Body(...),
     running_result: str = Body(default=""),
+    stream: Optional[str] = Query(default=None),
+    accept: Optional[str] = Header(default=None),
     user: dict = Depends(verify_jwt) # Re-enable JWT
 ):
-    feedback = ""
-    async for token in code_feedback(
+    """
+    Returns {"feedback": ...} by default. With `?stream=sse` / `Accept: text/event-stream`
+    tokens are sent as SSE `token` events, and with `?stream=text` / `Accept: text/plain`
+    as a chunked plain-text body.
+    """
+    started = time.perf_counter()
+    mode = negotiate_mode(stream, accept)
+    llm_user.set(request_user_id(user))
+    tokens = code_feedback(
         problem_title=problem_title,
         problem_description=problem_description,
         user_code=user_code,
         running_result=running_result,
-    ):
-        feedback += token
+    )
+
+    if mode == "text":
+        return StreamingResponse(record_ttfb(tokens, "feedback.text", started), media_type="text/plain")
+
+    if mode == "sse":
+        async def events():
+            try:
+                async for token in tokens:
+                    yield sse_event("token", {"text": token})
+                yield sse_event("done", {})
+            except Exception as e:
+                yield sse_event("error", {"message": str(e)})
+        return StreamingResponse(record_ttfb(events(), "feedback.sse", started),
+                                 media_type="text/event-stream", headers=SSE_HEADERS)
+
+    feedback = "".join([token async for token in tokens])
+    metrics.observe("feedback.json.total_ms", (time.perf_counter() - started) * 1000)
     return JSONResponse({"feedback": feedback})
 
 
+# --- Webhook for the code execution service (EXEC_RESULT_MODE=webhook) ---
+@app.post("/api/ai/exec-callback")
+async def exec_callback(
+    result: dict = Body(...),
+    x_exec_callback_secret: str = Header(default="")
+):
+    if not callback_authorized(x_exec_callback_secret):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid callback secret")
+    if "job_id" not in result:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing job_id")
+    resolve_callback(str(result["job_id"]), result)
+    return {"ok": True}
+
+
 # --- Your unprotected tuner endpoint remains the same ---
-tuner_agent = GamifiedTunerAgent()
+TUNER_BACKEND = os.getenv("TUNER_BACKEND", "vectorized")  # vectorized | dict
+tuner_agent = VectorizedTunerAgent() if TUNER_BACKEND == "vectorized" else GamifiedTunerAgent()
+# The dict agent pickles itself on every step; the vectorized one runs per cohort on app.tuner_state
+tuner_service = TunerService(make_tuner_state(tuner_agent), tuner_agent) if TUNER_BACKEND == "vectorized" else None
 @app.post("/api/ai/tuner-step")
 async def tuner_step(
     logs: dict = Body(...),
-    user_action_metrics: dict = Body(...)
+    user_action_metrics: dict = Body(...),
+    user_id: Optional[Union[int, str]] = Body(None),
+    cohort: Optional[str] = Body(None)
 ):
-    action, updated_logs = tuner_agent.step(logs, user_action_metrics)
-    return {"action": action, "logs": updated_logs}
\ No newline at end of file
+    if tuner_service is not None:
+        try:
+            action, updated_logs = await tuner_service.step(logs, user_action_metrics, user_id, cohort)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    else:
+        action, updated_logs = tuner_agent.step(logs, user_action_metrics)
+    return {"action": action, "logs": updated_logs}
+
+
+@app.post("/api/ai/tuner-step-many")
+async def tuner_step_many(steps: list = Body(..., embed=True)):
+    """Batched tuner-step: `steps` is a list of {"logs": ..., "user_action_metrics": ..., "user_id": ..., "cohort": ...}."""
+    logs_list = [item.get("logs", {}) for item in steps]
+    metrics_list = [item.get("user_action_metrics", {}) for item in steps]
+    if tuner_service is not None:
+        user_ids = [None if item.get("user_id") is None else str(item["user_id"]) for item in steps]
+        cohorts = [item.get("cohort") for item in steps]
+        try:
+            results = await tuner_service.step_many(logs_list, metrics_list, user_ids, cohorts)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    else:
+        results = [tuner_agent.step(logs, m) for logs, m in zip(logs_list, metrics_list)]
+    return {"results": [{"action": action, "logs": logs} for action, logs in results]}
+
+
+@app.get("/api/ai/metrics")
+async def metrics_endpoint():
+    return metrics.snapshot()
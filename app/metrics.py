@@ -0,0 +1,110 @@
+"""
+Lightweight in-process metrics.
+
+Counters, gauges and latency summaries are kept per worker process and
+exposed as JSON by the `/api/ai/metrics` endpoint in `main.py`.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Number of recent observations kept per summary for percentile estimates
+METRICS_SAMPLE_SIZE = int(os.getenv("METRICS_SAMPLE_SIZE", "1024"))
+
+_counters = defaultdict(float)
+_gauges = {}
+_samples = defaultdict(lambda: deque(maxlen=METRICS_SAMPLE_SIZE))
+_totals = defaultdict(lambda: [0, 0.0])  # name -> [count, sum]
+
+
+def inc(name: str, value: float = 1):
+    _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    _gauges[name] = value
+
+
+def observe(name: str, value: float):
+    _samples[name].append(value)
+    total = _totals[name]
+    total[0] += 1
+    total[1] += value
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def snapshot() -> dict:
+    summaries = {}
+    for name, samples in _samples.items():
+        values = sorted(samples)
+        count, total = _totals[name]
+        summaries[name] = {
+            "count": count,
+            "mean": total / count if count else 0.0,
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
+    return {
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "summaries": summaries,
+    }
+
+
+class StageTimer:
+    """
+    Records start/end offsets of named stages within one request, so overlapping
+    stages are visible in the log line and durations land in `<prefix>.<stage>_ms`.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.origin = time.perf_counter()
+        self.stages = {}  # name -> (start_ms, end_ms, status)
+
+    def _now(self):
+        return (time.perf_counter() - self.origin) * 1000
+
+    @contextmanager
+    def stage(self, name: str):
+        start = self._now()
+        status = "ok"
+        try:
+            yield
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.stages[name] = (start, self._now(), status)
+
+    async def track(self, name: str, coro):
+        with self.stage(name):
+            return await coro
+
+    def mark(self, name: str):
+        now = self._now()
+        self.stages[name] = (now, now, "ok")
+
+    def report(self):
+        parts = []
+        for name, (start, end, status) in sorted(self.stages.items(), key=lambda item: item[1][0]):
+            if status == "ok":
+                observe(f"{self.prefix}.{name}_ms", end - start)
+            else:
+                inc(f"{self.prefix}.{name}_{status}")
+            suffix = "" if status == "ok" else f"({status})"
+            parts.append(f"{name}={start:.0f}-{end:.0f}ms{suffix}")
+        print(f"{self.prefix} stages: " + " ".join(parts), flush=True)
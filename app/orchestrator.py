@@ -1,22 +1,48 @@
 from langchain.chains.router import MultiPromptChain
-from langchain.prompts import PromptTemplate
 from app.agents.explain import explain_lesson
 from app.agents.hint import generate_hint
 from app.agents.feedback import code_feedback
 from app.agents.conversation import generate_conversational_response
 from app.agents.suggest_problem import suggest_next
-from app.db import save_ai_assistance  # Make sure to implement create_new_session
+from app.write_behind import enqueue_ai_assistance
+from app.session_window import SESSION_WINDOW_ENABLED, session_windows
 from app.llm import ask_llm_stream  # Ensure this is implemented to stream LLM responses
-from app.db import fetch_previous_conversations
-import httpx
+from app.db import fetch_previous_conversations, get_conversation_summary
+from app.summaries import MAX_CONTEXT_CHARS, build_session_context, format_turns, refresh_session_summary
+from app.background import spawn
+from app.intent import classify_intent
+from app.prefetch import Prefetcher
+from app.speculation import SpeculativeRun
+from app.executor import run_job
+from app.agents.suggest_problem import fetch_user_history
+from app import metrics
+from app.metrics import StageTimer
+from app.prompts import PromptTemplate, Section
 import asyncio
 import json
 import os
-from app.db import get_solution_code, get_testcases  # Make sure to implement get_testcases
-
-EXEC_API_BASE = os.getenv("EXEC_API_BASE", "http://localhost:8001")  # Change to your exec service base URL
-
-ROUTER_PROMPT = """
+import time
+from datetime import datetime, timezone
+from app.problem_cache import get_problem_artifacts
+
+# Start the fetches of every candidate agent while the LLM router is deciding
+PREFETCH_SPECULATIVE = os.getenv("PREFETCH_SPECULATIVE", "true").lower() == "true"
+# Opt-in: start last_agent's answer while the LLM router decides, buffering up to N tokens
+SPECULATIVE_AGENT = os.getenv("SPECULATIVE_AGENT", "false").lower() == "true"
+SPECULATIVE_MAX_TOKENS = int(os.getenv("SPECULATIVE_MAX_TOKENS", "64"))
+
+AGENTS = ("explain", "hint", "suggest_problem", "conversation")
+# Markers agent_stream yields around the hint agent's code execution
+RUN_CODE_START = "__RUN_CODE_START__"
+RUN_CODE_DONE = "__RUN_CODE_DONE__"
+
+# Prefetched lookups each agent consumes; everything else is cancelled once routing is done
+AGENT_PREFETCHES = {
+    "hint": ("problem_artifacts",),
+    "suggest_problem": ("user_history",),
+}
+
+ROUTER_PROMPT = PromptTemplate("router", """
 You are an AI orchestrator. Your primary goal is to select the best agent to respond to the user's most recent `User input`.
 Use the `Recent conversation` to understand the context of their question. For example, if the user asks a follow-up question like "how do I remove an item?", the conversation history will tell you if they are asking about a list, a dictionary, or another data structure.
 Pay close attention to the `Last agent` used. If the user is continuing a topic, the same agent might be appropriate.
@@ -76,11 +102,147 @@ User input: {user_input}
 
 Reply with ONLY the agent name: explain, hint, suggest_problem, or conversation. Do NOT explain or answer the user's question.
 Agent:
-"""
+""")
+
+
+
+async def load_conversation_context(agent_kwargs: dict) -> str:
+    """Builds the conversation history string passed to the router and agents."""
+    previous_context = ""
+    session_id = agent_kwargs["session_id"]
+    if session_id is not None:
+        # Follow-ups are served from the in-process window written through after each turn
+        window = session_windows.get(session_id) if SESSION_WINDOW_ENABLED else None
+        if window is not None:
+            return build_session_context(window.turns(MAX_CONTEXT_CHARS), window.summary_row)
+        # Sessions keep a rolling summary that is updated in the background,
+        # so the request path only has to read it
+        prev_convos, summary_row = await asyncio.gather(
+            fetch_previous_conversations(agent_kwargs["lesson_id"],
+                                         agent_kwargs["problem_id"],
+                                         session_id,
+                                         agent_kwargs["user_id"]),
+            get_conversation_summary(session_id)
+        )
+        if SESSION_WINDOW_ENABLED:
+            session_windows.fill(session_id, prev_convos, summary_row)
+        previous_context = build_session_context(prev_convos, summary_row)
+    else:
+        prev_convos = await fetch_previous_conversations(agent_kwargs["lesson_id"],
+                                                          agent_kwargs["problem_id"],
+                                                          agent_kwargs["session_id"],
+                                                          agent_kwargs["user_id"])
+        if prev_convos:
+            # If too many previous conversations, summarize them
+            previous_context = format_turns(prev_convos)
+            if len(previous_context) > MAX_CONTEXT_CHARS:
+                # Summarize the previous context using the LLM itself
+                summary_prompt = f"Summarize the following conversation history for context in 5 concise bullet points:\n{previous_context}"
+                summary = ""
+                # Use ask_llm_stream to get the summary
+                async for token in ask_llm_stream(summary_prompt.strip(), purpose="context_summary"):
+                    summary += token
+                previous_context = "\nSummary of previous conversation history:\n" + summary.strip() + "\n"
+    return previous_context
+
+
+async def agent_stream(agent: str, agent_kwargs: dict, conversation_history: str,
+                       prefetch: Prefetcher, timer: StageTimer, gate: asyncio.Event = None):
+    """
+    Yields the tokens of the given agent, including the hint agent's code-execution round.
+    When `gate` is given (speculative runs), it must be set before the code is executed.
+    """
+    # Pass conversation_history to all agents
+    if agent == "explain":
+        generator = explain_lesson(
+            user_question=agent_kwargs["user_question"],
+            topic=agent_kwargs["topic"],
+            conversation_history=conversation_history
+        )
+    elif agent == "hint":
+        generator = generate_hint(
+            agent_kwargs["user_question"],
+            agent_kwargs["problem_title"],
+            agent_kwargs["problem_description"],
+            agent_kwargs["user_code"],
+            conversation_history=conversation_history,
+            running_result=agent_kwargs["running_result"],
+            testcase=agent_kwargs["testcase"],
+            is_done=False  # Indicate this is an initial hint before running code
+        )
+        response = ""
+        async for token in generator:
+            response += token
+            yield token
+
+        # TOOL USE: If LLM requests code execution
+        if response.strip() == "__RUN_CODE__":
+            if gate is not None:
+                await gate.wait()
+            print("Running code execution...", flush=True)
+            yield RUN_CODE_START
+            with timer.stage("exec"):
+                code_result = await execute_code(
+                    agent_kwargs["user_code"],
+                    agent_kwargs.get("problem_id"),
+                    artifacts=await prefetch.get("problem_artifacts")
+                )
+            yield RUN_CODE_DONE
+            # Now call generate_hint again, but YIELD its tokens!
+            generator = generate_hint(
+                agent_kwargs["user_question"],
+                agent_kwargs["problem_title"],
+                agent_kwargs["problem_description"],
+                agent_kwargs["user_code"],
+                conversation_history=conversation_history,
+                running_result=code_result,
+                testcase=agent_kwargs["testcase"],
+                is_done=True  # Indicate this is the final hint after running code
+            )
+            async for token in generator:
+                yield token
+        return
+    elif agent == "suggest_problem":
+        # Pass extra context to suggest_next
+        generator = suggest_next(
+            agent_kwargs["user_id"],
+            agent_kwargs["user_question"],
+            agent_kwargs["user_level"],
+            {
+                "lessonId": agent_kwargs["lesson_id"],
+                "problemId": agent_kwargs["problem_id"],
+                "topic": agent_kwargs["topic"]
+            },
+            completed_ids=await prefetch.get("user_history")
+        )
+    elif agent == "conversation":
+        generator = generate_conversational_response(
+            user_input=agent_kwargs["user_question"],
+            conversation_history=conversation_history
+        )
+    else:
+        return
 
+    async for token in generator:
+        yield token
 
 
 async def route_to_agent_stream(user_input: str, extra: dict = None):
+    """Plain-text stream of the answer, with the __RUN_CODE_DONE__ marker after code runs."""
+    async for event, data in route_to_agent_events(user_input, extra):
+        if event == "token":
+            yield data["text"]
+        elif event == "tool-done":
+            yield RUN_CODE_DONE
+        elif event == "error":
+            yield f"Error: {data['message']}"
+
+
+async def route_to_agent_events(user_input: str, extra: dict = None):
+    """
+    Yields (event, data) pairs: agent-selected, token, tool-run, tool-done, final
+    and error. route_to_agent_stream and the SSE/NDJSON modes are built on it.
+    """
     print(f"Routing user extra: {extra}", flush=True)
     agent_kwargs = {
             "session_id": extra.get("session_id") if extra else None,
@@ -100,136 +262,111 @@ async def route_to_agent_stream(user_input: str, extra: dict = None):
             "running_result": extra.get("running_result", "") if extra else "",
             "testcase": extra.get("testcase", "") if extra else ""
         }
+    timer = StageTimer("orchestrate")
+    prefetch = Prefetcher(timer)
+    speculative = None
     try:
-        # --- This block is changed to use OpenAI instead of Ollama ---
-        router_prompt_text = ROUTER_PROMPT.format(
-            user_input=user_input,
-            conversation_history="", # We will add this later
-            last_agent=agent_kwargs["last_agent"]
+        # The local classifier needs no I/O, so run it before anything else
+        decision = classify_intent(
+            user_input,
+            has_problem=bool(agent_kwargs["problem_id"] or agent_kwargs["user_code"])
         )
 
-        previous_context = ""
-        prev_convos = await fetch_previous_conversations(agent_kwargs["lesson_id"],
-                                                          agent_kwargs["problem_id"],
-                                                          agent_kwargs["session_id"],
-                                                          agent_kwargs["user_id"])
-        if prev_convos:
-            # If too many previous conversations, summarize them
-            MAX_CONTEXT_CHARS = 4000  # or any limit you want
-            for convo in prev_convos:
-                previous_context += f"User: {convo['user_query']}\nAI: {convo['ai_response']}\n"
-            if len(previous_context) > MAX_CONTEXT_CHARS:
-                # Summarize the previous context using the LLM itself
-                summary_prompt = f"Summarize the following conversation history for context in 5 concise bullet points:\n{previous_context}"
-                summary = ""
-                # Use ask_llm_stream to get the summary
-                async for token in ask_llm_stream(summary_prompt.strip()):
-                    summary += token
-                previous_context = "\nSummary of previous conversation history:\n" + summary.strip() + "\n"
-        
-        conversation_history = previous_context.strip()
-
-        # Update the router prompt with the conversation history
-        router_prompt_with_history = ROUTER_PROMPT.format(
-            user_input=user_input,
-            conversation_history=conversation_history,
-            last_agent=agent_kwargs["last_agent"]
-        )
-
-        # Get the agent decision from OpenAI
-        agent = ""
-        async for token in ask_llm_stream(router_prompt_with_history):
-            agent += token
-        agent = agent.strip().lower()
+        # Start every fetch the likely agents need at once. When the LLM router still
+        # has to decide, speculate on all of them and cancel the unused ones afterwards.
+        if decision:
+            likely_agents = {decision.agent}
+        elif PREFETCH_SPECULATIVE:
+            likely_agents = set(AGENT_PREFETCHES)
+        else:
+            likely_agents = set()
+        prefetch.start("context", load_conversation_context(agent_kwargs))
+        if agent_kwargs["user_id"] is not None and "suggest_problem" in likely_agents:
+            prefetch.start("user_history", fetch_user_history(agent_kwargs["user_id"]))
+        if agent_kwargs["problem_id"] and "hint" in likely_agents:
+            prefetch.start("problem_artifacts", get_problem_artifacts(agent_kwargs["problem_id"]))
+
+        conversation_history = (await prefetch.get("context")).strip()
+
+        # Only ask the LLM router when the local fast path wasn't confident
+        if decision:
+            agent = decision.agent
+            route_source = decision.source
+            route_confidence = decision.confidence
+        else:
+            # Optionally start last_agent's answer while the router is still deciding
+            last_agent = agent_kwargs["last_agent"]
+            if SPECULATIVE_AGENT and last_agent in AGENTS:
+                speculative = SpeculativeRun(
+                    last_agent,
+                    lambda confirmed: agent_stream(last_agent, agent_kwargs, conversation_history,
+                                                   prefetch, timer, gate=confirmed),
+                    SPECULATIVE_MAX_TOKENS
+                )
+            # Update the router prompt with the conversation history
+            router_prompt_with_history = ROUTER_PROMPT.render(
+                user_input=Section(user_input, strategy="head", priority=1),
+                conversation_history=Section(conversation_history, strategy="turns", priority=0),
+                last_agent=agent_kwargs["last_agent"]
+            )
+            # Get the agent decision from OpenAI
+            router_start = time.perf_counter()
+            agent = ""
+            with timer.stage("router"):
+                async for token in ask_llm_stream(router_prompt_with_history, purpose="router"):
+                    agent += token
+            agent = agent.strip().lower()
+            metrics.observe("router.llm_ms", (time.perf_counter() - router_start) * 1000)
+            route_source = "llm"
+            route_confidence = None
+        metrics.inc(f"router.source.{route_source}")
+        print(f"Routing decision: agent={agent} source={route_source} confidence={route_confidence}", flush=True)
+        yield "agent-selected", {"agent": agent, "source": route_source, "confidence": route_confidence}
+        # Cancel speculative fetches the chosen agent won't use
+        prefetch.keep_only(AGENT_PREFETCHES.get(agent, ()))
+
+        if speculative is not None and speculative.agent == agent and speculative.confirm():
+            # The router agreed: flush what was buffered and keep streaming the same run
+            decided_at = time.perf_counter()
+            saved = min(decided_at, speculative.first_token_at or decided_at) - speculative.started_at
+            metrics.inc("speculative.hit")
+            metrics.observe("speculative.saved_ms", saved * 1000)
+            metrics.observe("speculative.buffered_tokens", speculative.buffered)
+            print(f"Speculative {agent} confirmed: {speculative.buffered} tokens buffered, saved {saved * 1000:.0f}ms", flush=True)
+            generator = speculative.stream()
+        else:
+            if speculative is not None:
+                metrics.inc("speculative.exhausted" if speculative.agent == agent else "speculative.miss")
+                metrics.observe("speculative.wasted_tokens", speculative.buffered)
+                print(f"Speculative {speculative.agent} discarded for {agent}"
+                      f"{' (token ceiling reached)' if speculative.exhausted else ''}", flush=True)
+                await speculative.cancel()
+                speculative = None
+            generator = agent_stream(agent, agent_kwargs, conversation_history, prefetch, timer)
 
         found = False
         ai_response = ""  # Collect the response here
 
-        async def stream_and_collect(generator):
-            nonlocal found, ai_response
-            async for token in generator:
-                found = True
-                ai_response += token
-                yield token
-
         # Get session_id from extra if present
         session_id = extra.get("session_id") if extra else None
         print (f"Routing to agent: {agent}", flush=True)
 
-        # Pass conversation_history to all agents
-        if agent == "explain":
-            generator = explain_lesson(
-                user_question=agent_kwargs["user_question"],
-                topic=agent_kwargs["topic"],
-                conversation_history=conversation_history
-            )
-        elif agent == "hint":
-            generator = generate_hint(
-                agent_kwargs["user_question"],
-                agent_kwargs["problem_title"],
-                agent_kwargs["problem_description"],
-                agent_kwargs["user_code"],
-                conversation_history=conversation_history,
-                running_result=agent_kwargs["running_result"],
-                testcase=agent_kwargs["testcase"],
-                is_done=False  # Indicate this is an initial hint before running code
-            )
-            response = ""
-            async for token in generator:
-                found = True
-                ai_response += token
-                response += token
-                yield token
-
-            # TOOL USE: If LLM requests code execution
-            if response.strip() == "__RUN_CODE__":
-                print("Running code execution...", flush=True)
-                code_result = await execute_code(
-                    agent_kwargs["user_code"],
-                    agent_kwargs.get("problem_id")
-                )
-                yield "__RUN_CODE_DONE__"
-                # Now call generate_hint again, but YIELD its tokens!
-                generator = generate_hint(
-                    agent_kwargs["user_question"],
-                    agent_kwargs["problem_title"],
-                    agent_kwargs["problem_description"],
-                    agent_kwargs["user_code"],
-                    conversation_history=conversation_history,
-                    running_result=code_result,
-                    testcase=agent_kwargs["testcase"],
-                    is_done=True  # Indicate this is the final hint after running code
-                )
-                async for token in generator:
-                    found = True
-                    ai_response += token
-                    yield token
-        elif agent == "suggest_problem":
-            # Pass extra context to suggest_next
-            generator = suggest_next(
-                agent_kwargs["user_id"],
-                user_input,
-                agent_kwargs["user_level"],
-                {
-                    "lessonId": agent_kwargs["lesson_id"],
-                    "problemId": agent_kwargs["problem_id"],
-                    "topic": agent_kwargs["topic"]
-                }
-            )
-        elif agent == "conversation":
-            generator = generate_conversational_response(
-                user_input=user_input,
-                conversation_history=conversation_history
-            )
-        else:
-            generator = None
-
-        if generator:
-            async for token in stream_and_collect(generator):
-                yield token
+        async for token in generator:
+            # Tool-use markers for the client, not part of the answer
+            if token == RUN_CODE_START:
+                yield "tool-run", {"tool": "execute_code"}
+                continue
+            if token == RUN_CODE_DONE:
+                yield "tool-done", {"tool": "execute_code"}
+                continue
+            if not found:
+                timer.mark("first_token")
+            found = True
+            ai_response += token
+            yield "token", {"text": token}
 
         if not found:
-            yield "Sorry, no response was generated."
+            yield "token", {"text": "Sorry, no response was generated."}
 
         # Save to DB after streaming is done
         if found:
@@ -237,62 +374,63 @@ async def route_to_agent_stream(user_input: str, extra: dict = None):
             problem_id = extra.get("problem_id") if extra else None
             user_id = agent_kwargs["user_id"]
 
-            # Save the AI assistance with session_id
-            await save_ai_assistance(
-                user_id=user_id,
-                lesson_id=lesson_id,
-                problem_id=problem_id,
-                session_id=session_id,
-                user_query=user_input,
-                ai_response=ai_response,
-                suggestion_type=agent
-            )
+            # Queue the AI assistance row with session_id; it's written in a batch after the stream ends
+            saved_at = datetime.now(timezone.utc)
+            with timer.stage("save"):
+                saved = await enqueue_ai_assistance(
+                    user_id=user_id,
+                    lesson_id=lesson_id,
+                    problem_id=problem_id,
+                    session_id=session_id,
+                    user_query=user_input,
+                    ai_response=ai_response,
+                    suggestion_type=agent,
+                    date_time=saved_at
+                )
+            if session_id is not None and saved is not None:
+                session_windows.append(session_id, user_input, ai_response, saved_at)
+            # Fold the new turn into the session's rolling summary once it is stored, off the request path
+            if session_id is not None and saved is not None:
+                spawn(refresh_summary_after(saved, session_id), name=f"summary-{session_id}")
+
+        final = {"agent": agent, "text": ai_response}
+        if agent == "suggest_problem":
+            try:
+                final["suggestion"] = json.loads(ai_response)
+            except ValueError:
+                final["suggestion"] = None
+        yield "final", final
 
     except Exception as e:
-        yield f"Error: {str(e)}"
+        yield "error", {"message": str(e)}
+    finally:
+        if speculative is not None and not speculative.confirmed.is_set():
+            await speculative.cancel()
+        await prefetch.aclose()
+        timer.report()
+
+
 
+async def refresh_summary_after(saved: asyncio.Future, session_id: str):
+    await saved
+    await refresh_session_summary(session_id)
 
 
-async def execute_code(user_code: str, problem_id=None):
+async def execute_code(user_code: str, problem_id=None, artifacts=None):
     # If problem_id is provided, use /execute-problem and /result-problem
     if problem_id:
-        solution_code = await get_solution_code(problem_id) or ""
-        # Prepare test cases
-        testcases = await get_testcases(problem_id)
+        # Use the prefetched (solution_code, testcases) when given, otherwise the problem cache
+        if artifacts is None:
+            artifacts = await get_problem_artifacts(problem_id)
+        solution_code, testcases = artifacts
+        solution_code = solution_code or ""
         payload = {
             "userCode": user_code,
             "solutionCode": solution_code,
             "testCases": testcases
         }
-        print(f"Payload for /execute-problem: {json.dumps(payload, ensure_ascii=False)}", flush=True) 
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f"{EXEC_API_BASE}/execute-problem", json=payload)
-            resp.raise_for_status()
-            job_id = resp.json().get("job_id")
-            # Poll for result
-            for _ in range(30):
-                result_resp = await client.get(f"{EXEC_API_BASE}/result-problem/{job_id}")
-                result = result_resp.json()
-                if result["status"] == "finished":
-                    return json.dumps(result["results"], ensure_ascii=False)
-                elif result["status"] == "failed":
-                    return f"Error: {result.get('error', 'Job failed')}"
-                await asyncio.sleep(0.5)
-            return "Error: Code execution timed out."
+        print(f"Payload for /execute-problem: {json.dumps(payload, ensure_ascii=False)}", flush=True)
+        return await run_job("problem", payload, problem_id=problem_id)
     # If no problem_id, use /execute and /result
     else:
-        payload = {"code": user_code}
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f"{EXEC_API_BASE}/execute", json=payload)
-            resp.raise_for_status()
-            job_id = resp.json().get("job_id")
-            # Poll for result
-            for _ in range(30):
-                result_resp = await client.get(f"{EXEC_API_BASE}/result/{job_id}")
-                result = result_resp.json()
-                if result["status"] == "finished":
-                    return result.get("output", "")
-                elif result["status"] == "failed":
-                    return f"Error: {result.get('error', 'Job failed')}"
-                await asyncio.sleep(0.5)
-            return "Error: Code execution timed out."
\ No newline at end of file
+        return await run_job("code", {"code": user_code})
@@ -0,0 +1,43 @@
+"""
+Speculative prefetching for the orchestrator.
+
+Independent lookups are started as tasks as soon as a request arrives, while
+routing is still deciding which agent will run. Once the agent is known,
+fetches it does not need are cancelled; `aclose()` cancels and reaps whatever
+is left so no task outlives the request.
+"""
+import asyncio
+
+
+class Prefetcher:
+    def __init__(self, timer=None):
+        self.timer = timer
+        self._tasks = {}
+
+    def start(self, name: str, coro):
+        if self.timer is not None:
+            coro = self.timer.track(name, coro)
+        self._tasks[name] = asyncio.create_task(coro, name=f"prefetch-{name}")
+
+    def started(self, name: str) -> bool:
+        return name in self._tasks
+
+    async def get(self, name: str, default=None):
+        """Awaits a started fetch; returns `default` if it was never started."""
+        task = self._tasks.get(name)
+        if task is None:
+            return default
+        # Shielded so a cancelled consumer (e.g. a discarded speculative run) doesn't cancel the fetch
+        return await asyncio.shield(task)
+
+    def keep_only(self, names):
+        for name, task in self._tasks.items():
+            if name not in names and not task.done():
+                task.cancel()
+
+    async def aclose(self):
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        # Reap every task so failures in unused fetches are not reported as unretrieved
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
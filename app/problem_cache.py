@@ -0,0 +1,120 @@
+"""
+Cache of per-problem execution artifacts: solution code and test cases.
+
+Problem definitions almost never change, so the hint agent's code runs read
+them from a size-bounded LRU with a TTL instead of Postgres. Entries are
+invalidated through LISTEN/NOTIFY on PROBLEM_CACHE_CHANNEL, fed by the
+triggers in migrations/002_problem_artifact_notify.sql. If the listener
+connection drops, the whole cache is cleared because notifications may have
+been missed. Optionally the hottest problems are preloaded at startup.
+"""
+import asyncio
+import os
+
+from app import metrics
+from app.cache import TTLCache
+from app.db import acquire, get_solution_code, get_testcases, listen_forever
+
+PROBLEM_CACHE_SIZE = int(os.getenv("PROBLEM_CACHE_SIZE", "1024"))
+PROBLEM_CACHE_TTL = float(os.getenv("PROBLEM_CACHE_TTL", "3600"))
+PROBLEM_CACHE_CHANNEL = os.getenv("PROBLEM_CACHE_CHANNEL", "problem_artifacts_changed")
+PROBLEM_CACHE_LISTEN = os.getenv("PROBLEM_CACHE_LISTEN", "true").lower() == "true"
+# Number of most-requested problems to preload at startup (0 disables warm-up)
+PROBLEM_CACHE_WARM_COUNT = int(os.getenv("PROBLEM_CACHE_WARM_COUNT", "0"))
+
+
+class ProblemArtifactCache:
+    def __init__(self, maxsize: int = PROBLEM_CACHE_SIZE, ttl: float = PROBLEM_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._loading = {}  # problem_id -> task, so concurrent misses share one load
+        self._generation = 0  # bumped on every invalidation
+        self._listener_task = None
+
+    async def _load(self, problem_id):
+        generation = self._generation
+        artifacts = await asyncio.gather(get_solution_code(problem_id), get_testcases(problem_id))
+        artifacts = tuple(artifacts)
+        # Don't cache rows read before an invalidation that arrived mid-load
+        if generation == self._generation:
+            self._cache.set(problem_id, artifacts)
+        return artifacts
+
+    async def get(self, problem_id: int):
+        """Returns (solution_code, testcases) for the problem."""
+        problem_id = int(problem_id)
+        artifacts = self._cache.get(problem_id)
+        if artifacts is not None:
+            metrics.inc("problem_cache.hit")
+            return artifacts
+        metrics.inc("problem_cache.miss")
+        task = self._loading.get(problem_id)
+        if task is None:
+            task = asyncio.create_task(self._load(problem_id))
+            self._loading[problem_id] = task
+            task.add_done_callback(
+                lambda t: self._loading.pop(problem_id) if self._loading.get(problem_id) is t else None
+            )
+        # Shielded so one cancelled caller doesn't fail the others sharing the load
+        return await asyncio.shield(task)
+
+    def invalidate(self, problem_id=None):
+        self._generation += 1
+        if problem_id is None:
+            self._cache.clear()
+            self._loading.clear()
+        else:
+            self._cache.pop(int(problem_id))
+            self._loading.pop(int(problem_id), None)
+        metrics.inc("problem_cache.invalidations")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        if payload in ("", "*"):
+            self.invalidate()
+            return
+        try:
+            self.invalidate(int(payload))
+        except ValueError:
+            self.invalidate()
+
+    def start_listener(self):
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(
+                # Notifications may have been missed while disconnected, so clear everything
+                listen_forever(PROBLEM_CACHE_CHANNEL, self._on_notify, self.invalidate, "Problem cache"),
+                name="problem-cache-listener",
+            )
+
+    async def stop_listener(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    async def warm(self, count: int = PROBLEM_CACHE_WARM_COUNT):
+        """Preloads the problems users asked for help on most in the last week."""
+        if count <= 0:
+            return
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT problem_id
+                FROM ai_assistance
+                WHERE problem_id IS NOT NULL AND date_time > NOW() - INTERVAL '7 days'
+                GROUP BY problem_id
+                ORDER BY COUNT(*) DESC
+                LIMIT $1
+                """,
+                count
+            )
+        await asyncio.gather(*(self.get(row["problem_id"]) for row in rows), return_exceptions=True)
+        print(f"Problem cache warmed with {len(rows)} problems", flush=True)
+
+
+problem_cache = ProblemArtifactCache()
+
+
+async def get_problem_artifacts(problem_id: int):
+    return await problem_cache.get(problem_id)
@@ -0,0 +1,185 @@
+"""
+Token-budgeted prompt assembly shared by the agents.
+
+A `PromptTemplate` is a str.format template whose static text is tokenized
+once and cached. `render` fills it with sections, each with a truncation
+strategy and a priority; when the prompt would exceed the agent's token budget
+(PROMPT_BUDGET_<AGENT>), lower-priority sections are cut first:
+
+- "head":   keep the beginning (problem descriptions, questions)
+- "tail":   keep the end (run results, where the error usually is)
+- "middle": keep the beginning and end, dropping the middle (code)
+- "turns":  keep the conversation summary, then the newest whole turns
+
+Tokens are counted with tiktoken when its encoding is available locally,
+otherwise with a ~4 characters per token estimate. Rendered sizes are
+recorded as `prompt_tokens.<agent>` metrics.
+"""
+import os
+import re
+import string
+from dataclasses import dataclass
+
+from app import metrics
+
+PROMPT_TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "cl100k_base")
+DEFAULT_BUDGETS = {
+    "explain": 3000,
+    "hint": 3500,
+    "feedback": 3000,
+    "conversation": 1500,
+    "router": 1500,
+}
+TRUNCATION_MARKER = "\n... [truncated] ...\n"
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken  # optional dependency
+
+            _encoding = tiktoken.get_encoding(PROMPT_TOKENIZER_ENCODING)
+        except Exception as e:
+            # Missing package, or no network to fetch the encoding file on first use
+            print(f"tiktoken unavailable, estimating prompt tokens: {e}", flush=True)
+            _encoding = None
+    return _encoding
+
+
+def load_tokenizer():
+    """Loads the encoding up front; the first load may download it, so call it off the event loop."""
+    return _get_encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(len(text) // 4, len(text.split()))
+
+
+def _head(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _tail(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[-max_tokens:])
+    return text[-max_tokens * 4:]
+
+
+def budget_for(agent: str) -> int:
+    return int(os.getenv(f"PROMPT_BUDGET_{agent.upper()}", DEFAULT_BUDGETS.get(agent, 3000)))
+
+
+def truncate(text: str, max_tokens: int, strategy: str = "head") -> str:
+    """Shortens `text` to about `max_tokens` tokens using the given strategy."""
+    if not text or count_tokens(text) <= max_tokens:
+        return text or ""
+    if max_tokens <= 0:
+        return ""
+    if strategy == "turns":
+        return _truncate_turns(text, max_tokens)
+    marker_tokens = count_tokens(TRUNCATION_MARKER)
+    if max_tokens <= marker_tokens:
+        return ""  # no room for any text next to the marker
+    keep = max_tokens - marker_tokens
+    if strategy == "tail":
+        return TRUNCATION_MARKER.lstrip() + _tail(text, keep)
+    if strategy == "middle":
+        return _head(text, keep // 2) + TRUNCATION_MARKER + _tail(text, keep - keep // 2)
+    return _head(text, keep) + TRUNCATION_MARKER.rstrip()
+
+
+def _truncate_turns(text: str, max_tokens: int) -> str:
+    # History is "[summary header]User: ...\nAI: ...\n..." (app.summaries.format_turns)
+    header, *turns = re.split(r"(?m)^(?=User: )", text)
+    kept, used = [], 0
+    # The summary covers everything older, so keep it if it takes at most half the budget
+    header_tokens = count_tokens(header)
+    if not turns:
+        # Nothing to make room for; keep as much of the summary as fits
+        return header if header_tokens <= max_tokens else _head(header, max_tokens)
+    if header and header_tokens <= max_tokens // 2:
+        used = header_tokens
+    else:
+        header = ""
+    for turn in reversed(turns):
+        tokens = count_tokens(turn)
+        if used + tokens > max_tokens:
+            if not kept:
+                # Not even the newest turn fits whole; keep its end
+                kept.append(_tail(turn, max_tokens - used))
+            break
+        kept.append(turn)
+        used += tokens
+    return header + "".join(reversed(kept))
+
+
+@dataclass
+class Section:
+    text: str
+    strategy: str = "head"
+    priority: int = 0  # higher priorities are truncated last
+    min_tokens: int = 0  # reserved for this section before higher priorities take the rest
+
+
+class PromptTemplate:
+    def __init__(self, agent: str, template: str):
+        self.agent = agent
+        self.template = template
+        self._static = "".join(literal for literal, _, _, _ in string.Formatter().parse(template))
+        self._static_tokens = None
+
+    @property
+    def static_tokens(self) -> int:
+        # Counted once per template; only the sections are tokenized per request
+        if self._static_tokens is None:
+            self._static_tokens = count_tokens(self._static)
+        return self._static_tokens
+
+    def render(self, budget: int = None, **values) -> str:
+        """
+        Fills the template. Values may be plain strings (never truncated) or
+        `Section`s, which are cut to fit the budget in priority order.
+        """
+        budget = budget or budget_for(self.agent)
+        rendered, tokens, sections = {}, {}, {}
+        for key, value in values.items():
+            if isinstance(value, Section):
+                sections[key] = value
+                tokens[key] = count_tokens(value.text)
+                rendered[key] = value.text
+            else:
+                rendered[key] = value
+                tokens[key] = count_tokens(str(value))
+        available = budget - self.static_tokens - sum(tokens[k] for k in rendered if k not in sections)
+
+        if sum(tokens[k] for k in sections) > available:
+            metrics.inc(f"prompt_truncated.{self.agent}")
+            order = sorted(sections, key=lambda k: -sections[k].priority)
+            for i, key in enumerate(order):
+                reserved = sum(min(sections[k].min_tokens, tokens[k]) for k in order[i + 1:])
+                allowed = max(min(tokens[key], available - reserved), 0)
+                if allowed < tokens[key]:
+                    rendered[key] = truncate(sections[key].text, allowed, sections[key].strategy)
+                    tokens[key] = count_tokens(rendered[key])
+                available -= tokens[key]
+
+        metrics.observe(f"prompt_tokens.{self.agent}", self.static_tokens + sum(tokens.values()))
+        return self.template.format(**rendered)
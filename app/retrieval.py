@@ -0,0 +1,119 @@
+"""
+Retrieval backends for `suggest_next`.
+
+- PineconeBackend: remote query against the Pinecone index (default).
+- LocalVectorIndex: in-process NumPy index over the whole catalog. Embeddings
+  are L2-normalized float32 rows in a memory-mapped `.npy` file with a `.json`
+  sidecar holding ids and metadata; build it with scripts/export_pinecone_index.py.
+  Type/difficulty filters and completed-item exclusion are applied as masks
+  before ranking, and scoring is a single vectorized matrix-vector product.
+
+Both return matches as dicts: {"id": str, "score": float, "metadata": dict}.
+"""
+import asyncio
+import json
+import os
+
+import numpy as np
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pinecone")  # pinecone | local
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "catalog_index")
+
+
+class RetrievalBackend:
+    async def query(self, vector, top_k: int = 5, item_type: str = None, difficulty: str = None,
+                    exclude_ids=None) -> list:
+        raise NotImplementedError
+
+
+class PineconeBackend(RetrievalBackend):
+    def __init__(self, index):
+        self.index = index
+
+    async def query(self, vector, top_k=5, item_type=None, difficulty=None, exclude_ids=None):
+        pinecone_filter = {}
+        if item_type:
+            pinecone_filter["type"] = {"$eq": item_type}
+        if difficulty:
+            pinecone_filter["difficulty"] = {"$eq": difficulty}
+        results = await asyncio.to_thread(
+            self.index.query,
+            vector=list(vector),
+            top_k=top_k,
+            include_metadata=True,
+            filter=pinecone_filter or None,
+        )
+        exclude_ids = exclude_ids or ()
+        # Pinecone can't filter on ids, so completed items are dropped after ranking
+        return [
+            {"id": match["id"], "score": match["score"], "metadata": match["metadata"] or {}}
+            for match in results["matches"]
+            if match["id"] not in exclude_ids
+        ]
+
+
+class LocalVectorIndex(RetrievalBackend):
+    def __init__(self, ids, metadata, embeddings):
+        self.ids = list(ids)
+        self.metadata = list(metadata)
+        self.embeddings = embeddings
+        self._row_of = {item_id: row for row, item_id in enumerate(self.ids)}
+        self._types = np.array([m.get("type", "") for m in self.metadata])
+        self._difficulties = np.array([m.get("difficulty", "") for m in self.metadata])
+
+    @classmethod
+    def load(cls, path: str = None):
+        path = path or LOCAL_INDEX_PATH
+        with open(f"{path}.json") as f:
+            sidecar = json.load(f)
+        embeddings = np.load(f"{path}.npy", mmap_mode="r")
+        if embeddings.shape[0] != len(sidecar["ids"]):
+            raise ValueError(f"{path}: {embeddings.shape[0]} vectors but {len(sidecar['ids'])} ids")
+        print(f"Local vector index loaded from {path} ({embeddings.shape[0]} x {embeddings.shape[1]})", flush=True)
+        return cls(sidecar["ids"], sidecar["metadata"], embeddings)
+
+    @staticmethod
+    def save(path: str, ids, metadata, vectors):
+        """Writes normalized vectors and the id/metadata sidecar, atomically per file."""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        with open(f"{path}.npy.tmp", "wb") as f:
+            np.save(f, matrix)
+        with open(f"{path}.json.tmp", "w") as f:
+            json.dump({"ids": list(ids), "metadata": list(metadata)}, f)
+        os.replace(f"{path}.npy.tmp", f"{path}.npy")
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+
+    def metadata_by_id(self) -> dict:
+        return dict(zip(self.ids, self.metadata))
+
+    def search(self, vector, top_k=5, item_type=None, difficulty=None, exclude_ids=None):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if item_type:
+            mask &= self._types == item_type
+        if difficulty:
+            mask &= self._difficulties == difficulty
+        if exclude_ids:
+            rows = [self._row_of[i] for i in exclude_ids if i in self._row_of]
+            mask[rows] = False
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.embeddings[candidates] @ query
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.ids[candidates[i]], "score": float(scores[i]), "metadata": self.metadata[candidates[i]]}
+            for i in top
+        ]
+
+    async def query(self, vector, top_k=5, item_type=None, difficulty=None, exclude_ids=None):
+        # Sub-millisecond for catalog-sized indexes, so it runs inline on the event loop
+        return self.search(vector, top_k, item_type, difficulty, exclude_ids)
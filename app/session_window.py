@@ -0,0 +1,155 @@
+"""
+Per-session window of recent conversation turns, kept in process.
+
+The orchestrator writes each finished turn through to the session's window, so
+follow-up messages build their context from memory; Postgres is only read on a
+miss (new session, evicted or expired window). Each window also holds the
+session's rolling summary row, updated by app.summaries after it is stored.
+
+Windows are per worker, so with several workers another one may store newer
+turns or a newer summary. With SESSION_WINDOW_LISTEN, each worker listens on
+SESSION_WINDOW_CHANNEL, fed by the triggers in migrations/005_session_notify.sql,
+and drops a window when a turn or summary newer than its own arrives; the
+worker that wrote it already holds it, so its window stays. Without the
+listener, route a session to one worker (sticky sessions) or keep
+SESSION_WINDOW_TTL short. If the listener connection drops, all windows are
+cleared because notifications may have been missed.
+"""
+import asyncio
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from app import metrics
+from app.cache import TTLCache
+from app.db import listen_forever
+
+SESSION_WINDOW_ENABLED = os.getenv("SESSION_WINDOW_ENABLED", "true").lower() == "true"
+SESSION_WINDOW_MAX_SESSIONS = int(os.getenv("SESSION_WINDOW_MAX_SESSIONS", "5000"))
+SESSION_WINDOW_TURNS = int(os.getenv("SESSION_WINDOW_TURNS", "5"))  # matches fetch_previous_conversations' limit
+SESSION_WINDOW_TTL = float(os.getenv("SESSION_WINDOW_TTL", "1800"))
+SESSION_WINDOW_CHANNEL = os.getenv("SESSION_WINDOW_CHANNEL", "session_changed")
+SESSION_WINDOW_LISTEN = os.getenv("SESSION_WINDOW_LISTEN", "true").lower() == "true"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def epoch_micros(value) -> int:
+    """Microseconds since the epoch, exactly as the notify triggers encode timestamps."""
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def turn_chars(user_query: str, ai_response: str) -> int:
+    # Length of the turn as rendered by app.summaries.format_turns
+    return len("User: \nAI: \n") + len(user_query or "") + len(ai_response or "")
+
+
+class SessionWindow:
+    def __init__(self, max_turns: int, summary_row=None):
+        self._turns = deque(maxlen=max_turns)  # (turn dict, rendered length)
+        self.summary_row = summary_row
+        self.chars = 0
+
+    def append(self, user_query: str, ai_response: str, date_time):
+        if len(self._turns) == self._turns.maxlen:
+            self.chars -= self._turns[0][1]
+        chars = turn_chars(user_query, ai_response)
+        self._turns.append(({"user_query": user_query, "ai_response": ai_response, "date_time": date_time}, chars))
+        self.chars += chars
+
+    @property
+    def latest(self):
+        return self._turns[-1][0]["date_time"] if self._turns else None
+
+    def is_behind(self, kind: str, micros: int) -> bool:
+        """Whether a stored turn or summary at `micros` is newer than what this window holds."""
+        if kind == "turn":
+            held = self.latest
+        else:
+            held = self.summary_row["summarized_until"] if self.summary_row else None
+        return held is None or epoch_micros(held) < micros
+
+    def turns(self, max_chars: int = None):
+        """Returns turns oldest first; with `max_chars`, only the newest ones needed to fill it."""
+        if max_chars is None or self.chars <= max_chars:
+            return [turn for turn, _ in self._turns]
+        kept, total = [], 0
+        for turn, chars in reversed(self._turns):
+            kept.append(turn)
+            total += chars
+            if total >= max_chars:
+                break
+        kept.reverse()
+        return kept
+
+
+class SessionWindowCache:
+    def __init__(self, max_sessions: int = SESSION_WINDOW_MAX_SESSIONS, max_turns: int = SESSION_WINDOW_TURNS,
+                 ttl: float = SESSION_WINDOW_TTL):
+        self.max_turns = max_turns
+        self._windows = TTLCache(maxsize=max_sessions, ttl=ttl)
+        self._listener_task = None
+
+    def get(self, session_id: str):
+        window = self._windows.get(session_id)
+        metrics.inc("session_window.hit" if window is not None else "session_window.miss")
+        return window
+
+    def fill(self, session_id: str, rows, summary_row=None) -> SessionWindow:
+        """Creates the window from turns read from Postgres (oldest first)."""
+        window = SessionWindow(self.max_turns, summary_row)
+        for row in rows:
+            window.append(row["user_query"], row["ai_response"], row["date_time"])
+        self._windows.set(session_id, window)
+        metrics.set_gauge("session_window.sessions", len(self._windows))
+        return window
+
+    def append(self, session_id: str, user_query: str, ai_response: str, date_time):
+        # Only extend windows we hold; without one we don't know the earlier turns
+        window = self._windows.get(session_id)
+        if window is not None:
+            window.append(user_query, ai_response, date_time)
+            self._windows.set(session_id, window)  # renews the TTL
+
+    def set_summary(self, session_id: str, summary_row):
+        window = self._windows.get(session_id)
+        if window is not None:
+            window.summary_row = summary_row
+
+    def invalidate(self, session_id: str = None):
+        if session_id is None:
+            self._windows.clear()
+        else:
+            self._windows.pop(session_id)
+        metrics.inc("session_window.invalidations")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        # "<turn|summary>:<epoch microseconds>:<session_id>"
+        try:
+            kind, micros, session_id = payload.split(":", 2)
+            micros = int(micros)
+        except ValueError:
+            self.invalidate()
+            return
+        window = self._windows.get(session_id)
+        if window is not None and window.is_behind(kind, micros):
+            self.invalidate(session_id)
+
+    def start_listener(self):
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(
+                listen_forever(SESSION_WINDOW_CHANNEL, self._on_notify, self.invalidate, "Session windows"),
+                name="session-window-listener",
+            )
+
+    async def stop_listener(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+
+session_windows = SessionWindowCache()
@@ -0,0 +1,91 @@
+"""
+Speculative agent execution.
+
+While the LLM router is deciding, the orchestrator can start the agent that
+handled the previous turn (`last_agent`), since the router usually picks it
+again. Its tokens are buffered rather than yielded. If the router agrees, the
+buffer is flushed and streaming continues from the same generator; otherwise
+the run is cancelled and the chosen agent starts from scratch.
+
+At most `max_tokens` are generated before the decision. Pausing the read
+wouldn't stop the upstream completion (still generated, still billed), so once
+the ceiling is reached the stream is closed and the run marked `exhausted`; a
+confirmed exhausted run is treated like a miss and the agent starts over.
+"""
+import asyncio
+import time
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class SpeculativeRun:
+    def __init__(self, agent: str, make_stream, max_tokens: int):
+        """`make_stream(confirmed)` builds the agent's token generator; agents with
+        side effects (e.g. running code) should wait on `confirmed` before them."""
+        self.agent = agent
+        self.max_tokens = max_tokens
+        self.confirmed = asyncio.Event()
+        self.buffered = 0
+        self.exhausted = False
+        self.first_token_at = None
+        self.started_at = time.perf_counter()
+        self._queue = asyncio.Queue()
+        self._stream = make_stream(self.confirmed)
+        self._task = asyncio.create_task(self._pump(), name=f"speculative-{agent}")
+
+    async def _pump(self):
+        try:
+            async for token in self._stream:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                self._queue.put_nowait(token)
+                if not self.confirmed.is_set():
+                    self.buffered += 1
+                    if self.buffered >= self.max_tokens:
+                        # Cost ceiling reached: close the upstream completion so it stops generating
+                        self.exhausted = True
+                        break
+            if self.exhausted:
+                await self._stream.aclose()
+                self._queue.put_nowait(_Failure(RuntimeError("Speculative run hit its token ceiling")))
+                return
+            self._queue.put_nowait(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._queue.put_nowait(_Failure(e))
+
+    def confirm(self) -> bool:
+        """Confirms the run; False if it already hit the token ceiling and must be restarted."""
+        if self.exhausted:
+            return False
+        self.confirmed.set()
+        return True
+
+    async def stream(self):
+        """Confirms the run and yields the buffered tokens followed by the rest of the stream."""
+        self.confirmed.set()
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            if not self._task.done():
+                await self.cancel()
+
+    async def cancel(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self._stream.aclose()
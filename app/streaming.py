@@ -0,0 +1,139 @@
+"""
+Helpers for streamed HTTP responses: SSE/NDJSON framing, response-mode
+negotiation, token coalescing and time-to-first-byte metrics.
+"""
+import asyncio
+import json
+import os
+import time
+
+from app import metrics
+
+# Consecutive token events are merged until this many characters or this much time has passed
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "256"))
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "50"))
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # stop nginx from buffering the stream
+}
+
+
+def sse_event(event: str, data) -> str:
+    """Formats one Server-Sent Event; data is JSON-encoded so newlines in tokens are safe."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def ndjson_event(event: str, data) -> str:
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+def _accept_qualities(accept: str) -> dict:
+    """Maps each media type in an Accept header to its q-value."""
+    qualities = {}
+    for part in accept.lower().split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type:
+            qualities[media_type] = max(q, qualities.get(media_type, 0.0))
+    return qualities
+
+
+def negotiate_mode(stream: str = None, accept: str = None, default: str = "json") -> str:
+    """
+    Picks the response mode from an explicit `?stream=` value, then the Accept header.
+    Returns "sse", "ndjson", "text", "json" or `default`.
+
+    `text/plain` only selects text mode when the client ranks it above
+    `application/json`: HTTP clients such as axios send
+    "application/json, text/plain, */*" by default and expect JSON.
+    """
+    if stream:
+        stream = stream.lower()
+        if stream in ("sse", "ndjson", "text", "json"):
+            return stream
+        if stream in ("1", "true"):
+            return "text"
+    qualities = _accept_qualities(accept or "")
+    if qualities.get("text/event-stream", 0) > 0:
+        return "sse"
+    if qualities.get("application/x-ndjson", 0) > 0:
+        return "ndjson"
+    if qualities.get("text/plain", 0) > qualities.get("application/json", 0):
+        return "text"
+    return default
+
+
+async def record_ttfb(chunks, name: str, started: float = None):
+    """Passes chunks through, recording `<name>.ttfb_ms` when the first one is sent."""
+    started = started or time.perf_counter()
+    first = True
+    async for chunk in chunks:
+        if first:
+            metrics.observe(f"{name}.ttfb_ms", (time.perf_counter() - started) * 1000)
+            first = False
+        yield chunk
+
+
+async def coalesce_tokens(events, max_chars: int = STREAM_COALESCE_CHARS, window_ms: float = STREAM_COALESCE_MS):
+    """
+    Merges consecutive ("token", {"text": ...}) events from an (event, data)
+    stream into chunks of up to `max_chars`, flushed at the latest `window_ms`
+    after the first buffered token. The first token is passed through at once so
+    time-to-first-token isn't delayed; other events flush the buffer first.
+    """
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    upstream = events.__aiter__()
+    pending = None
+    buffer, buffered, deadline = [], 0, None
+    sent_token = False
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(upstream.__anext__())
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "token", {"text": "".join(buffer)}
+                buffer, buffered = [], 0
+                continue
+            item, pending = pending, None
+            try:
+                event, data = item.result()
+            except StopAsyncIteration:
+                break
+            if event == "token":
+                if not sent_token:
+                    sent_token = True
+                    yield event, data
+                    continue
+                if not buffer:
+                    deadline = loop.time() + window
+                buffer.append(data["text"])
+                buffered += len(data["text"])
+                if buffered >= max_chars:
+                    yield "token", {"text": "".join(buffer)}
+                    buffer, buffered = [], 0
+                continue
+            if buffer:
+                yield "token", {"text": "".join(buffer)}
+                buffer, buffered = [], 0
+            yield event, data
+        if buffer:
+            yield "token", {"text": "".join(buffer)}
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(upstream, "aclose"):
+            await upstream.aclose()
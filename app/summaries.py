@@ -0,0 +1,92 @@
+"""
+Rolling per-session conversation summaries.
+
+Rather than re-summarizing the whole history on every request, each session
+keeps a summary in `conversation_summaries` that is folded forward from the
+previous summary plus only the turns added since. Updates run in the
+background after the response is saved; the request path just reads the
+current summary.
+"""
+import os
+import time
+
+from app import metrics
+from app.db import fetch_session_turns_since, get_conversation_summary, upsert_conversation_summary
+from app.llm import ask_llm_stream
+from app.session_window import session_windows
+
+MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "4000"))
+# Fold turns into the summary once this much unsummarized text has built up
+SUMMARY_UPDATE_CHARS = int(os.getenv("SUMMARY_UPDATE_CHARS", "2000"))
+SUMMARY_MAX_NEW_TURNS = int(os.getenv("SUMMARY_MAX_NEW_TURNS", "50"))
+
+INITIAL_SUMMARY_PROMPT = """Summarize the following conversation history for context in 5 concise bullet points:
+{turns}"""
+
+ROLLING_SUMMARY_PROMPT = """Here is a summary of a tutoring conversation so far:
+{summary}
+
+Here are the newest turns of the same conversation:
+{turns}
+
+Update the summary so it also covers the newest turns. Reply with at most 5 concise bullet points and nothing else."""
+
+SUMMARY_HEADER = "\nSummary of previous conversation history:\n"
+
+_refreshing = set()
+
+
+def format_turns(rows) -> str:
+    return "".join(f"User: {row['user_query']}\nAI: {row['ai_response']}\n" for row in rows)
+
+
+def build_session_context(recent_turns, summary_row) -> str:
+    """
+    Combines the stored summary with the recent turns it does not cover yet,
+    keeping the newest text if the result is still over MAX_CONTEXT_CHARS.
+    """
+    if summary_row:
+        recent_turns = [t for t in recent_turns if t["date_time"] > summary_row["summarized_until"]]
+        header = SUMMARY_HEADER + summary_row["summary"].strip() + "\n"
+    else:
+        header = ""
+    turns_text = format_turns(recent_turns)
+    budget = max(MAX_CONTEXT_CHARS - len(header), 0)
+    if len(turns_text) > budget:
+        turns_text = turns_text[len(turns_text) - budget:]
+    return header + turns_text
+
+
+async def refresh_session_summary(session_id: str):
+    """Folds turns saved since the last summary into it. Meant to run in the background."""
+    if session_id is None or session_id in _refreshing:
+        # A refresh already in flight will pick up these turns on the next request
+        return
+    _refreshing.add(session_id)
+    try:
+        current = await get_conversation_summary(session_id)
+        since = current["summarized_until"] if current else None
+        turns = await fetch_session_turns_since(session_id, since, SUMMARY_MAX_NEW_TURNS)
+        new_text = format_turns(turns)
+        if not turns or len(new_text) < SUMMARY_UPDATE_CHARS:
+            return
+
+        if current:
+            prompt = ROLLING_SUMMARY_PROMPT.format(summary=current["summary"], turns=new_text)
+        else:
+            prompt = INITIAL_SUMMARY_PROMPT.format(turns=new_text)
+
+        start = time.perf_counter()
+        summary = ""
+        async for token in ask_llm_stream(prompt, purpose="summary"):
+            summary += token
+        metrics.observe("summary.update_ms", (time.perf_counter() - start) * 1000)
+
+        turn_count = (current["turn_count"] if current else 0) + len(turns)
+        await upsert_conversation_summary(session_id, summary.strip(), turns[-1]["date_time"], turn_count)
+        session_windows.set_summary(session_id, {
+            "summary": summary.strip(), "summarized_until": turns[-1]["date_time"], "turn_count": turn_count
+        })
+        metrics.inc("summary.updates")
+    finally:
+        _refreshing.discard(session_id)
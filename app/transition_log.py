@@ -0,0 +1,143 @@
+"""
+Append-only log of the tuner's (state, action, reward, next_state) transitions,
+for offline replay with scripts/train_tuner.py.
+
+Off by default (TUNER_TRANSITION_LOG_ENABLED). Each worker appends to its own
+<TUNER_STATE_DIR>/transitions/<id>-<n>.transitions files of fixed-size
+TRANSITION_DTYPE records (no header), so files can be memory-mapped and
+concatenated. States are stored as the raw feature rows (StateEncoder.FEATURES
+order) rather than encoded indices, so a log can be replayed with different
+TUNER_STATE_BINS. Records are buffered and written from a thread once
+TUNER_TRANSITION_FLUSH_RECORDS accumulate, and on shutdown.
+
+A worker moves on to a new file once its current one reaches
+TUNER_TRANSITION_FILE_MB; the oldest files in the directory (from any worker,
+including exited ones) are then deleted until the directory fits in
+TUNER_TRANSITION_MAX_MB.
+"""
+import asyncio
+import glob
+import os
+
+import numpy as np
+
+from app.tuner_store import TUNER_STATE_DIR
+
+TUNER_TRANSITION_LOG_ENABLED = os.getenv("TUNER_TRANSITION_LOG_ENABLED", "false").lower() == "true"
+TUNER_TRANSITION_DIR = os.getenv("TUNER_TRANSITION_DIR", os.path.join(TUNER_STATE_DIR, "transitions"))
+TUNER_TRANSITION_FLUSH_RECORDS = int(os.getenv("TUNER_TRANSITION_FLUSH_RECORDS", "1000"))
+TUNER_TRANSITION_FILE_MB = float(os.getenv("TUNER_TRANSITION_FILE_MB", "64"))
+TUNER_TRANSITION_MAX_MB = float(os.getenv("TUNER_TRANSITION_MAX_MB", "1024"))
+
+TRANSITION_DTYPE = np.dtype([
+    ("state", "<f4", (5,)),
+    ("action", "u1"),
+    ("reward", "<f4"),
+    ("next_state", "<f4", (5,)),
+])
+
+
+def read_transitions(directory: str = TUNER_TRANSITION_DIR) -> np.ndarray:
+    """Memory-maps every log in `directory`; a partial trailing record (crash mid-write) is ignored."""
+    parts = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.transitions"))):
+        count = os.path.getsize(path) // TRANSITION_DTYPE.itemsize
+        if count:
+            parts.append(np.memmap(path, dtype=TRANSITION_DTYPE, mode="r", shape=(count,)))
+    if not parts:
+        return np.empty(0, dtype=TRANSITION_DTYPE)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def prune_transitions(directory: str, max_bytes: float, keep: str = None) -> int:
+    """Deletes the oldest logs in `directory` until the rest fit in `max_bytes`; returns how many."""
+    files = []
+    for path in glob.glob(os.path.join(directory, "*.transitions")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+class TransitionLog:
+    def __init__(self, shard_id: str, directory: str = TUNER_TRANSITION_DIR,
+                 flush_records: int = TUNER_TRANSITION_FLUSH_RECORDS,
+                 file_mb: float = TUNER_TRANSITION_FILE_MB, max_mb: float = TUNER_TRANSITION_MAX_MB):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_id = shard_id
+        self.flush_records = flush_records
+        self.file_bytes = file_mb * 1024 * 1024
+        self.max_bytes = max_mb * 1024 * 1024
+        self._file_index = 0
+        self.path = self._file_path()
+        self._size = None  # unknown until the first write, which also prunes
+        self._pending = []
+        self._pending_count = 0
+        self._flushing = None
+
+    def _file_path(self):
+        return os.path.join(self.directory, f"{self.shard_id}-{self._file_index}.transitions")
+
+    def _write(self, records):
+        # Runs in a thread, one write at a time
+        if self._size is not None and self._size >= self.file_bytes:
+            self._file_index += 1
+            self.path = self._file_path()
+            self._size = None
+        if self._size is None:
+            self._size = 0
+            removed = prune_transitions(self.directory, self.max_bytes - self.file_bytes, keep=self.path)
+            if removed:
+                print(f"Pruned {removed} transition logs in {self.directory}", flush=True)
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+        self._size += records.nbytes
+
+    def append(self, states, actions, rewards, next_states):
+        records = np.empty(len(actions), dtype=TRANSITION_DTYPE)
+        records["state"] = states
+        records["action"] = actions
+        records["reward"] = rewards
+        records["next_state"] = next_states
+        self._pending.append(records)
+        self._pending_count += len(records)
+        if self._pending_count >= self.flush_records:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered records from a thread; one write at a time keeps them in order."""
+        if not self._pending or (self._flushing is not None and not self._flushing.done()):
+            return self._flushing
+        records = np.concatenate(self._pending)
+        self._pending, self._pending_count = [], 0
+        self._flushing = asyncio.create_task(asyncio.to_thread(self._write, records),
+                                             name="tuner-transition-flush")
+        self._flushing.add_done_callback(self._flushed)
+        return self._flushing
+
+    def _flushed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Transition log write failed: {task.exception()}", flush=True)
+
+    async def close(self):
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        task = self.flush()
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
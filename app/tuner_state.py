@@ -0,0 +1,335 @@
+"""
+Sharded tuner state: a Q-table per cohort and an exploration schedule per learner.
+
+`TunerService` runs VectorizedTunerAgent's batched Q-learning step against a
+state backend (TUNER_STATE_BACKEND):
+
+- local: dense tables in process, one VectorizedTunerAgent per cohort,
+  persisted by TunerStore (the global cohort in TUNER_STATE_DIR, others in
+  TUNER_STATE_DIR/cohorts/<cohort>). Learner step counts are per worker, so
+  route learners to the same worker for exact schedules.
+- redis: tables and step counts in Redis or any protocol-compatible server,
+  shared by every worker and pod. Q updates are sent as HINCRBYFLOAT deltas,
+  so concurrent updates from different workers add up instead of overwriting
+  each other.
+
+Cohorts (TUNER_COHORT_BY):
+- global: one table for everyone, as before
+- request: the `cohort` the caller sends (global if absent); names outside
+  TUNER_ALLOWED_COHORTS, or beyond TUNER_MAX_COHORTS distinct names when no
+  allow-list is set, are rejected, since each one costs a table, files and a
+  flush task that are never evicted
+- user: user_id hashed into TUNER_COHORTS buckets
+
+Each learner explores with epsilon_min <= epsilon * epsilon_decay ** steps over
+their own steps; requests without a user_id share one anonymous schedule.
+"""
+import asyncio
+import os
+import re
+import uuid
+import zlib
+
+import numpy as np
+
+from app import metrics
+from app.agents.vectorized_tuner import VectorizedTunerAgent
+from app.cache import TTLCache
+from app.transition_log import TUNER_TRANSITION_DIR, TUNER_TRANSITION_LOG_ENABLED, TransitionLog
+from app.tuner_store import TUNER_STATE_DIR, TunerStore
+
+TUNER_STATE_BACKEND = os.getenv("TUNER_STATE_BACKEND", "local")  # local | redis
+TUNER_REDIS_URL = os.getenv("TUNER_REDIS_URL", "redis://localhost:6379/0")
+TUNER_COHORT_BY = os.getenv("TUNER_COHORT_BY", "global")  # global | request | user
+TUNER_COHORTS = int(os.getenv("TUNER_COHORTS", "16"))
+TUNER_ALLOWED_COHORTS = frozenset(c.strip() for c in os.getenv("TUNER_ALLOWED_COHORTS", "").split(",") if c.strip())
+TUNER_MAX_COHORTS = int(os.getenv("TUNER_MAX_COHORTS", "32"))  # request cohorts per worker without an allow-list
+TUNER_MAX_LEARNERS = int(os.getenv("TUNER_MAX_LEARNERS", "100000"))
+TUNER_LEARNER_TTL = float(os.getenv("TUNER_LEARNER_TTL", str(30 * 86400)))
+
+GLOBAL_COHORT = "global"
+COHORT_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")  # cohorts name directories and Redis keys
+ANONYMOUS_LEARNER = "anonymous"
+
+
+def cohort_dir(cohort: str) -> str:
+    if cohort == GLOBAL_COHORT:
+        return TUNER_STATE_DIR
+    return os.path.join(TUNER_STATE_DIR, "cohorts", cohort)
+
+
+def transition_dir(cohort: str) -> str:
+    if cohort == GLOBAL_COHORT:
+        return TUNER_TRANSITION_DIR
+    return os.path.join(cohort_dir(cohort), "transitions")
+
+
+def _occurrence_offsets(keys):
+    """For each key, how many times it appeared earlier in `keys`, plus the total per key."""
+    seen, offsets = {}, []
+    for key in keys:
+        offsets.append(seen.get(key, 0))
+        seen[key] = offsets[-1] + 1
+    return offsets, seen
+
+
+class LocalTunerState:
+    def __init__(self, agent: VectorizedTunerAgent, max_learners: int = TUNER_MAX_LEARNERS,
+                 learner_ttl: float = TUNER_LEARNER_TTL, **store_options):
+        self._template = agent
+        self._store_options = store_options  # passed to each cohort's TunerStore
+        self._tables = {GLOBAL_COHORT: (agent, TunerStore(agent, **store_options))}
+        self._opening = {}
+        self._learners = TTLCache(maxsize=max_learners, ttl=learner_ttl)
+
+    async def open(self):
+        _, store = self._tables[GLOBAL_COHORT]
+        await asyncio.to_thread(store.open)
+        store.start()
+
+    async def _table(self, cohort):
+        table = self._tables.get(cohort)
+        if table is None:
+            # Single-flight: concurrent first requests for a cohort share one open
+            task = self._opening.get(cohort)
+            if task is None:
+                task = self._opening[cohort] = asyncio.create_task(self._open_cohort(cohort),
+                                                                   name=f"tuner-cohort-{cohort}")
+                task.add_done_callback(lambda _: self._opening.pop(cohort, None))
+            table = await asyncio.shield(task)
+        return table
+
+    def _load_cohort(self, cohort):
+        template = self._template
+        agent = VectorizedTunerAgent(actions=template.actions, alpha=template.alpha, delta=template.delta,
+                                     encoder=template.encoder, filepath=template.filepath)
+        store = TunerStore(agent, directory=cohort_dir(cohort), **self._store_options)
+        store.open()
+        return agent, store
+
+    async def _open_cohort(self, cohort):
+        agent, store = await asyncio.to_thread(self._load_cohort, cohort)
+        store.start()
+        self._tables[cohort] = (agent, store)
+        metrics.set_gauge("tuner.cohorts", len(self._tables))
+        return agent, store
+
+    async def learner_steps(self, user_ids) -> np.ndarray:
+        offsets, totals = _occurrence_offsets(user_ids)
+        before = {user: self._learners.get(user, 0) for user in totals}
+        for user, count in totals.items():
+            self._learners.set(user, before[user] + count)
+        return np.array([before[user] + offset for user, offset in zip(user_ids, offsets)], dtype=np.float64)
+
+    async def rows(self, cohort, states):
+        agent, _ = await self._table(cohort)
+        return agent.q[states], agent.visits[states]
+
+    async def update(self, cohort, cell_states, cell_actions, q_deltas, visited_states):
+        agent, store = await self._table(cohort)
+        agent.q[cell_states, cell_actions] += q_deltas
+        np.add.at(agent.visits, visited_states, 1)
+        store.record_updates(len(visited_states))
+
+    async def close(self):
+        for _, store in list(self._tables.values()):
+            await store.close()
+
+
+class RedisTunerState:
+    def __init__(self, url: str, n_actions: int, learner_ttl: float = TUNER_LEARNER_TTL):
+        import redis.asyncio as redis  # optional dependency
+
+        self._redis = redis.from_url(url)
+        self.n_actions = n_actions
+        self.learner_ttl = int(learner_ttl)
+
+    async def open(self):
+        await self._redis.ping()
+
+    async def learner_steps(self, user_ids) -> np.ndarray:
+        offsets, totals = _occurrence_offsets(user_ids)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user, count in totals.items():
+                pipe.incrby(f"tuner:learner:{user}", count)
+                pipe.expire(f"tuner:learner:{user}", self.learner_ttl)
+            replies = await pipe.execute()
+        after = dict(zip(totals, replies[::2]))
+        return np.array([after[user] - totals[user] + offset for user, offset in zip(user_ids, offsets)],
+                        dtype=np.float64)
+
+    async def rows(self, cohort, states):
+        fields = [f"{s}:{a}" for s in states.tolist() for a in range(self.n_actions)]
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(f"tuner:{cohort}:q", fields)
+            pipe.hmget(f"tuner:{cohort}:visits", states.tolist())
+            q_values, visits = await pipe.execute()
+        q = np.array([float(v) if v is not None else 0.0 for v in q_values]).reshape(len(states), self.n_actions)
+        return q, np.array([int(v) if v is not None else 0 for v in visits], dtype=np.int64)
+
+    async def update(self, cohort, cell_states, cell_actions, q_deltas, visited_states):
+        states, counts = np.unique(visited_states, return_counts=True)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for s, a, d in zip(cell_states.tolist(), cell_actions.tolist(), q_deltas.tolist()):
+                pipe.hincrbyfloat(f"tuner:{cohort}:q", f"{s}:{a}", d)
+            for s, c in zip(states.tolist(), counts.tolist()):
+                pipe.hincrby(f"tuner:{cohort}:visits", s, c)
+            await pipe.execute()
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def make_tuner_state(agent: VectorizedTunerAgent):
+    if TUNER_STATE_BACKEND == "redis":
+        return RedisTunerState(TUNER_REDIS_URL, len(agent.actions))
+    return LocalTunerState(agent)
+
+
+class TunerService:
+    """
+    Tuner steps against a state backend. `agent` supplies the encoder, actions,
+    hyperparameters and reward/engagement formulas; the tables live in `state`.
+    """
+
+    def __init__(self, state, agent: VectorizedTunerAgent, cohort_by: str = TUNER_COHORT_BY,
+                 cohorts: int = TUNER_COHORTS, log_transitions: bool = TUNER_TRANSITION_LOG_ENABLED,
+                 allowed_cohorts=TUNER_ALLOWED_COHORTS, max_cohorts: int = TUNER_MAX_COHORTS):
+        self.state = state
+        self.agent = agent
+        self.cohort_by = cohort_by
+        self.cohorts = cohorts
+        self.allowed_cohorts = frozenset(allowed_cohorts or ())
+        self.max_cohorts = max_cohorts
+        self._request_cohorts = set()
+        self.log_transitions = log_transitions
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._transition_logs = {}
+
+    def cohort_for(self, user_id=None, cohort=None) -> str:
+        if self.cohort_by == "request" and cohort:
+            cohort = str(cohort)
+            if cohort == GLOBAL_COHORT:
+                return cohort
+            if not COHORT_PATTERN.fullmatch(cohort):
+                raise ValueError(f"Invalid cohort {cohort!r}")
+            if self.allowed_cohorts:
+                if cohort not in self.allowed_cohorts:
+                    raise ValueError(f"Unknown cohort {cohort!r}")
+            elif cohort not in self._request_cohorts:
+                if len(self._request_cohorts) >= self.max_cohorts:
+                    metrics.inc("tuner.cohorts_rejected")
+                    raise ValueError(f"Too many cohorts; not opening {cohort!r}")
+                self._request_cohorts.add(cohort)
+            return cohort
+        if self.cohort_by == "user" and user_id is not None:
+            return f"u{zlib.crc32(str(user_id).encode()) % self.cohorts}"
+        return GLOBAL_COHORT
+
+    async def open(self):
+        await self.state.open()
+
+    async def step(self, logs, user_action_metrics, user_id=None, cohort=None):
+        return (await self.step_many([logs], [user_action_metrics], [user_id], [cohort]))[0]
+
+    async def step_many(self, logs_list, metrics_list, user_ids=None, cohorts=None):
+        n = len(logs_list)
+        user_ids = user_ids or [None] * n
+        cohorts = cohorts or [None] * n
+        groups = {}
+        for i, (user_id, cohort) in enumerate(zip(user_ids, cohorts)):
+            groups.setdefault(self.cohort_for(user_id, cohort), []).append(i)
+        results = [None] * n
+        for cohort, indices in groups.items():
+            learners = [ANONYMOUS_LEARNER if user_ids[i] is None else str(user_ids[i]) for i in indices]
+            if len(indices) == 1:
+                i = indices[0]
+                results[i] = await self._step_one(cohort, logs_list[i], metrics_list[i], learners[0])
+                continue
+            cohort_results = await self._step_cohort(
+                cohort, [logs_list[i] for i in indices], [metrics_list[i] for i in indices], learners
+            )
+            for i, result in zip(indices, cohort_results):
+                results[i] = result
+        return results
+
+    async def _step_one(self, cohort, logs, user_action_metrics, learner):
+        # Scalar path for single requests; NumPy call overhead dominates for one row
+        agent, encoder = self.agent, self.agent.encoder
+        features = encoder.features(logs)
+        state = encoder.encode(logs)
+        R = agent.reward_optimization(user_action_metrics.get("gain", 1.0), user_action_metrics.get("cost", 0.1))
+        logs["engagement"] = agent.engagement_dynamics(
+            logs.get("engagement", 0), R, user_action_metrics.get("disengagement", 0.05)
+        )
+        next_state = encoder.encode(logs)
+
+        steps = (await self.state.learner_steps([learner]))[0]
+        epsilon = max(agent.epsilon_min, agent.epsilon * agent.epsilon_decay ** steps)
+        q, visits = await self.state.rows(cohort, np.array([state, next_state]))
+        row = q[0].tolist()
+        if agent._rng.random() < epsilon or visits[0] == 0:
+            action = int(agent._rng.integers(len(agent.actions)))
+        else:
+            action = row.index(max(row))
+        target = R + agent.delta * max(q[1].tolist())
+        state_array = np.array([state])
+        await self.state.update(cohort, state_array, np.array([action]),
+                                np.array([agent.alpha * (target - row[action])]), state_array)
+
+        if self.log_transitions:
+            self._transition_log(cohort).append([features], [action], [R], [encoder.features(logs)])
+        metrics.inc(f"tuner.steps.{cohort}")
+        return agent.actions[action], logs
+
+    async def _step_cohort(self, cohort, logs_list, metrics_list, learners):
+        agent, encoder = self.agent, self.agent.encoder
+        n, n_actions = len(logs_list), len(agent.actions)
+        features = np.array([encoder.features(logs) for logs in logs_list], dtype=np.float64)
+        raw_features = features.copy()
+        states = encoder.encode_many(features)
+
+        gain = np.array([m.get("gain", 1.0) for m in metrics_list], dtype=np.float64)
+        cost = np.array([m.get("cost", 0.1) for m in metrics_list], dtype=np.float64)
+        disengagement = np.array([m.get("disengagement", 0.05) for m in metrics_list], dtype=np.float64)
+        rewards = agent.reward_optimization(gain, cost)
+        features[:, 2] = agent.engagement_dynamics(features[:, 2], rewards, disengagement)
+        next_states = encoder.encode_many(features)
+
+        steps = await self.state.learner_steps(learners)
+        epsilons = np.maximum(agent.epsilon_min, agent.epsilon * agent.epsilon_decay ** steps)
+        needed, positions = np.unique(np.concatenate([states, next_states]), return_inverse=True)
+        q, visits = await self.state.rows(cohort, needed)
+        here, there = positions[:n], positions[n:]
+
+        explore = (agent._rng.random(n) < epsilons) | (visits[here] == 0)
+        actions = np.where(explore, agent._rng.integers(0, n_actions, n), np.argmax(q[here], axis=1))
+
+        # Same averaged update as batch_update, sent as deltas so shared backends can apply them atomically
+        targets = rewards + agent.delta * q[there].max(axis=1)
+        cells, first, inverse = np.unique(here * n_actions + actions, return_index=True, return_inverse=True)
+        mean_targets = np.bincount(inverse, weights=targets) / np.bincount(inverse)
+        cell_rows, cell_actions = cells // n_actions, cells % n_actions
+        q_deltas = agent.alpha * (mean_targets - q[cell_rows, cell_actions])
+        await self.state.update(cohort, states[first], cell_actions, q_deltas, states)
+
+        if self.log_transitions:
+            self._transition_log(cohort).append(raw_features, actions, rewards, features)
+        metrics.inc(f"tuner.steps.{cohort}", n)
+
+        results = []
+        for logs, action, engagement in zip(logs_list, actions, features[:, 2]):
+            logs["engagement"] = float(engagement)
+            results.append((agent.actions[action], logs))
+        return results
+
+    def _transition_log(self, cohort):
+        log = self._transition_logs.get(cohort)
+        if log is None:
+            log = self._transition_logs[cohort] = TransitionLog(self.worker_id, directory=transition_dir(cohort))
+        return log
+
+    async def close(self):
+        for log in self._transition_logs.values():
+            await log.close()
+        await self.state.close()
@@ -0,0 +1,266 @@
+"""
+Persistence for VectorizedTunerAgent's Q-table.
+
+Updates only mark the table dirty; a flush runs after TUNER_FLUSH_EVERY updates
+or every TUNER_FLUSH_SECONDS, copying the table on the event loop (a few
+hundred KB) and writing it from a thread with an atomic rename.
+
+Files live in TUNER_STATE_DIR as .npy arrays of shape (states, actions + 1),
+the last column holding visit counts, so they can be memory-mapped:
+
+- base.npy: the consolidated table
+- shard-<id>.npy: one per worker process; the worker's full Q-values plus the
+  visits it added since it loaded the base
+
+Each worker holds an exclusive flock on its shard's .lock file while alive.
+At startup, under a directory lock, shards whose lock can be taken (their
+worker has exited) are merged into base.npy, weighting Q-values by visits,
+and removed; shards of live workers are merged into the starting table but
+left in place.
+
+scripts/train_tuner.py exports an offline-trained table as trained.npy. A
+worker starts from it when it is newer than base.npy, ignoring shards written
+before it, and reloads it within TUNER_RELOAD_SECONDS when it changes.
+"""
+import asyncio
+import fcntl
+import glob
+import os
+import time
+import uuid
+
+import numpy as np
+
+from app import metrics
+
+TUNER_STATE_DIR = os.getenv("TUNER_STATE_DIR", "tuner_state")
+TUNER_FLUSH_EVERY = int(os.getenv("TUNER_FLUSH_EVERY", "500"))
+TUNER_FLUSH_SECONDS = float(os.getenv("TUNER_FLUSH_SECONDS", "30"))
+TUNER_RELOAD_SECONDS = float(os.getenv("TUNER_RELOAD_SECONDS", "10"))
+
+
+def merge_tables(tables):
+    """
+    Visit-weighted merge of (q, visits) pairs. States nobody visited keep the
+    first table's values.
+    """
+    base_q, base_visits = tables[0]
+    weighted = base_q * base_visits[:, None]
+    visits = base_visits.astype(np.float64)
+    for q, v in tables[1:]:
+        weighted += q * v[:, None]
+        visits += v
+    merged = np.where(visits[:, None] > 0, weighted / np.maximum(visits, 1)[:, None], base_q)
+    return merged, visits
+
+
+def read_table(path, shape):
+    data = np.load(path, mmap_mode="r")
+    if data.shape != shape:
+        raise ValueError(f"{path} has shape {data.shape}, expected {shape}")
+    return np.array(data[:, :-1]), np.array(data[:, -1])
+
+
+def write_table(path, q, visits):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.column_stack([q, visits]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class TunerStore:
+    def __init__(self, agent, directory: str = TUNER_STATE_DIR, flush_every: int = TUNER_FLUSH_EVERY,
+                 flush_seconds: float = TUNER_FLUSH_SECONDS, reload_seconds: float = TUNER_RELOAD_SECONDS,
+                 shard_id: str = None):
+        self.agent = agent
+        self.directory = directory
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.reload_seconds = reload_seconds
+        self.shard_id = shard_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.shard_path = os.path.join(directory, f"shard-{self.shard_id}.npy")
+        self.trained_path = os.path.join(directory, "trained.npy")
+        self._shape = (agent.q.shape[0], agent.q.shape[1] + 1)
+        self._lock_file = None
+        self._loaded_visits = None
+        self._dirty = 0
+        self._flushing = None
+        self._periodic = None
+        self._watcher = None
+        self._trained_mtime = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self):
+        """Compacts finished shards, then loads the merged table into the agent."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(self._path(f"shard-{self.shard_id}.lock"), "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        with open(self._path("compact.lock"), "w") as dir_lock:
+            fcntl.flock(dir_lock, fcntl.LOCK_EX)
+            base_path = self._path("base.npy")
+            # Without a usable base, start from what the agent loaded itself (q_table.npz / .pkl)
+            tables = [(self.agent.q.copy(), self.agent.visits.astype(np.float64))]
+            finished, live = [], []
+            if os.path.exists(base_path):
+                try:
+                    tables = [read_table(base_path, self._shape)]
+                except ValueError as e:
+                    print(f"Ignoring tuner base table: {e}", flush=True)
+            trained_mtime = self._mtime(self.trained_path)
+            if trained_mtime is not None and trained_mtime > (self._mtime(base_path) or 0):
+                try:
+                    tables = [read_table(self.trained_path, self._shape)]
+                    self._trained_mtime = trained_mtime
+                except ValueError as e:
+                    print(f"Ignoring trained tuner table: {e}", flush=True)
+            for path in sorted(glob.glob(self._path("shard-*.npy"))):
+                if path == self.shard_path:
+                    continue
+                if self._trained_mtime is not None and (self._mtime(path) or 0) < self._trained_mtime:
+                    # Learned on top of a table the trained one replaces
+                    if self._owner_exited(path):
+                        self._remove_shard(path)
+                    continue
+                try:
+                    table = read_table(path, self._shape)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping tuner shard {path}: {e}", flush=True)
+                    continue
+                (finished if self._owner_exited(path) else live).append((path, table))
+
+            if finished:
+                q, visits = merge_tables(tables + [t for _, t in finished])
+                write_table(base_path, q, visits)
+                for path, _ in finished:
+                    self._remove_shard(path)
+                tables = [(q, visits)]
+                print(f"Compacted {len(finished)} tuner shards into {base_path}", flush=True)
+            elif self._trained_mtime is not None:
+                write_table(base_path, *tables[0])
+
+        self._load(*merge_tables(tables + [t for _, t in live]))
+        if self._trained_mtime is None:
+            self._trained_mtime = self._mtime(self.trained_path)
+
+    def _load(self, q, visits):
+        self.agent.q[:] = q
+        self.agent.visits[:] = visits.astype(self.agent.visits.dtype)
+        self._loaded_visits = self.agent.visits.copy()
+        metrics.set_gauge("tuner.states_visited", int((self.agent.visits > 0).sum()))
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_shard(path):
+        for name in (path, path[:-len(".npy")] + ".lock"):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def _owner_exited(self, shard_path) -> bool:
+        lock_path = shard_path[:-len(".npy")] + ".lock"
+        try:
+            with open(lock_path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+        except BlockingIOError:
+            return False
+
+    def record_updates(self, n: int = 1):
+        """Call after each step (or step_many); schedules a flush once enough updates pile up."""
+        self._dirty += n
+        if self._dirty >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Starts a background write of the current table unless one is already running."""
+        if self._dirty == 0 or (self._flushing is not None and not self._flushing.done()):
+            return self._flushing
+        q = self.agent.q.copy()
+        visits = (self.agent.visits - self._loaded_visits).astype(np.float64)
+        self._dirty = 0
+        self._flushing = asyncio.create_task(self._write_snapshot(q, visits), name="tuner-flush")
+        return self._flushing
+
+    async def _write_snapshot(self, q, visits):
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(write_table, self.shard_path, q, visits)
+            metrics.observe("tuner.flush_ms", (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            print(f"Tuner flush failed: {e}", flush=True)
+            self._dirty += 1  # retry on the next trigger
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.flush()
+
+    async def reload_trained(self) -> bool:
+        """Swaps in trained.npy if it changed since it was last loaded."""
+        mtime = self._mtime(self.trained_path)
+        if mtime is None or mtime == self._trained_mtime:
+            return False
+        try:
+            q, visits = await asyncio.to_thread(read_table, self.trained_path, self._shape)
+        except (OSError, ValueError) as e:
+            print(f"Not reloading trained tuner table: {e}", flush=True)
+            self._trained_mtime = mtime
+            return False
+        if self._flushing is not None:
+            await self._flushing
+        # Updates since the last flush were learned on the replaced table; start over from the trained one
+        self._load(q, visits)
+        self._dirty = 0
+        try:
+            os.remove(self.shard_path)  # keep the .lock: we still hold it
+        except FileNotFoundError:
+            pass
+        self._trained_mtime = mtime
+        metrics.inc("tuner.trained_reloads")
+        print(f"Reloaded trained tuner table from {self.trained_path}", flush=True)
+        return True
+
+    async def _watch_trained(self):
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            await self.reload_trained()
+
+    def start(self):
+        if self._periodic is None:
+            self._periodic = asyncio.create_task(self._flush_periodically(), name="tuner-periodic-flush")
+        if self._watcher is None and self.reload_seconds > 0:
+            self._watcher = asyncio.create_task(self._watch_trained(), name="tuner-trained-watch")
+
+    async def close(self):
+        """Stops the periodic flush and writes any remaining updates."""
+        for task in (self._periodic, self._watcher):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._periodic = self._watcher = None
+        if self._flushing is not None:
+            await self._flushing
+        task = self.flush()
+        if task is not None:
+            await task
+        if self._lock_file is not None:
+            if not os.path.exists(self.shard_path):
+                # Nothing to compact later; don't leave the lock behind
+                os.remove(self._lock_file.name)
+            self._lock_file.close()
+            self._lock_file = None
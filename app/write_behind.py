@@ -0,0 +1,190 @@
+"""
+Write-behind buffer for ai_assistance rows.
+
+Requests enqueue their interaction record instead of inserting it inline; a
+single flusher task writes them in batches (COPY by default) once
+WRITE_BEHIND_BATCH_SIZE rows are pending or WRITE_BEHIND_FLUSH_MS has passed
+since the first one. The queue is bounded, so when Postgres falls behind,
+`enqueue` waits for room (backpressure) instead of growing without limit.
+Transient failures are retried; when a batch is rejected for its data (a
+constraint or foreign key violation, say), its rows are inserted one at a
+time so only the offending ones are dropped.
+Each enqueue returns a future resolved once its row is written, so follow-up
+work such as the session summary refresh can run after the flush.
+"""
+import asyncio
+import os
+import time
+
+import asyncpg
+
+from app import metrics
+from app.db import ai_assistance_record, insert_ai_assistance_batch
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_METHOD = os.getenv("WRITE_BEHIND_METHOD", "copy")  # copy | executemany
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+
+# SQLSTATE classes worth retrying: connection, transaction rollback, resources, operator intervention, system
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57", "58")
+
+_STOP = object()
+
+
+def _rejects_data(error) -> bool:
+    """True for errors Postgres raised about the rows themselves, which retrying won't fix."""
+    sqlstate = getattr(error, "sqlstate", None)
+    return isinstance(error, asyncpg.PostgresError) and bool(sqlstate) and sqlstate[:2] not in TRANSIENT_SQLSTATE_CLASSES
+
+
+class WriteBehindQueue:
+    def __init__(self, batch_size: int = WRITE_BEHIND_BATCH_SIZE, flush_ms: float = WRITE_BEHIND_FLUSH_MS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, method: str = WRITE_BEHIND_METHOD):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_pending = max_pending
+        self.method = method
+        self._queue = None
+        self._batch_ready = asyncio.Event()
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run(), name="write-behind-flusher")
+
+    async def enqueue(self, record) -> asyncio.Future:
+        """Queues a row, waiting while the buffer is full. The returned future resolves once it's written."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        # Retrieve the exception even if nobody awaits the future
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self._queue.full():
+            metrics.inc("write_behind.backpressure")
+            start = time.perf_counter()
+            await self._queue.put((record, future))
+            metrics.observe("write_behind.blocked_ms", (time.perf_counter() - start) * 1000)
+        else:
+            self._queue.put_nowait((record, future))
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+        metrics.set_gauge("write_behind.pending", self._queue.qsize())
+        return future
+
+    async def _next_batch(self):
+        item = await self._queue.get()
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            if self._queue.empty():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return batch, False
+                # Woken early once a full batch is waiting; wait_for only ever cancels the Event wait
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+                if self._queue.empty():
+                    return batch, False
+            item = self._queue.get_nowait()
+
+    async def _flush(self, batch):
+        records = [record for record, _ in batch]
+        delay = 0.1
+        for attempt in range(WRITE_BEHIND_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                await insert_ai_assistance_batch(records, method=self.method)
+                break
+            except Exception as e:
+                if _rejects_data(e) and len(batch) > 1:
+                    print(f"Write-behind batch of {len(records)} rows rejected, inserting one by one: {e}", flush=True)
+                    metrics.inc("write_behind.row_fallback")
+                    await self._flush_rows(batch)
+                    return
+                if attempt == WRITE_BEHIND_RETRIES or _rejects_data(e):
+                    print(f"Write-behind flush of {len(records)} rows failed, dropping them: {e}", flush=True)
+                    metrics.inc("write_behind.dropped", len(records))
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    return
+                print(f"Write-behind flush failed (attempt {attempt + 1}), retrying: {e}", flush=True)
+                await asyncio.sleep(delay)
+                delay *= 2
+        metrics.observe("write_behind.flush_ms", (time.perf_counter() - start) * 1000)
+        metrics.observe("write_behind.batch_size", len(records))
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def _flush_rows(self, batch):
+        for record, future in batch:
+            try:
+                await insert_ai_assistance_batch([record], method="executemany")
+            except Exception as e:
+                print(f"Write-behind dropped a row: {e}", flush=True)
+                metrics.inc("write_behind.dropped")
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(self):
+        while True:
+            batch, stop = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            metrics.set_gauge("write_behind.pending", self._queue.qsize())
+            if stop:
+                return
+
+    async def close(self, timeout: float = 10.0):
+        """Flushes everything queued so far and stops the flusher."""
+        if self._task is None or self._task.done():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            # The queue may be full; the flusher makes room unless Postgres is down
+            await asyncio.wait_for(self._queue.put(_STOP), timeout=timeout)
+            self._batch_ready.set()
+            await asyncio.wait_for(self._task, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            print(f"Write-behind drain timed out with {self._queue.qsize()} rows pending", flush=True)
+            self._task.cancel()
+        self._task = None
+
+
+_writer = WriteBehindQueue()
+
+
+async def enqueue_ai_assistance(**fields):
+    """
+    Records an interaction; returns a future resolved once it is stored, or None
+    if there is nothing to store. Writes inline when WRITE_BEHIND_ENABLED is off.
+    """
+    record = ai_assistance_record(**fields)
+    if record is None:
+        return None
+    if not WRITE_BEHIND_ENABLED:
+        await insert_ai_assistance_batch([record], method="executemany")
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+    return await _writer.enqueue(record)
+
+
+async def close_write_behind():
+    await _writer.close()
@@ -0,0 +1,10 @@
+-- Rolling per-session conversation summaries, maintained in the background by
+-- app/summaries.py so requests only have to read the current summary.
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    -- date_time of the newest ai_assistance row folded into the summary
+    summarized_until TIMESTAMP NOT NULL,
+    turn_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
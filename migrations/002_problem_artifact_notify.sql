@@ -0,0 +1,44 @@
+-- Notify app/problem_cache.py when a problem's solution code or test cases change,
+-- so cached artifacts are invalidated. The payload is the problem id, or '*' for all.
+CREATE OR REPLACE FUNCTION notify_problem_artifacts_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_LEVEL = 'STATEMENT' THEN
+        PERFORM pg_notify('problem_artifacts_changed', '*');
+    ELSIF TG_TABLE_NAME = 'problems' THEN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM pg_notify('problem_artifacts_changed', OLD.id::text);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM pg_notify('problem_artifacts_changed', NEW.id::text);
+        END IF;
+    ELSE
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM pg_notify('problem_artifacts_changed', OLD.problem_id::text);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM pg_notify('problem_artifacts_changed', NEW.problem_id::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS problems_artifacts_changed ON problems;
+CREATE TRIGGER problems_artifacts_changed
+    AFTER INSERT OR UPDATE OR DELETE ON problems
+    FOR EACH ROW EXECUTE FUNCTION notify_problem_artifacts_changed();
+
+DROP TRIGGER IF EXISTS problems_artifacts_truncated ON problems;
+CREATE TRIGGER problems_artifacts_truncated
+    AFTER TRUNCATE ON problems
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_problem_artifacts_changed();
+
+DROP TRIGGER IF EXISTS test_cases_artifacts_changed ON test_cases;
+CREATE TRIGGER test_cases_artifacts_changed
+    AFTER INSERT OR UPDATE OR DELETE ON test_cases
+    FOR EACH ROW EXECUTE FUNCTION notify_problem_artifacts_changed();
+
+DROP TRIGGER IF EXISTS test_cases_artifacts_truncated ON test_cases;
+CREATE TRIGGER test_cases_artifacts_truncated
+    AFTER TRUNCATE ON test_cases
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_problem_artifacts_changed();
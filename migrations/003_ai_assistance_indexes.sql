@@ -0,0 +1,23 @@
+-- Indexes for the conversation-history lookups in app/db.py (fetch_previous_conversations,
+-- fetch_session_turns_since). Each matches one query shape, ending in date_time so the
+-- ORDER BY ... LIMIT is read straight off the index.
+--
+-- user_query/ai_response are deliberately not INCLUDEd: btree entries are limited to about
+-- a third of a page (~2.7kB), so long AI responses would make inserts fail. The heap
+-- fetch for the handful of rows under LIMIT is cheap.
+--
+-- CONCURRENTLY avoids blocking writes on a live table; run this file outside a transaction
+-- (plain `psql -f` does that).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ai_assistance_session_time_idx
+    ON ai_assistance (session_id, date_time DESC)
+    WHERE session_id IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ai_assistance_user_lesson_time_idx
+    ON ai_assistance (user_id, lesson_id, date_time DESC)
+    WHERE lesson_id IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ai_assistance_user_problem_time_idx
+    ON ai_assistance (user_id, problem_id, date_time DESC)
+    WHERE problem_id IS NOT NULL;
+
+ANALYZE ai_assistance;
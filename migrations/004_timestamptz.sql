@@ -0,0 +1,11 @@
+-- ai_assistance rows are timestamped by the app when they are queued (COPY can't
+-- evaluate NOW()), in UTC. Store instants rather than wall-clock times so they
+-- compare correctly with NOW() and with each other whatever the session TimeZone;
+-- existing values are read in the current TimeZone, which is how NOW() wrote them.
+ALTER TABLE ai_assistance
+    ALTER COLUMN date_time TYPE TIMESTAMPTZ,
+    ALTER COLUMN date_time SET DEFAULT NOW();
+
+ALTER TABLE conversation_summaries
+    ALTER COLUMN summarized_until TYPE TIMESTAMPTZ,
+    ALTER COLUMN updated_at TYPE TIMESTAMPTZ;
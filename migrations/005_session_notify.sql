@@ -0,0 +1,27 @@
+-- Notify app/session_window.py when a session gets a new turn or summary, so other
+-- workers drop their cached window. The payload is "<turn|summary>:<epoch microseconds>:<session_id>";
+-- the timestamp lets the worker that wrote the row keep its own, already current, window.
+CREATE OR REPLACE FUNCTION notify_session_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'ai_assistance' THEN
+        IF NEW.session_id IS NOT NULL THEN
+            PERFORM pg_notify('session_changed', 'turn:'
+                || (EXTRACT(EPOCH FROM NEW.date_time) * 1000000)::bigint || ':' || NEW.session_id);
+        END IF;
+    ELSE
+        PERFORM pg_notify('session_changed', 'summary:'
+            || (EXTRACT(EPOCH FROM NEW.summarized_until) * 1000000)::bigint || ':' || NEW.session_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ai_assistance_session_changed ON ai_assistance;
+CREATE TRIGGER ai_assistance_session_changed
+    AFTER INSERT ON ai_assistance
+    FOR EACH ROW EXECUTE FUNCTION notify_session_changed();
+
+DROP TRIGGER IF EXISTS conversation_summaries_session_changed ON conversation_summaries;
+CREATE TRIGGER conversation_summaries_session_changed
+    AFTER INSERT OR UPDATE ON conversation_summaries
+    FOR EACH ROW EXECUTE FUNCTION notify_session_changed();
@@ -0,0 +1,81 @@
+"""
+Latency benchmark for app/executor.py result waiting modes.
+
+Start the fake service first, then compare the old fixed 0.5s polling with
+adaptive polling, long-poll, SSE and webhooks:
+
+    python scripts/fake_exec_service.py --port 8001 --job-ms 300 &
+    EXEC_API_BASE=http://localhost:8001 python scripts/bench_exec.py -n 50 -c 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Body  # noqa: E402
+
+from app import executor, metrics  # noqa: E402
+
+# Every mode submits the same payloads; measure the service round trip, not the result cache
+executor.EXEC_RESULT_CACHE_ENABLED = False
+
+callback_app = FastAPI()
+
+
+@callback_app.post("/api/ai/exec-callback")
+async def exec_callback(result: dict = Body(...)):
+    executor.resolve_callback(str(result["job_id"]), result)
+    return {"ok": True}
+
+
+async def run_mode(mode, n, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            start = time.perf_counter()
+            await executor.run_job("problem", {"userCode": f"print({i})", "solutionCode": "", "testCases": [{"id": 1, "input": ""}]}, mode=mode)
+            return (time.perf_counter() - start) * 1000
+
+    return await asyncio.gather(*(one(i) for i in range(n)))
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    print(f"{name:>10}: mean={statistics.mean(samples):.0f}ms p50={p(0.5):.0f}ms p95={p(0.95):.0f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--callback-port", type=int, default=4099)
+    args = parser.parse_args()
+
+    server = uvicorn.Server(uvicorn.Config(callback_app, port=args.callback_port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    executor.EXEC_CALLBACK_BASE = f"http://127.0.0.1:{args.callback_port}"
+
+    # The pre-existing behaviour: fixed 500ms polling interval
+    initial, factor = executor.EXEC_POLL_INITIAL_MS, executor.EXEC_POLL_FACTOR
+    executor.EXEC_POLL_INITIAL_MS, executor.EXEC_POLL_FACTOR = 500, 1
+    report("fixed-0.5s", await run_mode("poll", args.n, args.concurrency))
+    executor.EXEC_POLL_INITIAL_MS, executor.EXEC_POLL_FACTOR = initial, factor
+
+    for mode in ("poll", "longpoll", "sse", "webhook"):
+        report(mode, await run_mode(mode, args.n, args.concurrency))
+
+    print("polls per job:", metrics.snapshot()["summaries"].get("exec.polls"))
+    await executor.close_exec_client()
+    server.should_exit = True
+    await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Compares time-to-first-token of a fresh httpx.AsyncClient per call (the old
+behaviour) against the shared client used by app.llm.ask_llm_stream.
+
+Point OPENAI_URL at scripts/stub_llm_server.py (or any compatible endpoint):
+
+    OPENAI_URL=http://localhost:9000/v1/chat/completions python scripts/bench_llm_ttft.py -n 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+from app import llm, metrics  # noqa: E402
+
+
+async def ttft_fresh_client(prompt):
+    payload = {"model": llm.OPENAI_MODEL, "messages": [{"role": "user", "content": prompt}], "stream": True}
+    headers = {"Authorization": f"Bearer {llm.OPENAI_API_KEY}"}
+    start = time.perf_counter()
+    first = None
+    async with httpx.AsyncClient() as client:
+        async with client.stream("POST", llm.OPENAI_URL, headers=headers, json=payload, timeout=None) as response:
+            async for line in response.aiter_lines():
+                if first is None and line.startswith("data: ") and "content" in line:
+                    first = time.perf_counter() - start
+    return first
+
+
+async def ttft_shared_client(prompt):
+    start = time.perf_counter()
+    first = None
+    async for _ in llm.ask_llm_stream(prompt):
+        if first is None:
+            first = time.perf_counter() - start
+    return first
+
+
+async def run(fn, n, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            return await fn(f"benchmark prompt {i}")
+
+    results = await asyncio.gather(*(one(i) for i in range(n)))
+    return [r * 1000 for r in results if r is not None]
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    print(f"{name:>14}: n={len(samples)} mean={statistics.mean(samples):.1f}ms "
+          f"p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"Target: {llm.OPENAI_URL} (ask_llm_stream: {llm.model_for()}"
+          f"{f', fallback {llm.fallback_for()}' if llm.fallback_for() else ''})")
+    report("fresh client", await run(ttft_fresh_client, args.n, args.concurrency))
+    report("shared client", await run(ttft_shared_client, args.n, args.concurrency))
+    races = {k: v for k, v in metrics.snapshot()["counters"].items()
+             if k.startswith(("llm.hedged", "llm.fallback", "llm.race_won"))}
+    if races:
+        print("  " + "  ".join(f"{k}={v:.0f}" for k, v in sorted(races.items())))
+    await llm.close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
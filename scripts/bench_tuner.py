@@ -0,0 +1,92 @@
+"""
+Throughput and memory of the tuner backends.
+
+Compares GamifiedTunerAgent (dict of float-tuple states, pickled after every
+step) with VectorizedTunerAgent's `step` and batched `step_many`, on random
+user logs. Each run uses a fresh temporary directory, so no q_table files are
+touched:
+
+    python scripts/bench_tuner.py -n 20000 --batch 256
+"""
+import argparse
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.agents.gamified_tuner import GamifiedTunerAgent  # noqa: E402
+from app.agents.vectorized_tuner import StateEncoder, VectorizedTunerAgent  # noqa: E402
+
+
+def random_step(rng):
+    logs = {
+        "performance": rng.random(),
+        "time_taken": rng.random() * 2,
+        "engagement": rng.random(),
+        "difficulty": rng.randint(1, 5),
+        "proficiency": rng.random(),
+    }
+    metrics = {"gain": rng.choice([0.0, 1.0]), "cost": rng.random() * 0.2, "disengagement": rng.random() * 0.1}
+    return logs, metrics
+
+
+def run_dict(steps, save_every_step):
+    os.chdir(tempfile.mkdtemp(prefix="bench_tuner_"))
+    agent = GamifiedTunerAgent()
+    if not save_every_step:
+        agent.save_q_table = lambda *a, **k: None
+    tracemalloc.start()
+    start = time.perf_counter()
+    for logs, metrics in steps:
+        agent.step(dict(logs), metrics)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory, len(agent.q_table), len(pickle.dumps(dict(agent.q_table)))
+
+
+def run_vectorized(steps, batch, bins):
+    os.chdir(tempfile.mkdtemp(prefix="bench_tuner_"))
+    agent = VectorizedTunerAgent(encoder=StateEncoder(bins), seed=0)
+    start = time.perf_counter()
+    if batch <= 1:
+        for logs, metrics in steps:
+            agent.step(dict(logs), metrics)
+    else:
+        for i in range(0, len(steps), batch):
+            chunk = steps[i:i + batch]
+            agent.step_many([dict(logs) for logs, _ in chunk], [metrics for _, metrics in chunk])
+    elapsed = time.perf_counter() - start
+    return elapsed, agent.q.nbytes + agent.visits.nbytes, int((agent.visits > 0).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=256)
+    parser.add_argument("--bins", default="5")
+    parser.add_argument("--save-every-step", action="store_true",
+                        help="include the dict agent's per-step pickle, as in production")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    steps = [random_step(rng) for _ in range(args.n)]
+
+    elapsed, memory, states, pickled = run_dict(steps, args.save_every_step)
+    print(f"{'dict':>22}: {args.n / elapsed:>10,.0f} steps/s  table={memory / 1024:,.0f}KiB "
+          f"({states:,} states, pickle {pickled / 1024:,.0f}KiB)")
+    elapsed, memory, visited = run_vectorized(steps, 1, args.bins)
+    print(f"{'vectorized step':>22}: {args.n / elapsed:>10,.0f} steps/s  table={memory / 1024:,.0f}KiB "
+          f"({visited:,} cells visited)")
+    elapsed, memory, visited = run_vectorized(steps, args.batch, args.bins)
+    print(f"{f'step_many({args.batch})':>22}: {args.n / elapsed:>10,.0f} steps/s  table={memory / 1024:,.0f}KiB "
+          f"({visited:,} cells visited)")
+
+
+if __name__ == "__main__":
+    main()
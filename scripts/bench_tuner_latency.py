@@ -0,0 +1,113 @@
+"""
+tuner-step latency under concurrent load, per persistence strategy.
+
+Serves a copy of the /api/ai/tuner-step handler in process (httpx ASGI
+transport, one event loop like a uvicorn worker) and fires requests from
+--concurrency clients:
+
+- dict:       GamifiedTunerAgent, pickling the whole table after every step
+- vectorized: TunerService on the local state backend, as the service runs it
+  (TunerStore flushing shards and the transition log in the background)
+
+Latency includes time spent waiting for the event loop, so a synchronous save
+in one handler shows up in the tail of the others. Each run uses a fresh
+temporary directory:
+
+    python scripts/bench_tuner_latency.py -n 5000 --concurrency 32 --flush-every 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import Body, FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.agents.gamified_tuner import GamifiedTunerAgent  # noqa: E402
+from app.agents.vectorized_tuner import VectorizedTunerAgent  # noqa: E402
+from app.tuner_state import LocalTunerState, TunerService  # noqa: E402
+
+
+def random_body(rng):
+    # Raw floats, as clients send them; the dict table grows with every distinct state
+    logs = {
+        "performance": rng.random(),
+        "time_taken": rng.random() * 2,
+        "engagement": rng.random(),
+        "difficulty": rng.randint(1, 5),
+        "proficiency": rng.random(),
+    }
+    metrics = {"gain": rng.choice([0.0, 1.0]), "cost": rng.random() * 0.2, "disengagement": rng.random() * 0.1}
+    return {"logs": logs, "user_action_metrics": metrics, "user_id": str(rng.randrange(1000))}
+
+
+def build_app(agent, service):
+    app = FastAPI()
+
+    @app.post("/api/ai/tuner-step")
+    async def tuner_step(logs: dict = Body(...), user_action_metrics: dict = Body(...), user_id: str = Body(None)):
+        if service is not None:
+            action, updated_logs = await service.step(logs, user_action_metrics, user_id)
+        else:
+            action, updated_logs = agent.step(logs, user_action_metrics)
+        return {"action": action, "logs": updated_logs}
+
+    return app
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+async def run(backend, bodies, concurrency, flush_every):
+    os.chdir(tempfile.mkdtemp(prefix="bench_tuner_latency_"))
+    service = None
+    if backend == "dict":
+        agent = GamifiedTunerAgent()
+    else:
+        agent = VectorizedTunerAgent(seed=0)
+        service = TunerService(LocalTunerState(agent, flush_every=flush_every), agent)
+        await service.open()
+    transport = httpx.ASGITransport(app=build_app(agent, service))
+    latencies = []
+    pending = iter(bodies)
+
+    async def client(http):
+        for body in pending:
+            start = time.perf_counter()
+            response = await http.post("/api/ai/tuner-step", json=body)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    if service is not None:
+        await service.close()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--flush-every", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    bodies = [random_body(rng) for _ in range(args.n)]
+    for backend in ("dict", "vectorized"):
+        elapsed, latencies = asyncio.run(run(backend, bodies, args.concurrency, args.flush_every))
+        print(f"{backend:>10}: {args.n / elapsed:>8,.0f} req/s  p50={percentile(latencies, 50):.2f}ms  "
+              f"p99={percentile(latencies, 99):.2f}ms  max={max(latencies):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Builds the local vector index used when RETRIEVAL_BACKEND=local.
+
+Export every vector from the Pinecone index:
+
+    python scripts/export_pinecone_index.py -o catalog_index
+
+Or build offline from JSONL rows of {"id", "metadata", "values"} (or "text",
+which is embedded with the same model as suggest_next):
+
+    python scripts/export_pinecone_index.py --from-jsonl catalog.jsonl -o catalog_index
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.retrieval import LocalVectorIndex  # noqa: E402
+
+BATCH = 100
+
+
+def export_from_pinecone():
+    import pinecone
+
+    pc = pinecone.Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    index = pc.Index(os.getenv("PINECONE_INDEX", "gami-ai"))
+    all_ids = list(itertools.chain.from_iterable(index.list()))
+    ids, metadata, vectors = [], [], []
+    for start in range(0, len(all_ids), BATCH):
+        response = index.fetch(ids=all_ids[start:start + BATCH])
+        fetched = response.vectors if hasattr(response, "vectors") else response["vectors"]
+        for item_id, vector in fetched.items():
+            values = vector.values if hasattr(vector, "values") else vector["values"]
+            meta = vector.metadata if hasattr(vector, "metadata") else vector.get("metadata")
+            ids.append(item_id)
+            metadata.append(meta or {})
+            vectors.append(values)
+        print(f"Fetched {len(ids)}/{len(all_ids)}")
+    return ids, metadata, vectors
+
+
+def build_from_jsonl(path):
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    missing = [row for row in rows if "values" not in row]
+    if missing:
+        from app.embeddings import get_embedding_service, close_embedding_service
+
+        async def embed_all():
+            vectors = await get_embedding_service().embed_many([row["text"] for row in missing])
+            await close_embedding_service()
+            return vectors
+
+        for row, values in zip(missing, asyncio.run(embed_all())):
+            row["values"] = values
+    return [row["id"] for row in rows], [row.get("metadata", {}) for row in rows], [row["values"] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--from-jsonl", help="build from a JSONL file instead of Pinecone")
+    parser.add_argument("-o", "--output", default="catalog_index", help="path prefix for .npy/.json")
+    args = parser.parse_args()
+
+    ids, metadata, vectors = build_from_jsonl(args.from_jsonl) if args.from_jsonl else export_from_pinecone()
+    LocalVectorIndex.save(args.output, ids, metadata, vectors)
+    print(f"Wrote {len(ids)} vectors to {args.output}.npy / {args.output}.json")
+
+
+if __name__ == "__main__":
+    main()
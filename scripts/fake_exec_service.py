@@ -0,0 +1,122 @@
+"""
+Fake code execution service for tests and latency benchmarks.
+
+Implements the endpoints used by app/executor.py: job submission, plain and
+long-poll (`?wait=`) result polling, SSE result streams and webhook callbacks.
+Each job "runs" for --job-ms milliseconds.
+
+    python scripts/fake_exec_service.py --port 8001 --job-ms 300
+"""
+import argparse
+import asyncio
+import itertools
+import json
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Body
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+settings = {"job_ms": 300.0}
+jobs = {}  # job_id -> {"done": asyncio.Event, "result": dict}
+_ids = itertools.count(1)
+_background = set()
+
+
+async def _run(job_id, kind, payload):
+    await asyncio.sleep(settings["job_ms"] / 1000)
+    if kind == "problem":
+        result = {"status": "finished", "results": [
+            {"id": tc.get("id"), "input": tc.get("input"), "passed": True} for tc in payload.get("testCases", [])
+        ]}
+    else:
+        result = {"status": "finished", "output": "ok\n"}
+    jobs[job_id]["result"] = result
+    jobs[job_id]["done"].set()
+    if payload.get("callbackUrl"):
+        await _callback_client().post(payload["callbackUrl"], json=dict(result, job_id=job_id),
+                                      headers=payload.get("callbackHeaders") or {})
+
+
+_client = None
+
+
+def _callback_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient()
+    return _client
+
+
+def _submit(kind, payload):
+    job_id = str(next(_ids))
+    jobs[job_id] = {"done": asyncio.Event(), "result": {"status": "running"}}
+    task = asyncio.create_task(_run(job_id, kind, payload))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return {"job_id": job_id}
+
+
+async def _result(job_id, wait):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "failed", "error": "Unknown job"}
+    if wait:
+        try:
+            await asyncio.wait_for(job["done"].wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+    return job["result"]
+
+
+def _stream(job_id):
+    async def events():
+        job = jobs.get(job_id)
+        if job is None:
+            yield "data: " + json.dumps({"status": "failed", "error": "Unknown job"}) + "\n\n"
+            return
+        await job["done"].wait()
+        yield "data: " + json.dumps(job["result"]) + "\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/execute")
+async def execute(payload: dict = Body(...)):
+    return _submit("code", payload)
+
+
+@app.post("/execute-problem")
+async def execute_problem(payload: dict = Body(...)):
+    return _submit("problem", payload)
+
+
+@app.get("/result/{job_id}")
+async def result(job_id: str, wait: float = 0):
+    return await _result(job_id, wait)
+
+
+@app.get("/result-problem/{job_id}")
+async def result_problem(job_id: str, wait: float = 0):
+    return await _result(job_id, wait)
+
+
+@app.get("/result/{job_id}/stream")
+async def result_stream(job_id: str):
+    return _stream(job_id)
+
+
+@app.get("/result-problem/{job_id}/stream")
+async def result_problem_stream(job_id: str):
+    return _stream(job_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--job-ms", type=float, default=300.0)
+    args = parser.parse_args()
+    settings["job_ms"] = args.job_ms
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,73 @@
+"""
+Local stub of the OpenAI chat completions streaming API and Ollama's /api/chat,
+for benchmarks and for trying provider selection and hedging.
+
+    python scripts/stub_llm_server.py --port 9000 --first-token-ms 50
+    OPENAI_URL=http://localhost:9000/v1/chat/completions python scripts/bench_llm_ttft.py
+
+    # a slow remote model hedged with a fast local one
+    python scripts/stub_llm_server.py --port 9001 --first-token-ms 50
+    OPENAI_URL=http://localhost:9000/v1/chat/completions OLLAMA_URL=http://localhost:9001 \
+        LLM_FALLBACK_DEFAULT=ollama:stub LLM_HEDGE_MS=30 python scripts/bench_llm_ttft.py
+"""
+import argparse
+import asyncio
+import json
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+settings = {"first_token_ms": 50.0, "token_ms": 5.0, "tokens": 20}
+
+
+def _chunk(content):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]}) + "\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    await request.json()
+
+    async def stream():
+        await asyncio.sleep(settings["first_token_ms"] / 1000)
+        for i in range(settings["tokens"]):
+            if i:
+                await asyncio.sleep(settings["token_ms"] / 1000)
+            yield _chunk(f"tok{i} ")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/api/chat")
+async def ollama_chat(request: Request):
+    body = await request.json()
+
+    async def stream():
+        await asyncio.sleep(settings["first_token_ms"] / 1000)
+        for i in range(settings["tokens"]):
+            if i:
+                await asyncio.sleep(settings["token_ms"] / 1000)
+            yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": f"tok{i} "},
+                              "done": False}) + "\n"
+        yield json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": ""},
+                          "done": True}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--ssl-keyfile")
+    parser.add_argument("--ssl-certfile")
+    args = parser.parse_args()
+    settings.update(first_token_ms=args.first_token_ms, token_ms=args.token_ms, tokens=args.tokens)
+    uvicorn.run(app, host=args.host, port=args.port,
+                ssl_keyfile=args.ssl_keyfile, ssl_certfile=args.ssl_certfile, log_level="warning")
@@ -0,0 +1,101 @@
+"""
+Trains the linear intent model used by app.intent for local routing.
+
+Training data is JSONL with {"text": ..., "agent": ...} per line, or the
+router decisions already recorded in ai_assistance (user_query, suggestion_type):
+
+    python scripts/train_intent_model.py --data intents.jsonl -o intent_model.json
+    python scripts/train_intent_model.py --from-db -o intent_model.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.intent import AGENTS, extract_features  # noqa: E402
+
+
+def load_jsonl(path):
+    with open(path) as f:
+        return [(row["text"], row["agent"]) for row in map(json.loads, f) if row.get("agent") in AGENTS]
+
+
+async def load_from_db(limit):
+    from app.db import acquire, close_db_pool
+
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT user_query, suggestion_type
+            FROM ai_assistance
+            WHERE suggestion_type = ANY($1::text[]) AND user_query <> ''
+            ORDER BY date_time DESC
+            LIMIT $2
+            """,
+            list(AGENTS), limit,
+        )
+    await close_db_pool()
+    return [(row["user_query"], row["suggestion_type"]) for row in rows]
+
+
+def train(examples, epochs=20, lr=0.5, l2=1e-4, min_count=2, seed=0):
+    """Multinomial logistic regression over unigram+bigram features, trained with SGD."""
+    labels = list(AGENTS)
+    counts = Counter(f for text, _ in examples for f in extract_features(text))
+    vocab = {f for f, c in counts.items() if c >= min_count}
+    weights = {f: [0.0] * len(labels) for f in vocab}
+    bias = [0.0] * len(labels)
+    data = [([f for f in extract_features(text) if f in vocab], labels.index(agent)) for text, agent in examples]
+    rng = random.Random(seed)
+
+    for epoch in range(epochs):
+        rng.shuffle(data)
+        loss = 0.0
+        for features, y in data:
+            scores = list(bias)
+            for f in features:
+                for i, w in enumerate(weights[f]):
+                    scores[i] += w
+            top = max(scores)
+            exps = [math.exp(s - top) for s in scores]
+            total = sum(exps)
+            probs = [e / total for e in exps]
+            loss -= math.log(max(probs[y], 1e-12))
+            for i in range(len(labels)):
+                grad = probs[i] - (1.0 if i == y else 0.0)
+                bias[i] -= lr * grad
+                for f in features:
+                    weights[f][i] -= lr * (grad + l2 * weights[f][i])
+        print(f"epoch {epoch + 1}/{epochs} loss={loss / max(len(data), 1):.4f}")
+
+    return {"labels": labels, "bias": bias, "weights": weights}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--data", help="JSONL file of {text, agent}")
+    source.add_argument("--from-db", action="store_true", help="use routed queries from ai_assistance")
+    parser.add_argument("--limit", type=int, default=100000)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--lr", type=float, default=0.5)
+    parser.add_argument("--min-count", type=int, default=2)
+    parser.add_argument("-o", "--output", default="intent_model.json")
+    args = parser.parse_args()
+
+    examples = asyncio.run(load_from_db(args.limit)) if args.from_db else load_jsonl(args.data)
+    print(f"Training on {len(examples)} examples: {dict(Counter(agent for _, agent in examples))}")
+    model = train(examples, epochs=args.epochs, lr=args.lr, min_count=args.min_count)
+    with open(args.output, "w") as f:
+        json.dump(model, f)
+    print(f"Saved {len(model['weights'])} features to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
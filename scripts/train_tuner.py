@@ -0,0 +1,147 @@
+"""
+Offline experience-replay trainer for the tuner's Q-table.
+
+Replays the transitions logged by the service (app/transition_log.py) in
+shuffled, vectorized batches for several epochs, sweeping alpha/delta in a
+process pool. Each configuration is scored by mean squared TD error on a
+held-out split; the best one is retrained on all transitions and exported as
+<TUNER_STATE_DIR>/trained.npy, which running workers pick up within
+TUNER_RELOAD_SECONDS:
+
+    python scripts/train_tuner.py --epochs 5 --alpha 0.05,0.1,0.2 --delta 0.8,0.9
+
+With TUNER_COHORT_BY=request or user, each cohort logs to and loads from its
+own directory (TUNER_STATE_DIR/cohorts/<cohort>); train one with --cohort:
+
+    python scripts/train_tuner.py --cohort u3
+
+TD errors under different deltas measure different targets, so compare deltas
+with care; sweeping alpha at a fixed delta is the safer default.
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.agents.vectorized_tuner import TUNER_ACTIONS, StateEncoder, batch_update  # noqa: E402
+from app.transition_log import read_transitions  # noqa: E402
+from app.tuner_state import GLOBAL_COHORT, cohort_dir, transition_dir  # noqa: E402
+from app.tuner_store import write_table  # noqa: E402
+
+N_ACTIONS = len(TUNER_ACTIONS)
+
+_data = {}
+
+
+def _load_worker_data(paths):
+    # Encoded arrays are shared with workers as memory-mapped .npy files, not pickled per task
+    for name, path in paths.items():
+        _data[name] = np.load(path, mmap_mode="r")
+
+
+def train(n_states, indices, alpha, delta, epochs, batch_size, seed):
+    q = np.zeros((n_states, N_ACTIONS), dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    states, actions, rewards, next_states = (_data[k] for k in ("states", "actions", "rewards", "next_states"))
+    for _ in range(epochs):
+        order = indices[rng.permutation(len(indices))]
+        for start in range(0, len(order), batch_size):
+            batch = np.sort(order[start:start + batch_size])  # sorted reads are kinder to the memmap
+            batch_update(q, states[batch], actions[batch], rewards[batch], next_states[batch], alpha, delta)
+    return q
+
+
+def td_error(q, indices, delta):
+    s, a = _data["states"][indices], _data["actions"][indices]
+    targets = _data["rewards"][indices] + delta * q[_data["next_states"][indices]].max(axis=1)
+    return float(np.mean((targets - q[s, a]) ** 2))
+
+
+def evaluate(args):
+    n_states, train_idx, holdout_idx, alpha, delta, epochs, batch_size, seed = args
+    start = time.perf_counter()
+    q = train(n_states, train_idx, alpha, delta, epochs, batch_size, seed)
+    return alpha, delta, td_error(q, holdout_idx, delta), time.perf_counter() - start
+
+
+def floats(value):
+    return [float(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cohort", default=GLOBAL_COHORT)
+    parser.add_argument("--transitions", help="defaults to the cohort's transition log directory")
+    parser.add_argument("--bins", default=os.getenv("TUNER_STATE_BINS", "5"))
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--alpha", type=floats, default=[0.05, 0.1, 0.2])
+    parser.add_argument("--delta", type=floats, default=[0.9])
+    parser.add_argument("--holdout", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--export", help="defaults to trained.npy in the cohort's state directory")
+    parser.add_argument("--no-export", action="store_true")
+    args = parser.parse_args()
+    args.transitions = args.transitions or transition_dir(args.cohort)
+    args.export = args.export or os.path.join(cohort_dir(args.cohort), "trained.npy")
+
+    records = read_transitions(args.transitions)
+    records = records[records["action"] < N_ACTIONS]
+    if len(records) == 0:
+        sys.exit(f"No transitions in {args.transitions}")
+    encoder = StateEncoder(args.bins)
+    rng = np.random.default_rng(args.seed)
+    print(f"{len(records):,} transitions, {encoder.n_states:,} states", flush=True)
+
+    with tempfile.TemporaryDirectory(prefix="train_tuner_") as tmp:
+        arrays = {
+            "states": encoder.encode_many(records["state"]),
+            "actions": records["action"].astype(np.int64),
+            "rewards": records["reward"].astype(np.float64),
+            "next_states": encoder.encode_many(records["next_state"]),
+        }
+        paths = {}
+        for name, array in arrays.items():
+            paths[name] = os.path.join(tmp, f"{name}.npy")
+            np.save(paths[name], array)
+        _load_worker_data(paths)
+
+        order = rng.permutation(len(records))
+        n_holdout = int(len(order) * args.holdout)
+        holdout_idx, train_idx = order[:n_holdout], order[n_holdout:]
+        grid = list(itertools.product(args.alpha, args.delta))
+        best = None
+        if n_holdout and len(grid) > 1:
+            jobs = [(encoder.n_states, train_idx, holdout_idx, alpha, delta, args.epochs, args.batch_size, args.seed)
+                    for alpha, delta in grid]
+            with ProcessPoolExecutor(args.workers, initializer=_load_worker_data, initargs=(paths,)) as pool:
+                for alpha, delta, error, elapsed in pool.map(evaluate, jobs):
+                    print(f"alpha={alpha:<6} delta={delta:<6} held-out TD error={error:.5f}  ({elapsed:.1f}s)",
+                          flush=True)
+                    if best is None or error < best[2]:
+                        best = (alpha, delta, error)
+            alpha, delta = best[:2]
+        else:
+            alpha, delta = grid[0]
+
+        all_idx = np.arange(len(records))
+        q = train(encoder.n_states, all_idx, alpha, delta, args.epochs, args.batch_size, args.seed)
+        visits = np.bincount(arrays["states"], minlength=encoder.n_states).astype(np.float64)
+        print(f"Trained with alpha={alpha} delta={delta}; {int((visits > 0).sum()):,} states visited", flush=True)
+
+    if not args.no_export:
+        os.makedirs(os.path.dirname(args.export) or ".", exist_ok=True)
+        write_table(args.export, q, visits)
+        print(f"Exported {args.export}", flush=True)
+
+
+if __name__ == "__main__":
+    main()